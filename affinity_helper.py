@@ -0,0 +1,80 @@
+# affinity_helper.py
+import os
+import cv2
+
+
+STAGES = ('capture', 'detect', 'output')
+
+
+def parse_cores(text):
+    """'0', '1-3' or '0,2' -> [0], [1, 2, 3], [0, 2]."""
+    cores = []
+    for part in text.split(','):
+        first, _, last = part.partition('-')
+        cores.extend(range(int(first), int(last or first) + 1))
+    return cores
+
+
+class CpuLayout:
+    """
+    Cores of the pipeline stages and the thread budget of OpenCV.
+
+    - capture: the camera threads (libcamera, Picamera2), and the capture process of --processes
+    - detect: the detection loop with the warp and the matching, the Multi-ROI thread
+      pool and the worker threads of OpenCV, cv_threads of them
+    - output: the event logger and the sink threads
+
+    A thread starts on the cores of the thread that creates it, so each stage is
+    entered before its threads are started: enter('capture') before the camera is
+    started, enter('output') before the sinks are created, enter('detect') before the
+    detection loop. A stage without cores keeps the cores it inherits.
+    """
+    def __init__(self, capture=None, detect=None, output=None, cv_threads=None):
+        self.cores = {'capture': capture, 'detect': detect, 'output': output}
+        self.cv_threads = cv_threads
+        available = os.cpu_count() or 1
+        for stage, cores in self.cores.items():
+            if cores is not None and (not cores or any(core < 0 or core >= available for core in cores)):
+                raise ValueError(f"Cores of {stage} must be between 0 and {available - 1}: {cores}")
+
+    @classmethod
+    def parse(cls, spec):
+        """
+        Build a layout from 'stage=cores' items, e.g. 'capture=0 detect=1-3 output=0 threads=3'.
+        spec is a string or a list of items, as given to --cpu-layout.
+        """
+        items = spec.split() if isinstance(spec, str) else spec
+        options = {}
+        for item in items:
+            name, _, value = item.partition('=')
+            if name == 'threads':
+                options['cv_threads'] = int(value)
+            elif name in STAGES:
+                options[name] = parse_cores(value)
+            else:
+                raise ValueError(f"Unknown stage: {name} (stages: {', '.join(STAGES)}, threads)")
+        return cls(**options)
+
+    def __str__(self):
+        items = [f"{stage}={','.join(map(str, cores))}" for stage, cores in self.cores.items() if cores is not None]
+        if self.cv_threads is not None:
+            items.append(f"threads={self.cv_threads}")
+        return ' '.join(items) or 'unpinned'
+
+    def pin(self, stage, thread_id=0):
+        """Move a thread (native id, 0 for the calling one) to the cores of a stage."""
+        cores = self.cores[stage]
+        if cores is not None and hasattr(os, 'sched_setaffinity'):  # Linux only
+            os.sched_setaffinity(thread_id, cores)
+
+    def enter(self, stage):
+        """Move the calling thread to a stage, the threads it starts from now on follow it."""
+        self.pin(stage)
+        if stage == 'detect' and self.cv_threads is not None:
+            # OpenCV (re)starts its workers from this thread when the budget changes
+            cv2.setNumThreads(self.cv_threads)
+
+    def pin_thread(self, thread, stage):
+        """Move a running threading.Thread to the cores of a stage."""
+        if thread is not None and thread.native_id is not None:
+            self.pin(stage, thread.native_id)
@@ -0,0 +1,681 @@
+# benchmark.py
+"""
+Benchmarks of the detection pipeline, run on the frames stored in a parameter folder.
+
+Usage:
+    python benchmark.py incremental --folder parameters_support/high_res_para
+    python benchmark.py gradient --folder parameters_support/high_res_para parameters_support/medium_res
+    python benchmark.py buffers --folder parameters_support/high_res_para
+    python benchmark.py dual --folder parameters_support/high_res_para --lores 1536x864
+    python benchmark.py cascade --folder parameters_support/high_res_para
+    python benchmark.py resolution --folder parameters_support/high_res_para --px-per-mm 1.5 1.0 0.75
+    python benchmark.py ring --folder parameters_support/high_res_para --readers 1 2
+    python benchmark.py affinity --folder parameters_support/high_res_para parameters_support/medium_res
+    python benchmark.py realtime --folder parameters_support/medium_res --frames 2000
+    python benchmark.py preview --folder parameters_support/medium_res --frames 300
+    python benchmark.py trajectory --records 5000000
+"""
+import argparse
+import gc
+import multiprocessing
+import os
+import queue
+import threading
+import time
+import tracemalloc
+import urllib.request
+import cv2
+import numpy as np
+from detect_helper import DetectProcessor, ReplayCamera, DualFrame
+from ring_helper import FrameRing, RingCamera
+from affinity_helper import CpuLayout
+from realtime_helper import RealtimeMode
+from log_helper import EventLogger
+from preview_helper import PreviewServer, BOUNDARY
+from trajectory_helper import TrajectoryWriter, read_trajectories, read_trajectory, trajectory_segments
+from matcher_helper import non_max_suppression, DetectionResult, IncrementalMatcher, GradientMatcher, CascadeMatcher, planted_targets
+
+
+def load_rectified_gray(folder):
+    """Load the parameters of a folder and return the detector and its rectified gray p1.jpg."""
+    detector = DetectProcessor()
+    detector.load_parameters(folder)
+    image = cv2.imread(f"{folder}/p1.jpg")
+    gray = cv2.cvtColor(detector.imgcorr(image), cv2.COLOR_BGR2GRAY)
+    return detector, gray
+
+
+def changed_frames(gray, fraction, frames, tile_size, seed=0):
+    """Yield frames in which `fraction` of the tiles are brightened compared with `gray`."""
+    rng = np.random.default_rng(seed)
+    rows = -(-gray.shape[0] // tile_size)
+    cols = -(-gray.shape[1] // tile_size)
+    count = int(round(fraction * rows * cols))
+    for i in range(frames):
+        frame = gray.copy()
+        for index in rng.choice(rows * cols, size=count, replace=False):
+            y, x = (index // cols) * tile_size, (index % cols) * tile_size
+            tile = frame[y:y + tile_size, x:x + tile_size]
+            cv2.add(tile, 20 + 20 * (i % 2), dst=tile)  # Alternate so consecutive frames differ
+        yield frame
+
+
+def bench_incremental(args):
+    """Compare the incremental response map with the full recomputation at several motion levels."""
+    detector, gray = load_rectified_gray(args.folder)
+    template_gray = detector.template_gray
+    print(f"Rectified ROI {gray.shape[1]}x{gray.shape[0]}, template {template_gray.shape[1]}x{template_gray.shape[0]}, "
+          f"tile {args.tile}")
+    # A level brightens that fraction of the tiles per frame, but the tiles of the previous frame
+    # change back as well, so the rows are labelled with what the matcher actually saw: the
+    # tiles that differ from its reference, and the share of the response positions (search
+    # windows) it evaluated
+    print("level\tchanged tiles\tsearched\tfull(ms)\tincremental(ms)\tspeedup\tmax_error")
+    for fraction in args.levels:
+        frames = list(changed_frames(gray, fraction, args.frames, args.tile))
+        matcher = IncrementalMatcher(template_gray, tile_size=args.tile)
+        matcher.full(gray)
+        full_times, incremental_times, changed, searched, error = [], [], [], [], 0.0
+        for frame in frames:
+            start = time.perf_counter()
+            expected = cv2.matchTemplate(frame, template_gray, cv2.TM_CCOEFF_NORMED)
+            full_times.append(time.perf_counter() - start)
+            changed.append(float(matcher.changed_tiles(frame).mean()))
+            start = time.perf_counter()
+            response = matcher.match(frame)
+            incremental_times.append(time.perf_counter() - start)
+            searched.append(matcher.stats['recomputed_fraction'])
+            error = max(error, float(np.abs(response - expected).max()))
+        full_ms = np.mean(full_times) * 1000
+        incremental_ms = np.mean(incremental_times) * 1000
+        print(f"{fraction:.0%}\t{np.mean(changed):.1%}\t{np.mean(searched):.1%}\t{full_ms:.2f}\t{incremental_ms:.2f}\t"
+              f"{full_ms / incremental_ms:.2f}x\t{error:.2e}")
+
+
+def template_path_hits(gray, template_gray, threshold):
+    """The matching of process_image: TM_CCOEFF_NORMED, threshold and non-max suppression."""
+    h, w = template_gray.shape
+    res = cv2.matchTemplate(gray, template_gray, cv2.TM_CCOEFF_NORMED)
+    loc = np.where(res >= threshold)
+    boxes = non_max_suppression([[pt[0], pt[1], pt[0] + w, pt[1] + h] for pt in zip(*loc[::-1])])
+    return [(int(x1 + x2) // 2, int(y1 + y2) // 2) for x1, y1, x2, y2 in boxes]
+
+
+def lighting_variants(gray):
+    """The stored frame under a few lighting changes: (name, image)."""
+    yield "stored", gray
+    yield "darker x0.5", cv2.convertScaleAbs(gray, alpha=0.5)
+    yield "brighter x1.2", cv2.convertScaleAbs(gray, alpha=1.2, beta=-30)
+    yield "flat +60", cv2.convertScaleAbs(gray, alpha=0.7, beta=60)
+    # Uneven lighting: a horizontal gradient from 0.5 to 1.0
+    ramp = np.linspace(0.5, 1.0, gray.shape[1], dtype=np.float32)
+    yield "uneven", cv2.convertScaleAbs(gray.astype(np.float32) * ramp)
+
+
+def count_planted(hits, centers, tolerance=3):
+    """Return (found, missed, other): planted centres with a hit within tolerance pixels, without one, and the other hits."""
+    found = sum(any(abs(x - cx) <= tolerance and abs(y - cy) <= tolerance for x, y in hits) for cx, cy in centers)
+    other = sum(not any(abs(x - cx) <= tolerance and abs(y - cy) <= tolerance for cx, cy in centers) for x, y in hits)
+    return found, len(centers) - found, other
+
+
+def bench_gradient(args):
+    """
+    Compare the gradient orientation matcher with the template matching of process_image
+    on the frame with the template planted at 3 places, under each lighting change.
+    """
+    for folder in args.folder:
+        detector, gray = load_rectified_gray(folder)
+        template_gray = detector.template_gray
+        gradient = GradientMatcher(template_gray, threshold=detector.threshold)
+        print(f"{folder}: ROI {gray.shape[1]}x{gray.shape[0]}, template {template_gray.shape[1]}x{template_gray.shape[0]}, "
+              f"{len(gradient.features)} gradient features, spread {gradient.spread}")
+        print("lighting\ttemplate(ms)\tfound\tmissed\tother\tgradient(ms)\tfound\tmissed\tother")
+        planted = list(planted_targets(gray, template_gray))
+        for index, (name, _) in enumerate(lighting_variants(gray)):
+            template_times, gradient_times = [], []
+            template_counts, gradient_counts = np.zeros(3, dtype=int), np.zeros(3, dtype=int)
+            for image, center in planted:
+                # The lighting changes the planted target like the rest of the frame
+                frame = list(lighting_variants(image))[index][1]
+                for _ in range(args.frames):
+                    start = time.perf_counter()
+                    template_hits = template_path_hits(frame, template_gray, detector.threshold)
+                    template_times.append(time.perf_counter() - start)
+                    start = time.perf_counter()
+                    gradient_hits = [hit[1] for hit in gradient.match(frame)]
+                    gradient_times.append(time.perf_counter() - start)
+                template_counts += count_planted(template_hits, [center])
+                gradient_counts += count_planted(gradient_hits, [center])
+            print(f"{name}\t{np.mean(template_times) * 1000:.2f}\t" + "\t".join(map(str, template_counts)) +
+                  f"\t{np.mean(gradient_times) * 1000:.2f}\t" + "\t".join(map(str, gradient_counts)))
+
+
+def traced_stage(stats, name, function, *args, **kwargs):
+    """Run one stage and add the memory it allocated (tracemalloc peak growth) to stats[name]."""
+    before = tracemalloc.get_traced_memory()[0]
+    tracemalloc.reset_peak()
+    value = function(*args, **kwargs)
+    grown = tracemalloc.get_traced_memory()[1] - before
+    bytes_allocated, count = stats.get(name, (0, 0))
+    # Stages either reuse their buffer or allocate at least one frame sized array
+    stats[name] = (bytes_allocated + grown, count + (1 if grown >= 4096 else 0))
+    return value
+
+
+def traced_frame(detector, camera, stats):
+    """Run the stages of one processed frame the way process_frame does, with tracemalloc accounting."""
+    buffers = detector.buffers
+    image = traced_stage(stats, "capture", detector.capture, camera)
+    warped = traced_stage(stats, "warp", detector.imgcorr, image, None if buffers is None else buffers.warped)
+    gray = traced_stage(stats, "gray", cv2.cvtColor, warped, cv2.COLOR_BGR2GRAY,
+                        dst=None if buffers is None else buffers.gray)
+    res = traced_stage(stats, "match", detector.matcher.response, gray, None if buffers is None else buffers.response)
+    detections = traced_stage(stats, "locate", detector.matcher.locate, res, None if buffers is None else buffers.mask)
+    for detection in detections:
+        detection.center_mm = detector.to_mm(*detection.center_px)
+    result = DetectionResult(detections, warped)
+    traced_stage(stats, "display", detector.draw_result, result, None if buffers is None else buffers.display)
+
+
+def bench_buffers(args):
+    """Allocation counts, bytes and time per frame with and without the preallocated buffers."""
+    camera = ReplayCamera([f"{args.folder}/p1.jpg"])
+    print(f"{args.folder}: frame {camera.modes['replay']['size'][0]}x{camera.modes['replay']['size'][1]}")
+    for preallocate in (False, True):
+        detector = DetectProcessor(motion_gate=False, engine='template', preallocate=preallocate)
+        detector.start_session(args.folder, camera)
+        detector.process_frame(detector.capture(camera))  # Warm up
+
+        # Time the real loop first, tracemalloc slows every allocation down
+        times = []
+        for _ in range(args.frames):
+            start = time.perf_counter()
+            detector.process_frame(detector.capture(camera))
+            times.append(time.perf_counter() - start)
+
+        stats = {}
+        tracemalloc.start()
+        for _ in range(args.frames):
+            traced_frame(detector, camera, stats)
+        tracemalloc.stop()
+
+        label = "preallocated" if preallocate else "allocating"
+        if detector.buffers is not None:
+            label += f" ({detector.buffers.nbytes / 1e6:.1f} MB of buffers)"
+        print(f"{label}: {np.mean(times) * 1000:.2f} ms/frame (std {np.std(times) * 1000:.2f} ms)")
+        print("  stage\tallocations/frame\tMB/frame")
+        for name, (bytes_allocated, count) in stats.items():
+            print(f"  {name}\t{count / args.frames:.1f}\t{bytes_allocated / args.frames / 1e6:.2f}")
+        total_bytes = sum(value[0] for value in stats.values())
+        total_count = sum(value[1] for value in stats.values())
+        print(f"  total\t{total_count / args.frames:.1f}\t{total_bytes / args.frames / 1e6:.2f}")
+
+
+def bench_dual(args):
+    """Compare the full resolution detection with the lores coarse pass plus main stream windows."""
+    image_path = f"{args.folder}/p1.jpg"
+    lores_size = tuple(int(value) for value in args.lores.lower().split('x'))
+    print(f"{args.folder}: lores {lores_size[0]}x{lores_size[1]}")
+    print("path	ms/frame	detections")
+    for label, camera in (("full", ReplayCamera([image_path])), ("dual", ReplayCamera([image_path], lores_size=lores_size))):
+        detector = DetectProcessor(motion_gate=False)
+        detector.start_session(args.folder, camera)
+        times = []
+        for _ in range(args.frames):
+            start = time.perf_counter()
+            frame = detector.capture(camera)
+            result, _ = detector.process_frame(frame)
+            if isinstance(frame, DualFrame):
+                frame.release()
+            times.append(time.perf_counter() - start)
+        centers = [detection.center_mm for detection in result.detections]
+        print(f"{label}\t{np.mean(times) * 1000:.2f}\t{centers}")
+
+
+def plain_background(gray, seed=0):
+    """A featureless frame of the same size: uniform gray with a little sensor noise."""
+    rng = np.random.default_rng(seed)
+    noise = rng.integers(0, 6, size=gray.shape, dtype=np.uint8)
+    return cv2.GaussianBlur(cv2.add(np.full_like(gray, int(gray.mean())), noise), (3, 3), 0)
+
+
+def bench_cascade(args):
+    """Compare the cascade matcher with the full response map, with the per-stage rejection rates."""
+    for folder in args.folder:
+        detector, gray = load_rectified_gray(folder)
+        template_gray = detector.template_gray
+        cascade = CascadeMatcher(template_gray, threshold=detector.threshold, sparse_pixels=args.sparse,
+                                 margin=args.margin)
+        print(f"{folder}: ROI {gray.shape[1]}x{gray.shape[0]}, template {template_gray.shape[1]}x{template_gray.shape[0]}, "
+              f"{len(cascade.offsets)} sparse pixels, margin {args.margin}")
+        print("frame\ttemplate(ms)\thits\tcascade(ms)\thits\tstage1\tstage2\tstage3\tmax_error")
+        scenes = list(lighting_variants(gray)) + [("plain", plain_background(gray))]
+        for name, frame in scenes:
+            image, _ = next(planted_targets(frame, template_gray, count=1))
+            template_times, cascade_times = [], []
+            for _ in range(args.frames):
+                start = time.perf_counter()
+                expected = cv2.matchTemplate(image, template_gray, cv2.TM_CCOEFF_NORMED)
+                template_times.append(time.perf_counter() - start)
+                start = time.perf_counter()
+                response = cascade.match(image)
+                cascade_times.append(time.perf_counter() - start)
+            rates = cascade.rejection_rates(cascade.stats)
+            evaluated = response > -1
+            error = float(np.abs(response - expected)[evaluated].max()) if evaluated.any() else 0.0
+            print(f"{name}\t{np.mean(template_times) * 1000:.2f}\t{int(np.count_nonzero(expected >= detector.threshold))}\t"
+                  f"{np.mean(cascade_times) * 1000:.2f}\t{int(np.count_nonzero(response >= detector.threshold))}\t"
+                  f"{rates['stage1']:.2%}\t{rates['stage2']:.2%}\t{rates['stage3']:.2%}\t{error:.1e}")
+
+
+def planted_frame(detector, image, count=3):
+    """Paste the template at `count` places of the rectified ROI of a raw frame. Return the frame and the centres in mm."""
+    h, w = detector.template_gray.shape
+    rectified = detector.imgcorr(image)
+    patches = np.zeros(rectified.shape[:2], dtype=np.uint8)
+    centers = []
+    for _, (x, y) in planted_targets(rectified[:, :, 0], detector.template_gray, count):
+        x1, y1 = x - w // 2, y - h // 2
+        rectified[y1:y1 + h, x1:x1 + w] = cv2.cvtColor(detector.template_gray, cv2.COLOR_GRAY2BGR)
+        patches[y1:y1 + h, x1:x1 + w] = 255
+        centers.append(detector.to_mm(x, y))
+    # Warp the pasted patches back into the camera frame
+    size = (image.shape[1], image.shape[0])
+    back = cv2.warpPerspective(rectified, detector.transform, size, flags=cv2.WARP_INVERSE_MAP | cv2.INTER_LINEAR)
+    mask = cv2.warpPerspective(patches, detector.transform, size, flags=cv2.WARP_INVERSE_MAP | cv2.INTER_NEAREST)
+    frame = image.copy()
+    frame[mask > 0] = back[mask > 0]
+    return frame, centers
+
+
+def bench_resolution(args):
+    """Detection time and accuracy of the working resolutions, on a frame with planted targets."""
+    reference = DetectProcessor()
+    reference.load_parameters(args.folder)
+    image, expected = planted_frame(reference, cv2.imread(f"{args.folder}/p1.jpg"))
+    print(f"{args.folder}: real size {reference.real_size[0]}x{reference.real_size[1]} mm, "
+          f"{len(expected)} planted targets")
+    print("px/mm\twarp size\ttemplate\twarp(ms)\tmatch(ms)\tfound\tmax_error(mm)")
+    for px_per_mm in [None] + args.px_per_mm:
+        detector = DetectProcessor(px_per_mm=px_per_mm)
+        detector.load_parameters(args.folder)
+        warp_times, match_times = [], []
+        for _ in range(args.frames):
+            result = detector.detect(image)
+            warp_times.append(result.timings['warp'])
+            match_times.append(result.timings['match'])
+        errors = []
+        for x_mm, y_mm in expected:
+            distances = [np.hypot(d.center_mm[0] - x_mm, d.center_mm[1] - y_mm) for d in result.detections]
+            if distances and min(distances) <= args.tolerance:
+                errors.append(min(distances))
+        label = "full" if px_per_mm is None else f"{px_per_mm:g}"
+        template_height, template_width = detector.template_gray.shape
+        print(f"{label}\t{detector.warp_size[0]}x{detector.warp_size[1]}\t{template_width}x{template_height}\t"
+              f"{np.mean(warp_times) * 1000:.2f}\t{np.mean(match_times) * 1000:.2f}\t{len(errors)}/{len(expected)}\t"
+              f"{max(errors) if errors else float('nan'):.2f}")
+
+
+def replay_frames(folder, duration, fps, publish):
+    """Replay p1.jpg of a folder for `duration` seconds, calling publish(camera) fps times per second (0: at once)."""
+    camera = ReplayCamera([f"{folder}/p1.jpg"])
+    deadline = time.monotonic() + duration
+    next_frame = time.monotonic()
+    while time.monotonic() < deadline:
+        publish(camera)
+        if fps:
+            next_frame += 1.0 / fps
+            time.sleep(max(0.0, next_frame - time.monotonic()))
+
+
+def ring_writer(name, folder, duration, fps):
+    """Capture process of the ring benchmark."""
+    ring = FrameRing.attach(name)
+    replay_frames(folder, duration, fps, ring.publish)
+    ring.close()
+
+
+def queue_writer(queues, folder, duration, fps):
+    """Capture process of the Queue baseline: every reader gets a pickled copy, dropped when its queue is full."""
+    def publish(camera):
+        image = camera.capture_image()
+        for frames in queues:
+            try:
+                frames.put_nowait((image, camera.frame_info.capture_ns))
+            except queue.Full:
+                pass
+    replay_frames(folder, duration, fps, publish)
+    for frames in queues:
+        frames.cancel_join_thread()  # The readers are gone, do not wait for the pending frames to be sent
+
+
+def ring_reader(name, folder, duration, results):
+    """Detector process of the ring benchmark: detect on the slot views and check them afterwards."""
+    camera = RingCamera(name)
+    detector = DetectProcessor(headless=True, motion_gate=False)
+    detector.start_session(folder, camera)
+    frames, torn, handoff = 0, 0, []
+    deadline = time.monotonic() + duration
+    while time.monotonic() < deadline:
+        image = camera.capture_image()  # The writer runs past the deadline, there is always a next frame
+        handoff.append((time.monotonic_ns() - camera.frame_info.capture_ns) / 1e6)
+        result, _ = detector.process_frame(image, None, camera.frame_info)
+        frames += 1
+        torn += result is None
+    image = None
+    detector.buffers = detector.last_result = None
+    camera.stop()
+    results.put({'frames': frames, 'skipped': camera.skipped, 'torn': torn, 'handoff': handoff})
+
+
+def queue_reader(frames_queue, folder, duration, results):
+    """Detector process of the Queue baseline."""
+    detector = DetectProcessor(headless=True, motion_gate=False)
+    detector.load_parameters(folder)
+    frames, handoff = 0, []
+    deadline = time.monotonic() + duration
+    while time.monotonic() < deadline:
+        try:
+            image, capture_ns = frames_queue.get(timeout=1.0)
+        except queue.Empty:
+            break
+        handoff.append((time.monotonic_ns() - capture_ns) / 1e6)
+        detector.detect(image)
+        frames += 1
+    results.put({'frames': frames, 'skipped': None, 'torn': 0, 'handoff': handoff})
+
+
+def bench_ring(args):
+    """Frames delivered to N detector processes through the shared memory ring vs a multiprocessing.Queue."""
+    height, width = cv2.imread(f"{args.folder}/p1.jpg").shape[:2]
+    print(f"{args.folder}: {width}x{height} frames ({height * width * 3 / 1e6:.1f} MB), {args.slots} slots, "
+          f"{args.duration:g} s per run, capture at {args.fps or 'max'} fps")
+    print("transport	readers	fps/reader	skipped	torn	handoff p50(ms)	handoff p99(ms)")
+    context = multiprocessing.get_context('spawn')
+    for readers in args.readers:
+        for transport in ('ring', 'queue'):
+            results = context.Queue()
+            if transport == 'ring':
+                ring = FrameRing.create(f"bench_ring_{readers}", (height, width, 3), args.slots)
+                writer = context.Process(target=ring_writer, args=(ring.shm.name, args.folder, args.duration + 1.0, args.fps))
+                processes = [context.Process(target=ring_reader, args=(ring.shm.name, args.folder, args.duration, results))
+                             for _ in range(readers)]
+            else:
+                ring = None
+                queues = [context.Queue(maxsize=args.slots - 1) for _ in range(readers)]
+                writer = context.Process(target=queue_writer, args=(queues, args.folder, args.duration + 1.0, args.fps))
+                processes = [context.Process(target=queue_reader, args=(frames, args.folder, args.duration, results))
+                             for frames in queues]
+            for process in processes + [writer]:
+                process.start()
+            stats = [results.get() for _ in processes]
+            for process in processes + [writer]:
+                process.join()
+            if ring is not None:
+                ring.close()
+            handoff = np.concatenate([np.asarray(s['handoff'], dtype=np.float64) for s in stats])
+            fps = np.mean([s['frames'] for s in stats]) / args.duration
+            skipped = '-' if stats[0]['skipped'] is None else sum(s['skipped'] for s in stats)
+            print(f"{transport}\t{readers}\t{fps:.1f}\t{skipped}\t{sum(s['torn'] for s in stats)}\t"
+                  f"{np.percentile(handoff, 50):.2f}\t{np.percentile(handoff, 99):.2f}")
+
+
+def candidate_layouts(cores):
+    """The layouts tried by the affinity benchmark on a list of cores."""
+    layouts = [CpuLayout()]  # Unpinned, OpenCV's default thread count
+    layouts += [CpuLayout(cv_threads=threads) for threads in range(1, len(cores) + 1)]
+    if len(cores) > 1:
+        # The camera and the outputs share one core, the detection gets the others
+        for threads in range(1, len(cores)):
+            layouts.append(CpuLayout(capture=cores[:1], detect=cores[1:], output=cores[:1], cv_threads=threads))
+    if len(cores) > 2:
+        # Also a core of its own for the camera
+        layouts.append(CpuLayout(capture=cores[:1], detect=cores[2:], output=cores[1:2], cv_threads=len(cores) - 2))
+    return layouts
+
+
+def replay_capture(camera, fps, running):
+    """Stand-in for the camera threads: capture a frame fps times per second into a scratch buffer."""
+    buffer = np.empty_like(camera.frames[0])
+    next_frame = time.monotonic()
+    while running.is_set():
+        camera.capture_into(buffer)
+        next_frame += 1.0 / fps
+        time.sleep(max(0.0, next_frame - time.monotonic()))
+
+
+def bench_affinity(args):
+    """Per-frame detection time and its spread for the candidate core layouts, and the best one per folder."""
+    cores = sorted(os.sched_getaffinity(0))
+    default_threads = cv2.getNumThreads()
+    print(f"cores {','.join(map(str, cores))}, OpenCV {default_threads} threads by default, "
+          f"camera replayed at {args.fps:g} fps")
+    for folder in args.folder:
+        camera = ReplayCamera([f"{folder}/p1.jpg"])
+        image = camera.frames[0].copy()
+        print(f"{folder}: frame {image.shape[1]}x{image.shape[0]}")
+        print("layout\tmean(ms)\tp90(ms)\tmax(ms)\tspread(%)")
+        results = []
+        for layout in candidate_layouts(cores):
+            # Every run starts from the unpinned main thread
+            os.sched_setaffinity(0, cores)
+            cv2.setNumThreads(default_threads)
+            layout.enter('capture')
+            running = threading.Event()
+            running.set()
+            capture = threading.Thread(target=replay_capture, args=(camera, args.fps, running), daemon=True)
+            capture.start()
+            layout.enter('detect')
+            detector = DetectProcessor(motion_gate=False, headless=True)
+            detector.start_session(folder, camera)
+            detector.process_frame(image)  # Warm up
+            times = []
+            for _ in range(args.frames):
+                start = time.perf_counter()
+                detector.process_frame(image)
+                times.append((time.perf_counter() - start) * 1000)
+            running.clear()
+            capture.join()
+            times = np.asarray(times)
+            results.append((np.percentile(times, 90), str(layout)))
+            print(f"{layout}\t{times.mean():.2f}\t{np.percentile(times, 90):.2f}\t{times.max():.2f}\t"
+                  f"{times.std() / times.mean() * 100:.1f}")
+        p90, best = min(results)
+        print(f"best layout (lowest p90): {best}, {p90:.2f} ms")
+    os.sched_setaffinity(0, cores)
+    cv2.setNumThreads(default_threads)
+
+
+def bench_realtime(args):
+    """Tail of the frame times of the detection loop, in the normal and in the real-time mode."""
+    camera = ReplayCamera([f"{args.folder}/p1.jpg"])
+    print(f"{args.folder}: frame {camera.modes['replay']['size'][0]}x{camera.modes['replay']['size'][1]}, "
+          f"{args.frames} frames, per-frame events on")
+    print("mode\tmean(ms)\tp50(ms)\tp99(ms)\tp99.9(ms)\tmax(ms)\tgc gen2 runs")
+    for realtime in (False, True):
+        detector = DetectProcessor(motion_gate=False, headless=True)
+        detector.start_session(args.folder, camera)
+        # The events allocate a dict per frame, as in a session with log_frames
+        logger = EventLogger(console=False, frame_events=True, frame_sample=1)
+        logger.start()
+        detector.process_frame(detector.capture(camera))  # Warm up
+        mode = RealtimeMode() if realtime else None
+        if mode is not None:
+            mode.enter(detector.buffers.arrays, logger)
+        full_collections = gc.get_stats()[2]['collections']
+        times = []
+        for _ in range(args.frames):
+            start = time.perf_counter()
+            detector.process_frame(detector.capture(camera), logger, camera.frame_info)
+            times.append((time.perf_counter() - start) * 1000)
+            if mode is not None:
+                mode.checkpoint()
+        full_collections = gc.get_stats()[2]['collections'] - full_collections
+        if mode is not None:
+            print(f"  enabled: {', '.join(mode.enabled)}")
+            mode.exit(logger)
+        logger.stop()
+        times = np.asarray(times)
+        p50, p99, p999 = np.percentile(times, [50, 99, 99.9])
+        print(f"{'realtime' if realtime else 'normal'}\t{times.mean():.2f}\t{p50:.2f}\t{p99:.2f}\t{p999:.2f}\t"
+              f"{times.max():.2f}\t{full_collections}")
+
+
+def read_stream(url, counts, running):
+    """Client of the preview: count the JPEG parts of an MJPEG stream until running is cleared."""
+    with urllib.request.urlopen(url, timeout=5) as response:
+        while running.is_set():
+            line = response.readline()
+            if not line:
+                return
+            if line.strip() == b'--' + BOUNDARY:
+                counts['frames'] += 1
+
+
+def bench_preview(args):
+    """Cost of the MJPEG preview per frame: without it, without a client, and with a client on localhost."""
+    camera = ReplayCamera([f"{args.folder}/p1.jpg"])
+    print(f"{args.folder}: {args.frames} frames, preview capped at {args.fps} fps, {args.width} px wide")
+    print("setup\tmean(ms)\tp99(ms)\tframes received")
+    for setup in ('headless', 'preview, no client', 'preview, 1 client'):
+        detector = DetectProcessor(motion_gate=False, headless=True)
+        detector.start_session(args.folder, camera)
+        preview = None
+        counts = {'frames': 0}
+        running = threading.Event()
+        client = None
+        if setup != 'headless':
+            preview = PreviewServer(0, max_fps=args.fps, width=args.width)  # Any free port
+            preview.start()
+            detector.preview = preview
+        if setup == 'preview, 1 client':
+            running.set()
+            client = threading.Thread(target=read_stream, daemon=True,
+                                      args=(f"http://localhost:{preview.port}/stream/{detector.name}.mjpg",
+                                            counts, running))
+            client.start()
+            while not preview.watching:
+                time.sleep(0.01)
+        times = []
+        for _ in range(args.frames):
+            start = time.perf_counter()
+            result, display_image = detector.process_frame(detector.capture(camera))
+            if display_image is not None:
+                detector.show(display_image)
+            times.append((time.perf_counter() - start) * 1000)
+        if preview is not None:
+            preview.stop()  # Ends the stream of the client
+        running.clear()
+        if client is not None:
+            client.join(5)
+        times = np.asarray(times)
+        print(f"{setup}\t{times.mean():.2f}\t{np.percentile(times, 99):.2f}\t"
+              f"{counts['frames'] if client is not None else '-'}")
+
+
+def bench_trajectory(args):
+    """Cost of logging a position to the trajectory log, and time to open and scan the log."""
+    path = f"{args.path}/bench_trajectory.traj"
+    for segment in trajectory_segments(path):
+        os.remove(segment)
+    writer = TrajectoryWriter(path, max_bytes=args.segment_mb * 1024 * 1024, max_queue=args.records + 1)
+    writer.start()
+    start = time.perf_counter()
+    for sequence in range(args.records):
+        writer.add(sequence * 70000000, sequence, (812.5, 640.25), (463.2, 368.9), 0.97, 0, 'medium_res')
+    add_us = (time.perf_counter() - start) / args.records * 1e6
+    writer.stop()
+    segments = trajectory_segments(path)
+    megabytes = sum(os.path.getsize(segment) for segment in segments) / 1e6
+    print(f"{args.records} records, {len(segments)} segments, {megabytes:.1f} MB, add: {add_us:.2f} us/record, "
+          f"{writer.dropped} dropped")
+    start = time.perf_counter()
+    records, _ = read_trajectory(segments[0])
+    print(f"map first segment: {(time.perf_counter() - start) * 1000:.2f} ms ({len(records)} records)")
+    start = time.perf_counter()
+    records = read_trajectories(path)
+    speed = np.hypot(np.diff(records['x_mm']), np.diff(records['y_mm'])) / np.diff(records['t_ns']) * 1e9
+    print(f"read all and compute speeds: {(time.perf_counter() - start) * 1000:.1f} ms "
+          f"({len(records)} records, mean {speed.mean():.1f} mm/s)")
+    del records
+    for segment in segments:
+        os.remove(segment)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Detection pipeline benchmarks")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    incremental = subparsers.add_parser("incremental", help="Tile-level incremental correlation vs full recomputation")
+    incremental.add_argument("--folder", default="parameters_support/high_res_para")
+    incremental.add_argument("--frames", type=int, default=20)
+    incremental.add_argument("--tile", type=int, default=64)
+    incremental.add_argument("--levels", type=float, nargs='+', default=[0.0, 0.01, 0.05, 0.2, 0.5, 1.0],
+                             help="Fractions of tiles changed per frame")
+    incremental.set_defaults(func=bench_incremental)
+
+    gradient = subparsers.add_parser("gradient", help="Gradient orientation matcher vs the template matching path")
+    gradient.add_argument("--folder", nargs='+', default=["parameters_support/high_res_para", "parameters_support/medium_res"])
+    gradient.add_argument("--frames", type=int, default=5)
+    gradient.set_defaults(func=bench_gradient)
+
+    buffers = subparsers.add_parser("buffers", help="Allocations per frame with and without preallocated buffers")
+    buffers.add_argument("--folder", default="parameters_support/high_res_para")
+    buffers.add_argument("--frames", type=int, default=10)
+    buffers.set_defaults(func=bench_buffers)
+
+    dual = subparsers.add_parser("dual", help="Lores coarse pass + main stream windows vs full resolution")
+    dual.add_argument("--folder", default="parameters_support/high_res_para")
+    dual.add_argument("--lores", default="1536x864", help="Size of the lores stream, e.g. 1536x864")
+    dual.add_argument("--frames", type=int, default=10)
+    dual.set_defaults(func=bench_dual)
+
+    cascade = subparsers.add_parser("cascade", help="Cascade early rejection vs the full response map")
+    cascade.add_argument("--folder", nargs='+', default=["parameters_support/high_res_para", "parameters_support/medium_res"])
+    cascade.add_argument("--frames", type=int, default=5)
+    cascade.add_argument("--sparse", type=int, default=32, help="Template pixels of the sparse test")
+    cascade.add_argument("--margin", type=float, default=0.3, help="Sparse test threshold below the matching threshold")
+    cascade.set_defaults(func=bench_cascade)
+
+    resolution = subparsers.add_parser("resolution", help="Working resolutions (px/mm) vs the full rectified resolution")
+    resolution.add_argument("--folder", default="parameters_support/high_res_para")
+    resolution.add_argument("--px-per-mm", dest="px_per_mm", type=float, nargs='+', default=[1.5, 1.0, 0.75, 0.5])
+    resolution.add_argument("--frames", type=int, default=5)
+    resolution.add_argument("--tolerance", type=float, default=3.0, help="Allowed centre error in mm")
+    resolution.set_defaults(func=bench_resolution)
+
+    ring = subparsers.add_parser("ring", help="Shared memory frame ring vs multiprocessing.Queue between processes")
+    ring.add_argument("--folder", default="parameters_support/high_res_para")
+    ring.add_argument("--readers", type=int, nargs='+', default=[1, 2], help="Detector processes per run")
+    ring.add_argument("--slots", type=int, default=4)
+    ring.add_argument("--fps", type=float, default=14.35, help="Capture rate, 0 for as fast as possible")
+    ring.add_argument("--duration", type=float, default=5.0, help="Seconds per run")
+    ring.set_defaults(func=bench_ring)
+
+    affinity = subparsers.add_parser("affinity", help="Core layouts and OpenCV thread counts of the pipeline stages")
+    affinity.add_argument("--folder", nargs='+', default=["parameters_support/high_res_para", "parameters_support/medium_res"])
+    affinity.add_argument("--frames", type=int, default=30)
+    affinity.add_argument("--fps", type=float, default=14.35, help="Frame rate of the replayed camera")
+    affinity.set_defaults(func=bench_affinity)
+
+    realtime = subparsers.add_parser("realtime", help="p99/p99.9 frame times with and without the real-time mode")
+    realtime.add_argument("--folder", default="parameters_support/medium_res")
+    realtime.add_argument("--frames", type=int, default=2000)
+    realtime.set_defaults(func=bench_realtime)
+
+    preview = subparsers.add_parser("preview", help="Frame times without the MJPEG preview, without and with a client")
+    preview.add_argument("--folder", default="parameters_support/medium_res")
+    preview.add_argument("--frames", type=int, default=300)
+    preview.add_argument("--fps", type=float, default=5.0, help="Frame rate cap of the preview")
+    preview.add_argument("--width", type=int, default=640, help="Width of the preview frames")
+    preview.set_defaults(func=bench_preview)
+
+    trajectory = subparsers.add_parser("trajectory", help="Write and memory-map a binary trajectory log")
+    trajectory.add_argument("--records", type=int, default=5000000)
+    trajectory.add_argument("--segment-mb", dest='segment_mb', type=int, default=256, help="Size of a segment")
+    trajectory.add_argument("--path", default="/tmp", help="Folder of the temporary log")
+    trajectory.set_defaults(func=bench_trajectory)
+
+    args = parser.parse_args()
+    args.func(args)
@@ -0,0 +1,220 @@
+# calibration_helper.py
+"""
+Camera calibration: produces calibration_results.txt and a cache of undistortion maps.
+
+Usage:
+    python calibration_helper.py --images calibration_images --pattern 9x6 --square 25
+    python calibration_helper.py --images calibration_images --board charuco --pattern 7x5 --square 30 --marker 22
+"""
+import argparse
+import glob
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+import cv2
+import numpy as np
+
+
+def load_calibration_params(file_path='calibration_results.txt'):
+    """Load the intrinsic matrix and the distortion coefficients from a file."""
+    with open(file_path, 'r') as f:
+        lines = f.readlines()
+    intrinsic_matrix = np.array([[float(val) for val in lines[1].split()],
+                                 [float(val) for val in lines[2].split()],
+                                 [float(val) for val in lines[3].split()]])
+    distortion_coeffs = np.array([float(val) for val in lines[6:11]])
+    return intrinsic_matrix, distortion_coeffs
+
+
+def save_calibration_params(file_path, intrinsic_matrix, distortion_coeffs):
+    """Save the intrinsic matrix and the distortion coefficients in the format of load_calibration_params."""
+    with open(file_path, 'w') as f:
+        f.write("Intrinsic Matrix:\n")
+        for row in intrinsic_matrix:
+            f.write(' '.join(f"{val:.5f}" for val in row) + "\n")
+        f.write("\nDistortion Coefficients:\n")
+        for val in np.ravel(distortion_coeffs)[:5]:
+            f.write(f"{val:.5f}\n")
+
+
+def save_undistort_maps(file_path, intrinsic_matrix, distortion_coeffs, image_size):
+    """Precompute the remap tables of cv2.undistort for one image size and store them."""
+    map1, map2 = cv2.initUndistortRectifyMap(intrinsic_matrix, distortion_coeffs, None, intrinsic_matrix,
+                                             image_size, cv2.CV_16SC2)
+    np.savez(file_path, map1=map1, map2=map2, size=np.array(image_size), intrinsic=intrinsic_matrix,
+             distortion=distortion_coeffs)
+
+
+def load_undistort_maps(file_path, image_size):
+    """Return the cached (map1, map2) for image_size, or None when the cache does not match."""
+    if not os.path.exists(file_path):
+        return None
+    cache = np.load(file_path)
+    if tuple(cache['size']) != tuple(image_size):
+        return None
+    return cache['map1'], cache['map2']
+
+
+def create_charuco_board(pattern_size, square_size, marker_size, dictionary=None):
+    """Create a ChArUco board with the API of the installed OpenCV version."""
+    if marker_size is None:
+        raise ValueError("The marker size is needed for a ChArUco board")
+    aruco_dict = cv2.aruco.getPredefinedDictionary(cv2.aruco.DICT_5X5_100 if dictionary is None else dictionary)
+    if hasattr(cv2.aruco, 'CharucoBoard_create'):  # OpenCV < 4.7
+        return cv2.aruco.CharucoBoard_create(pattern_size[0], pattern_size[1], square_size, marker_size, aruco_dict)
+    return cv2.aruco.CharucoBoard(pattern_size, square_size, marker_size, aruco_dict)
+
+
+def find_corners(path, pattern_size, square_size, board='chessboard', marker_size=None, detect_width=1000):
+    """
+    Find the calibration corners of one image, run in a worker process.
+
+    The board is searched in a copy shrunk to detect_width pixels, which is much faster
+    on the full sensor resolution, and the corners are then refined with sub-pixel
+    accuracy on the original image.
+
+    Returns (path, image_points, object_points, image_size), with None points when the
+    board was not found.
+    """
+    gray = cv2.imread(path, cv2.IMREAD_GRAYSCALE)
+    if gray is None:
+        return path, None, None, None
+    image_size = (gray.shape[1], gray.shape[0])
+    criteria = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 30, 0.001)
+
+    if board == 'charuco':
+        charuco = create_charuco_board(pattern_size, square_size, marker_size)
+        if hasattr(cv2.aruco, 'CharucoDetector'):
+            corners, ids, _, _ = cv2.aruco.CharucoDetector(charuco).detectBoard(gray)
+        else:
+            marker_corners, marker_ids, _ = cv2.aruco.detectMarkers(gray, charuco.dictionary)
+            if marker_ids is None:
+                return path, None, None, image_size
+            _, corners, ids = cv2.aruco.interpolateCornersCharuco(marker_corners, marker_ids, gray, charuco)
+        if ids is None or len(ids) < 6:
+            return path, None, None, image_size
+        chessboard = charuco.getChessboardCorners() if hasattr(charuco, 'getChessboardCorners') else charuco.chessboardCorners
+        object_points = np.array(chessboard, dtype=np.float32)[ids.ravel()]
+        return path, corners.reshape(-1, 1, 2).astype(np.float32), object_points, image_size
+
+    scale = min(1.0, detect_width / float(gray.shape[1]))
+    small = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA) if scale < 1.0 else gray
+    flags = cv2.CALIB_CB_ADAPTIVE_THRESH + cv2.CALIB_CB_NORMALIZE_IMAGE + cv2.CALIB_CB_FAST_CHECK
+    found, corners = cv2.findChessboardCorners(small, pattern_size, flags)
+    if not found:
+        return path, None, None, image_size
+    corners = corners / scale
+    # The search window covers the error of the shrunk detection
+    window = max(5, int(round(1.5 / scale)))
+    corners = cv2.cornerSubPix(gray, corners.reshape(-1, 1, 2).astype(np.float32), (window, window), (-1, -1), criteria)
+    object_points = np.zeros((pattern_size[0] * pattern_size[1], 3), np.float32)
+    object_points[:, :2] = np.mgrid[0:pattern_size[0], 0:pattern_size[1]].T.reshape(-1, 2) * square_size
+    return path, corners, object_points, image_size
+
+
+def limit_worker_threads():
+    """Each worker process uses one OpenCV thread, the pool provides the parallelism."""
+    cv2.setNumThreads(1)
+
+
+def calibrate(paths, pattern_size=(9, 6), square_size=25.0, board='chessboard', marker_size=None, workers=None):
+    """
+    Detect the corners of all images in a process pool and solve the camera intrinsics.
+
+    Returns a dict with the intrinsic matrix, the distortion coefficients, the RMS
+    reprojection error, the error per image and the image size.
+    """
+    start_time = time.time()
+    worker = partial(find_corners, pattern_size=pattern_size, square_size=square_size, board=board,
+                     marker_size=marker_size)
+    with ProcessPoolExecutor(max_workers=workers, initializer=limit_worker_threads) as executor:
+        results = list(executor.map(worker, paths, chunksize=max(1, len(paths) // (4 * (workers or os.cpu_count())))))
+    detect_time = time.time() - start_time
+
+    used = [r for r in results if r[1] is not None]
+    if len(used) < 3:
+        raise ValueError(f"The calibration board was found in {len(used)} of {len(paths)} images, at least 3 are needed")
+    image_size = used[0][3]
+    if any(r[3] != image_size for r in used):
+        raise ValueError("All calibration images must have the same size")
+
+    image_points = [r[1] for r in used]
+    object_points = [r[2] for r in used]
+    rms, intrinsic_matrix, distortion_coeffs, rvecs, tvecs = cv2.calibrateCamera(
+        object_points, image_points, image_size, None, None)
+
+    per_image = {}
+    for (path, corners, points, _), rvec, tvec in zip(used, rvecs, tvecs):
+        projected, _ = cv2.projectPoints(points, rvec, tvec, intrinsic_matrix, distortion_coeffs)
+        residual = projected.reshape(-1, 2) - corners.reshape(-1, 2)
+        per_image[path] = float(np.sqrt(np.mean(np.sum(residual ** 2, axis=1))))
+    return {
+        'intrinsic_matrix': intrinsic_matrix,
+        'distortion_coeffs': distortion_coeffs.ravel(),
+        'rms': rms,
+        'per_image_error': per_image,
+        'image_size': image_size,
+        'rejected': [r[0] for r in results if r[1] is None],
+        'detect_time': detect_time,
+        'total_time': time.time() - start_time,
+    }
+
+
+def print_report(result):
+    """Print the reprojection errors of a calibration."""
+    print(f"Board found in {len(result['per_image_error'])} images, rejected {len(result['rejected'])}")
+    for path in result['rejected']:
+        print(f"  rejected: {path}")
+    for path, error in sorted(result['per_image_error'].items(), key=lambda item: -item[1]):
+        print(f"  {error:.3f} px  {path}")
+    print(f"RMS reprojection error: {result['rms']:.4f} px")
+    print(f"Corner detection {result['detect_time']:.2f} s, total {result['total_time']:.2f} s")
+    print("Intrinsic Matrix:\n", result['intrinsic_matrix'])
+    print("Distortion Coefficients:\n", result['distortion_coeffs'])
+
+
+def capture_calibration_images(camera, folder, count):
+    """Capture calibration images with the camera, waiting for Enter between shots."""
+    os.makedirs(folder, exist_ok=True)
+    for i in range(count):
+        input(f"Move the board and press Enter to capture image {i + 1}/{count}...")
+        filename = f"{folder}/calib_{i:03d}.jpg"
+        camera.capture_file(filename)
+        print(f"Captured {filename}")
+
+
+def run_calibration(folder, pattern_size, square_size, board='chessboard', marker_size=None, workers=None,
+                    output='calibration_results.txt', maps_output='calibration_maps.npz'):
+    """Calibrate from all images of a folder, print the report and write both outputs."""
+    paths = sorted(glob.glob(f"{folder}/*.jpg") + glob.glob(f"{folder}/*.png"))
+    if not paths:
+        raise ValueError(f"No calibration images in {folder}")
+    result = calibrate(paths, pattern_size, square_size, board, marker_size, workers)
+    print_report(result)
+    save_calibration_params(output, result['intrinsic_matrix'], result['distortion_coeffs'])
+    save_undistort_maps(maps_output, result['intrinsic_matrix'], result['distortion_coeffs'], result['image_size'])
+    print(f"{output} and {maps_output} saved")
+    return result
+
+
+def parse_pattern(text):
+    """Parse a board size such as '9x6' (inner corners for a chessboard, squares for ChArUco)."""
+    columns, rows = text.lower().split('x')
+    return int(columns), int(rows)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Calibrate the camera from checkerboard or ChArUco images")
+    parser.add_argument("--images", default="calibration_images", help="Folder with the calibration images")
+    parser.add_argument("--board", choices=['chessboard', 'charuco'], default='chessboard')
+    parser.add_argument("--pattern", type=parse_pattern, default=(9, 6),
+                        help="Inner corners of the chessboard, or squares of the ChArUco board, e.g. 9x6")
+    parser.add_argument("--square", type=float, default=25.0, help="Square size in mm")
+    parser.add_argument("--marker", type=float, default=None, help="ChArUco marker size in mm")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: one per core)")
+    parser.add_argument("--output", default="calibration_results.txt")
+    parser.add_argument("--maps", default="calibration_maps.npz")
+    args = parser.parse_args()
+    run_calibration(args.images, args.pattern, args.square, args.board, args.marker, args.workers,
+                    args.output, args.maps)
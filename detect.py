@@ -1,8 +1,24 @@
 # detect.py
+"""
+Interactive menu, or with arguments a detection started without prompts, e.g.
+    python detect.py --mode medium_res --folder medium_res --matcher template --sink csv:positions.csv --headless
+    python detect.py --config detect.json
+"""
+import argparse
+import json
+import multiprocessing
+import signal
+import sys
 import cv2
 import numpy as np
-from detect_helper import CameraProcessor, DetectProcessor
+from detect_helper import CameraProcessor, DetectProcessor, MultiDetectProcessor
 from parameters_helper import parameter_adjusting
+from calibration_helper import capture_calibration_images, parse_pattern, run_calibration
+from profile_helper import PROFILERS
+from matcher_helper import MATCHERS
+from sink_helper import SINKS, create_sink
+from ring_helper import FrameRing, capture_to_ring, detect_from_ring
+from affinity_helper import CpuLayout
 import os
 
 def change_parameters_folder():
@@ -19,12 +35,231 @@ def change_parameters_folder():
     os.makedirs(f"parameters_support/{parameter_folder}", exist_ok=True)
     return "parameters_support/" + parameter_folder
 
+def choose_parameters_folders():
+    """Ask for several existing parameter folders, one per ROI."""
+    print("The existing parameter folder:")
+    for item in os.listdir("parameters_support"):
+        print(item)
+    names = input("Type the folder names to detect in, separated by commas: ")
+    folders = []
+    for name in names.split(','):
+        name = name.strip()
+        if not name:
+            continue
+        if not os.path.isdir(f"parameters_support/{name}"):
+            print(f"Folder {name} does not exist, skipped")
+            continue
+        folders.append(f"parameters_support/{name}")
+    return folders
+
+def add_crop_mode(camera_processor, parameter_folder):
+    """Offer a camera mode cropped to the ROI of the parameter folder, when its parameters are set."""
+    if not os.path.exists(f"{parameter_folder}/points.txt") or not os.path.exists(f"{parameter_folder}/p1.jpg"):
+        return
+    # The ROI corners refer to the mode p1.jpg was captured in
+    height, width = cv2.imread(f"{parameter_folder}/p1.jpg").shape[:2]
+    base_names = [name for name, config in camera_processor.modes.items()
+                  if 'crop' not in config and 'lores' not in config and config['size'] == (width, height)]
+    if not base_names:
+        return
+    roi = DetectProcessor()
+    roi.load_points_from_file(f"{parameter_folder}/points.txt")
+    name = camera_processor.add_crop_mode(base_names[0], roi.roi_bounding_box())
+    print(f"Camera mode {name} crops to the ROI: {camera_processor.modes[name]['size']}")
+
+def calibrate_camera(camera_processor):
+    """Capture or reuse chessboard images and write calibration_results.txt."""
+    try:
+        folder = input("Folder of the calibration images (default calibration_images): ").strip() or "calibration_images"
+        count = int(input("Number of new images to capture (0 to use the existing ones): ").strip() or 0)
+        if count > 0:
+            capture_calibration_images(camera_processor.camera, folder, count)
+        pattern = parse_pattern(input("Inner corners of the chessboard (default 9x6): ").strip() or "9x6")
+        square = float(input("Square size in mm (default 25): ").strip() or 25)
+        run_calibration(folder, pattern, square)
+    except ValueError as e:
+        print(f"Calibration failed: {e}")
+    except KeyboardInterrupt:
+        print("\nKeyboardInterrupt")
+
+def config_defaults(parser, config):
+    """
+    Map the keys of a config file to the destinations of the parser's options. A key is
+    an option name without the dashes, e.g. "memory-cap" (or "memory_cap") for --memory-cap,
+    whose destination is memory_cap_mb. Unknown keys are an error.
+    """
+    destinations = {}
+    for action in parser._actions:
+        if action.dest in ('help', 'config'):
+            continue
+        for option in action.option_strings:
+            if option.startswith('--'):
+                destinations[option[2:]] = action.dest
+                destinations[option[2:].replace('-', '_')] = action.dest
+    unknown = sorted(key for key in config if key not in destinations)
+    if unknown:
+        parser.error(f"Unknown option(s) in the config file: {', '.join(unknown)} "
+                     f"(known: {', '.join(sorted(key for key in destinations if '_' not in key))})")
+    return {destinations[key]: value for key, value in config.items()}
+
+def parse_args(argv=None):
+    """Options of the scripted launch. A --config JSON file gives defaults, the command line overrides them."""
+    parser = argparse.ArgumentParser(description="Start the detection without prompts. "
+                                                 "Without arguments the interactive menu is shown.")
+    parser.add_argument("--config", help="JSON file with the options below as keys, e.g. {\"mode\": \"medium_res\"}")
+    parser.add_argument("--mode", help="Camera mode, e.g. high_res, medium_res, low_res, high_res_dual or <mode>_crop")
+    parser.add_argument("--folder", nargs='+', help="Parameter folder(s), several folders run the Multi-ROI detection")
+    parser.add_argument("--matcher", help=f"Matcher name ({', '.join(sorted(MATCHERS))}), default matcher.txt or template")
+    parser.add_argument("--sink", action='append', help=f"Output ({', '.join(sorted(SINKS))}), with an argument "
+                                                        "as name:argument, e.g. csv:positions.csv. Repeatable")
+    parser.add_argument("--headless", action='store_true', help="No drawing and no display window")
+    parser.add_argument("--profile", choices=PROFILERS, help="Profile the detection session")
+    parser.add_argument("--memory-cap", dest='memory_cap_mb', type=float,
+                        help="Soft memory cap in MB: sizes the queues and stops the per-frame events when exceeded, "
+                             "it does not bound the RSS")
+    parser.add_argument("--px-per-mm", dest='px_per_mm', type=float,
+                        help="Working resolution of the rectified ROI, default the full resolution of the camera mode")
+    parser.add_argument("--drift-check", dest='drift_interval', type=int,
+                        help="Check the corner markers every N frames and correct the ROI when the camera moved")
+    parser.add_argument("--processes", action='store_true',
+                        help="Capture in this process and detect in one process per folder, sharing the frames in memory")
+    parser.add_argument("--cpu-layout", dest='cpu_layout', nargs='+',
+                        help="Cores of the pipeline stages and the OpenCV threads, e.g. capture=0 detect=1-3 output=0 threads=3")
+    parser.add_argument("--realtime", action='store_true',
+                        help="No garbage collection pauses, locked memory and a real-time priority where permitted")
+    parser.add_argument("--preview", type=int, metavar='PORT',
+                        help="Serve the annotated frames as MJPEG on http://localhost:PORT/ instead of a window")
+    parser.add_argument("--metrics", metavar='PORT|FILE',
+                        help="Export fps, detection and latency metrics on http://localhost:PORT/metrics or to a file")
+    args = parser.parse_args(argv)
+    if args.config:
+        # --sink appends to its default, sinks on the command line replace those of the config instead
+        command_line_sinks = args.sink
+        with open(args.config, 'r') as file:
+            config = json.load(file)
+        parser.set_defaults(**config_defaults(parser, config))
+        args = parser.parse_args(argv)
+        if command_line_sinks:
+            args.sink = command_line_sinks
+    if isinstance(args.folder, str):
+        args.folder = [args.folder]
+    if isinstance(args.sink, str):
+        args.sink = [args.sink]
+    if not args.mode or not args.folder:
+        parser.error("--mode and --folder are needed (on the command line or in the config file)")
+    return args
+
+def resolve_folder(name):
+    """Accept 'medium_res' as well as 'parameters_support/medium_res'."""
+    if not os.path.isdir(name) and os.path.isdir(f"parameters_support/{name}"):
+        return f"parameters_support/{name}"
+    return name
+
+def stop_on_sigterm(signum, frame):
+    """A service stop ends the detection like Ctrl+C, so the logs and reports are written."""
+    raise KeyboardInterrupt
+
+def run_processes(camera_processor, folders, options, sink_specs):
+    """
+    Capture in this process into a shared memory FrameRing and detect in one process per
+    parameter folder, so the matching never holds the GIL of the capture loop.
+    """
+    mode_name = list(camera_processor.modes)[camera_processor.current_mode]
+    if 'lores' in camera_processor.modes[mode_name]:
+        raise SystemExit("--processes needs a single stream camera mode")
+    width, height = camera_processor.modes[mode_name]['size']
+    ring = FrameRing.create(f"frames_{os.getpid()}", (height, width, 3))
+    context = multiprocessing.get_context('spawn')  # No forked copy of the camera in the detectors
+    detectors = []
+    for index, folder in enumerate(folders):
+        folder_options = dict(options)
+        if options.get('preview_port') is not None:
+            # One preview server per process, on consecutive ports
+            folder_options['preview_port'] = options['preview_port'] + index
+        metrics_output = options.get('metrics_output')
+        if metrics_output is not None:
+            # One registry per process: consecutive ports, or one file per folder
+            if str(metrics_output).isdigit():
+                folder_options['metrics_output'] = int(metrics_output) + index
+            else:
+                root, extension = os.path.splitext(metrics_output)
+                folder_options['metrics_output'] = f"{root}_{os.path.basename(folder)}{extension}"
+        # The mode dict carries the crop offset of a crop mode to the detector
+        detectors.append(context.Process(target=detect_from_ring,
+                                         args=(ring.shm.name, folder, folder_options, sink_specs,
+                                               mode_name, camera_processor.modes[mode_name]),
+                                         name=f"detect_{os.path.basename(folder)}"))
+    for detector in detectors:
+        detector.start()
+    try:
+        frames = capture_to_ring(camera_processor, ring)
+        print(f"{frames} frames captured")
+    finally:
+        for detector in detectors:
+            detector.terminate()
+        for detector in detectors:
+            detector.join()
+        ring.close()
+
+def run_detection(args):
+    """Configure the camera and run the detection until Ctrl+C or SIGTERM, without prompts."""
+    folders = [resolve_folder(folder) for folder in args.folder]
+    for folder in folders:
+        if not os.path.exists(f"{folder}/points.txt"):
+            raise SystemExit(f"{folder} has no parameters, set them in the interactive menu first")
+    try:
+        layout = CpuLayout.parse(args.cpu_layout) if args.cpu_layout else None
+    except ValueError as e:
+        raise SystemExit(f"Invalid --cpu-layout: {e}")
+    if layout is not None:
+        layout.enter('capture')  # The camera threads start on the capture cores
+    camera_processor = CameraProcessor()
+    if args.mode.endswith('_crop'):
+        add_crop_mode(camera_processor, folders[0])
+    if args.mode not in camera_processor.modes:
+        raise SystemExit(f"Unknown camera mode {args.mode}, available: {', '.join(camera_processor.modes)}")
+    if 'lores' in camera_processor.modes[args.mode] and args.matcher not in (None, 'template'):
+        raise SystemExit(f"The dual-stream mode {args.mode} only matches with the template matcher")
+    camera_processor.configure_camera_mode(list(camera_processor.modes).index(args.mode))
+    options = dict(engine=args.matcher, headless=args.headless, profile=args.profile, memory_cap_mb=args.memory_cap_mb,
+                   px_per_mm=args.px_per_mm, drift_interval=args.drift_interval, cpu_layout=layout,
+                   realtime=args.realtime, preview_port=args.preview,
+                   metrics_output=args.metrics)
+    signal.signal(signal.SIGTERM, stop_on_sigterm)
+    if args.processes:
+        try:
+            run_processes(camera_processor, folders, options, args.sink or [])
+        finally:
+            camera_processor.stop()
+        return
+    if layout is not None:
+        layout.enter('output')
+    sinks = [create_sink(spec) for spec in args.sink or []]
+    try:
+        if len(folders) == 1:
+            detecter = DetectProcessor(**options)
+            detecter.sinks = sinks
+            detecter.process_image(folders[0], camera_processor)
+        else:
+            multi = MultiDetectProcessor(**options)
+            multi.sinks.extend(sinks)
+            multi.process_image(folders, camera_processor)
+    finally:
+        for sink in sinks:
+            sink.close()
+        camera_processor.stop()
+
 # Main entry point of the script
 if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        run_detection(parse_args())
+        sys.exit(0)
+
     # Initialize the camera processor to manage camera input
     camera_processor = CameraProcessor()
     camera_processor.start()
     parameter_folder = change_parameters_folder() #Determin the folder will be used to hold the parameters
+    add_crop_mode(camera_processor, parameter_folder)
     
     # Create an instance of parameter_adjusting to manage adjustable parameters
     parameter = parameter_adjusting(parameter_folder)
@@ -35,7 +270,7 @@ if __name__ == "__main__":
         end = False
         while end == False:
             # Display a menu for the user to select a mode
-            mode = input("Choose mode: (1) Start Detection (2) Adjust Parameters (3) Modify Camera mode\n(4) Change parameter folder (0) Exit: ")
+            mode = input("Choose mode: (1) Start Detection (2) Adjust Parameters (3) Modify Camera mode\n(4) Change parameter folder (5) Calibrate camera (6) Multi-ROI detection (7) Toggle profiling (0) Exit: ")
             if mode == '1':
                 # Start the detection process with predefined files and the camera processor
                 detecter.process_image(parameter_folder, camera_processor)
@@ -43,15 +278,32 @@ if __name__ == "__main__":
             elif mode == '2':
                 # Allow the user to adjust parameters for the system
                 parameter.adjust_parameters(parameter_folder, camera_processor.camera)
+                add_crop_mode(camera_processor, parameter_folder)
             elif mode == '3':
                 # Modify the camera mode (e.g., resolution, settings)
                 camera_processor.set_mode()
             elif mode == '4':
                 try:
                     parameter_folder = change_parameters_folder()
+                    add_crop_mode(camera_processor, parameter_folder)
+                except KeyboardInterrupt:
+                    print("\nKeyboardInterrupt")
+            elif mode == '5':
+                # Recalibrate the lens intrinsics and distortion (e.g. after a focus change)
+                calibrate_camera(camera_processor)
+            elif mode == '6':
+                # Detect in several parameter folders (ROIs/templates) from one shared capture
+                try:
+                    folders = choose_parameters_folders()
+                    if folders:
+                        MultiDetectProcessor(profile=detecter.profile).process_image(folders, camera_processor)
                 except KeyboardInterrupt:
                     print("\nKeyboardInterrupt")
-                    
+            elif mode == '7':
+                # Cycle off -> sampling -> cprofile -> off, the files are written at the end of each detection
+                options = (None,) + PROFILERS
+                detecter.profile = options[(options.index(detecter.profile) + 1) % len(options)]
+                print(f"Profiling: {detecter.profile or 'off'}")
             elif mode == '0':
                 # Exit the program
                 print("Exiting program...")
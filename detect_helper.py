@@ -2,68 +2,20 @@
 import time
 import cv2
 import numpy as np
-from picamera2 import Picamera2, Preview
+from picamera2 import Picamera2, Preview, MappedArray
 from libcamera import controls
 import io
-
-
-def non_max_suppression(boxes, overlapThresh=0.3):
-    """
-    Implement non-max suppression to filter overlapping bounding boxes.
-    
-    This function takes a list of bounding boxes and an overlap threshold as input.
-    It returns a list of bounding boxes that are selected based on their overlap with other boxes.
-    
-    Parameters:
-    - boxes: A list of bounding boxes, where each box is represented by a list of four numbers (x1, y1, x2, y2).
-    - overlapThresh: A float representing the threshold for overlap. Boxes with overlap greater than this value are suppressed.
-    
-    Returns:
-    - A list of bounding boxes that are selected after applying non-max suppression.
-    """
-    
-    # If no target box found
-    if len(boxes) == 0:
-        return []
-    
-    # Convert the list of boxes to a numpy array for easier manipulation
-    boxes = np.array(boxes, dtype="float")
-    
-    # The boxes that are selected
-    pick = []
-    
-    # the coordinates of the boxes
-    x1, y1, x2, y2 = boxes[:, 0], boxes[:, 1], boxes[:, 2], boxes[:, 3]
-    
-    # the area of each box
-    area = (x2 - x1 + 1) * (y2 - y1 + 1)
-    idxs = np.argsort(y2)
-    
-    # While there are still indices to process
-    while len(idxs) > 0:
-        last = len(idxs) - 1
-        i = idxs[last]
-        
-        pick.append(i)
-        
-        # Calculate the coordinates of the intersection rectangle
-        xx1 = np.maximum(x1[i], x1[idxs[:last]])
-        yy1 = np.maximum(y1[i], y1[idxs[:last]])
-        xx2 = np.minimum(x2[i], x2[idxs[:last]])
-        yy2 = np.minimum(y2[i], y2[idxs[:last]])
-        
-        # Calculate the width and height of the intersection rectangle
-        w = np.maximum(0, xx2 - xx1 + 1)
-        h = np.maximum(0, yy2 - yy1 + 1)
-        
-        # Calculate the overlap between the current box and the other boxes
-        overlap = (w * h) / area[idxs[:last]]
-        
-        # Delete the indices of the boxes that have an overlap greater than the threshold
-        idxs = np.delete(idxs, np.concatenate(([last], np.where(overlap > overlapThresh)[0])))
-    
-    # Return the boxes that were picked after applying non-max suppression
-    return boxes[pick].astype("int")
+import os
+from concurrent.futures import ThreadPoolExecutor
+from log_helper import EventLogger
+from latency_helper import FrameInfo, LatencyTracker
+from profile_helper import SessionProfiler
+from memory_helper import MemoryMonitor
+from realtime_helper import RealtimeMode
+from preview_helper import PreviewServer
+from metrics_helper import MetricsRegistry, MetricsExporter, LoopMetrics, DetectionMetrics
+from fiducial_helper import FiducialLocator
+from matcher_helper import non_max_suppression, Detection, DetectionResult, create_matcher
 
 
 class CameraProcessor:
@@ -74,9 +26,13 @@ class CameraProcessor:
         self.modes = {
             'high_res': {'size': (4608, 2592), 'framerate': 14.35},
             'medium_res': {'size': (2304, 1296), 'framerate': 56.03},
-            'low_res': {'size': (1536, 864), 'framerate': 120.13}
+            'low_res': {'size': (1536, 864), 'framerate': 120.13},
+            # Coarse detection on the lores stream, precise matching on windows of main
+            'high_res_dual': {'size': (4608, 2592), 'framerate': 14.35, 'lores': (1536, 864)}
         }
         self.current_mode = 0  # Default mode: high-res
+        self.sequence = 0  # Number of frames captured
+        self.frame_info = None  # FrameInfo of the last captured frame
 
     def start(self):
         """Start the camera with the default configuration."""
@@ -89,10 +45,105 @@ class CameraProcessor:
     def capture_image(self):
         """Capture an image and return it as a numpy array."""
         stream = io.BytesIO()
-        self.camera.capture_file(stream, format='jpeg')
+        request = self.camera.capture_request()
+        try:
+            request.save('main', stream, format='jpeg')
+            metadata = request.get_metadata()
+        finally:
+            request.release()
         stream.seek(0)
         image = np.frombuffer(stream.read(), dtype=np.uint8)
-        return cv2.imdecode(image, cv2.IMREAD_COLOR)
+        image = cv2.imdecode(image, cv2.IMREAD_COLOR)
+        self.record_frame(metadata)
+        return image
+
+    def capture_into(self, out):
+        """
+        Capture the main stream straight into a preallocated BGR array and return it.
+        The XBGR8888 buffer is converted in place of the JPEG encode/decode round trip.
+        Picamera2 maps XBGR8888 as [R, G, B, 255] per pixel, hence RGBA -> BGR.
+        """
+        width, height = self.modes[list(self.modes.keys())[self.current_mode]]['size']
+        if out.shape != (height, width, 3) or out.dtype != np.uint8:
+            # cv2 would silently allocate a new dst instead of writing into out
+            raise ValueError(f"Frame buffer is {out.shape}, the stream needs {(height, width, 3)}")
+        request = self.camera.capture_request()
+        try:
+            with MappedArray(request, 'main') as mapped:
+                cv2.cvtColor(mapped.array[:height, :width], cv2.COLOR_RGBA2BGR, dst=out)
+            metadata = request.get_metadata()
+        finally:
+            request.release()
+        self.record_frame(metadata)
+        return out
+
+    def capture_dual(self, lores_out=None):
+        """
+        Capture a request of a dual-stream mode and return it as a DualFrame.
+        The luminance of the lores stream is copied (into lores_out when given) and the
+        main stream stays mapped until the DualFrame is released.
+        """
+        lores_width, lores_height = self.modes[list(self.modes.keys())[self.current_mode]]['lores']
+        request = self.camera.capture_request()
+        try:
+            with MappedArray(request, 'lores') as mapped:
+                y_plane = mapped.array[:lores_height, :lores_width]  # YUV420: the Y plane comes first
+                if lores_out is None:
+                    lores = y_plane.copy()
+                else:
+                    np.copyto(lores_out, y_plane)
+                    lores = lores_out
+            metadata = request.get_metadata()
+            main = MappedArray(request, 'main')
+            main.__enter__()
+        except Exception:
+            request.release()
+            raise
+        self.record_frame(metadata)
+
+        def release():
+            main.__exit__(None, None, None)
+            request.release()
+        return DualFrame(lores, main.array, release)
+
+    def record_frame(self, metadata):
+        """Keep the sensor timestamp and exposure of the frame that was just captured."""
+        self.sequence += 1
+        self.frame_info = FrameInfo.from_metadata(self.sequence, metadata)
+
+    def add_crop_mode(self, base_name, box, margin=32):
+        """
+        Add a mode that streams only the (x, y, w, h) box of the base mode plus a margin.
+
+        The ISP crops the sensor image (ScalerCrop) before it is scaled and written to
+        memory, so the output keeps the pixel scale of the base mode. The offset of the
+        crop is stored with the mode for the detector to adjust its homography.
+        Returns the name of the new mode.
+        """
+        base_width, base_height = self.modes[base_name]['size']
+        x1 = max(0, box[0] - margin) & ~1  # Even offsets for the YUV/Bayer pipeline
+        y1 = max(0, box[1] - margin) & ~1
+        x2 = min(base_width, box[0] + box[2] + margin)
+        y2 = min(base_height, box[1] + box[3] + margin)
+        width = min(-(-(x2 - x1) // 16) * 16, base_width)  # Row stride friendly width
+        height = min(-(-(y2 - y1) // 2) * 2, base_height)
+        x1 = min(x1, base_width - width)
+        y1 = min(y1, base_height - height)
+        name = f"{base_name}_crop"
+        # The sensor readout is unchanged, only less data leaves the ISP
+        self.modes[name] = {'size': (width, height), 'framerate': self.modes[base_name]['framerate'],
+                            'crop': (x1, y1, width, height), 'base': base_name}
+        return name
+
+    def sensor_crop(self, mode_config):
+        """Return the ScalerCrop rectangle, in sensor pixels, of a crop mode."""
+        base_width, base_height = self.modes[mode_config['base']]['size']
+        max_x, max_y, max_width, max_height = self.camera.camera_properties.get(
+            'ScalerCropMaximum', (0, 0) + tuple(self.camera.camera_properties['PixelArraySize']))
+        scale_x = max_width / base_width
+        scale_y = max_height / base_height
+        x, y, width, height = mode_config['crop']
+        return (int(max_x + x * scale_x), int(max_y + y * scale_y), int(width * scale_x), int(height * scale_y))
 
     def configure_camera_mode(self, mode):
         """Configure the camera with the selected mode."""
@@ -101,10 +152,17 @@ class CameraProcessor:
             mode_config = self.modes[list(self.modes.keys())[mode]]
             
             # Create video configuration
+            options = {}
+            if 'lores' in mode_config:
+                options['lores'] = {"size": mode_config['lores'], "format": "YUV420"}
+            if 'crop' in mode_config:
+                # Keep the sensor mode of the base mode and crop on the ISP
+                options['sensor'] = {'output_size': self.modes[mode_config['base']]['size']}
+                options['controls'] = {'ScalerCrop': self.sensor_crop(mode_config)}
             video_config = self.camera.create_video_configuration(main={
                 "size": mode_config['size'],
                 "format": "XBGR8888"  # Compatible with OpenCV
-            })
+            }, **options)
 
             self.stop()
             self.camera.configure(video_config)
@@ -142,19 +200,258 @@ class CameraProcessor:
                 end = True
 
 
+class DualFrame:
+    """
+    One capture of a dual-stream mode: the lores luminance, and the main stream of
+    which only windows are converted, on request. release() gives the buffers back.
+    """
+    def __init__(self, lores, main, release=None):
+        self.lores = lores  # Gray lores image
+        self.main = main  # Main stream array, XBGR8888 ([R, G, B, 255]) from the camera or BGR
+        self._release = release
+
+    def read_main(self, x, y, w, h):
+        """Return the (x, y, w, h) window of the main stream as a BGR image."""
+        window = self.main[y:y + h, x:x + w]
+        if window.shape[2] == 4:
+            return cv2.cvtColor(window, cv2.COLOR_RGBA2BGR)
+        return window.copy()
+
+    def release(self):
+        if self._release is not None:
+            self._release()
+            self._release = None
+
+
+class ReplayCamera:
+    """
+    Stand-in for CameraProcessor that replays stored images, used by the benchmarks.
+
+    The images are decoded once and play the part of the camera buffers: capture_image
+    returns a new copy, capture_into copies into a preallocated array. With a lores_size
+    the mode is a dual-stream one and capture_dual also replays a shrunk luminance.
+    """
+    def __init__(self, paths, mode_name='replay', lores_size=None):
+        self.frames = [cv2.imread(path) for path in paths]
+        self.modes = {mode_name: {'size': (self.frames[0].shape[1], self.frames[0].shape[0]), 'framerate': 0}}
+        self.lores_frames = None
+        if lores_size is not None:
+            self.modes[mode_name]['lores'] = lores_size
+            self.lores_frames = [cv2.resize(cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY), lores_size,
+                                            interpolation=cv2.INTER_AREA) for frame in self.frames]
+        self.current_mode = 0
+        self.index = 0
+        self.frame_info = None
+
+    def record_frame(self):
+        """There is no sensor, the frame counts as exposed when it is replayed."""
+        now = time.monotonic_ns()
+        self.frame_info = FrameInfo(self.index, now, capture_ns=now)
+
+    def next_frame(self):
+        frame = self.frames[self.index]
+        self.index = (self.index + 1) % len(self.frames)
+        return frame
+
+    def capture_image(self):
+        """Return a copy of the next stored image."""
+        self.record_frame()
+        return self.next_frame().copy()
+
+    def capture_into(self, out):
+        """Copy the next stored image into a preallocated array."""
+        self.record_frame()
+        np.copyto(out, self.next_frame())
+        return out
+
+    def capture_dual(self, lores_out=None):
+        """Return the next stored image and its shrunk luminance as a DualFrame."""
+        self.record_frame()
+        lores = self.lores_frames[self.index]
+        if lores_out is not None:
+            np.copyto(lores_out, lores)
+            lores = lores_out
+        return DualFrame(lores, self.next_frame())
+
+
+class MotionGate:
+    """
+    Cheap scene change detector.
+
+    The ROI bounding box of the raw frame is shrunk by `scale` and compared with the
+    same shrunk region of the last frame that went through the full detection. When
+    no cell changed by more than `threshold` gray levels, the frame can reuse the
+    previous result. The reference is only replaced by frames that are processed, so
+    slow drift still adds up and wakes the detector. At most max_cached frames in a row
+    reuse a result, which bounds how stale a published position can be.
+    """
+    def __init__(self, region=None, threshold=12, scale=0.125, max_cached=3):
+        self.region = region  # (x, y, w, h) of the raw frame to watch, None for the whole frame
+        self.threshold = threshold
+        self.scale = scale
+        self.max_cached = max_cached  # Force a full detection after this many reused frames
+        self.reference = None
+        self.cached_count = 0
+
+    def shrink(self, image):
+        """Downsample the watched region to a small gray image."""
+        if self.region is not None:
+            x, y, w, h = self.region
+            image = image[y:y + h, x:x + w]
+        small = cv2.resize(image, None, fx=self.scale, fy=self.scale, interpolation=cv2.INTER_AREA)
+        if small.ndim == 3:
+            small = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+        return small
+
+    def changed(self, image):
+        """Return True if the frame needs a full detection, and keep it as the new reference."""
+        small = self.shrink(image)
+        if (self.reference is not None and self.cached_count < self.max_cached
+                and self.reference.shape == small.shape
+                and cv2.absdiff(small, self.reference).max() <= self.threshold):
+            self.cached_count += 1
+            return False
+        self.reference = small
+        self.cached_count = 0
+        return True
+
+    def reset(self):
+        self.reference = None
+        self.cached_count = 0
+
+
+class FrameBuffers:
+    """
+    Fixed-size arrays owned by the detector and reused for every frame of a session.
+
+    They are sized once from the camera mode (captured frame) and from the parameter
+    folder (rectified ROI and template). frame_size is None when the frame is captured
+    by someone else, e.g. shared between several ROIs. Every OpenCV call of the detection loop writes
+    into them through its dst/result output instead of allocating new arrays, so a
+    DetectionResult image is only valid until the next frame is processed.
+    """
+    def __init__(self, frame_size, warp_size, template_shape, lores_size=None, float_gray=False):
+        width, height = frame_size if frame_size is not None else (0, 0)
+        warp_width, warp_height = warp_size
+        template_height, template_width = template_shape
+        self.frame = None if frame_size is None else np.empty((height, width, 3), dtype=np.uint8)  # Captured BGR frame
+        self.warped = np.empty((warp_height, warp_width, 3), dtype=np.uint8)  # Rectified ROI
+        self.gray = np.empty((warp_height, warp_width), dtype=np.uint8)
+        # Float copy of gray, for the matchers that need one (Matcher.float_target)
+        self.gray_float = np.empty((warp_height, warp_width), dtype=np.float32) if float_gray else None
+        self.response = np.empty((warp_height - template_height + 1, warp_width - template_width + 1),
+                                 dtype=np.float32)  # matchTemplate output
+        self.mask = np.empty(self.response.shape, dtype=bool)  # Response above the threshold
+        self.display = np.empty_like(self.warped)  # Annotated copy for the window
+        self.lores = None if lores_size is None else np.empty(lores_size[::-1], dtype=np.uint8)  # Lores luminance
+
+    @property
+    def arrays(self):
+        return [buffer for buffer in (self.frame, self.warped, self.gray, self.gray_float, self.response, self.mask,
+                                      self.display, self.lores) if buffer is not None]
+
+    @property
+    def nbytes(self):
+        return sum(buffer.nbytes for buffer in self.arrays)
+
+
 class DetectProcessor:
-    def __init__(self):
-        """Initialize attributes for points, shape, and real size."""
+    def __init__(self, log_frames=False, log_sample=10, motion_gate=True, motion_threshold=12,
+                 engine=None, preallocate=True, profile=None, memory_cap_mb=None, memory_report=False,
+                 headless=False, px_per_mm=None, drift_interval=None, drift_threshold=2.0, cpu_layout=None,
+                 realtime=False, preview_port=None, metrics_output=None):
+        """
+        Initialize attributes for points, shape, and real size.
+
+        log_frames enables the per-frame events (capture, centre, "Not Found"),
+        of which only one out of every log_sample is recorded.
+        motion_gate skips the warp and matching while the ROI does not change by more
+        than motion_threshold gray levels, and reuses the previous result instead, for
+        at most 3 frames in a row.
+        engine names the registered matcher that locates the target: 'template' (the
+        reference) recomputes the response map for every frame, 'incremental' only updates
+        the tiles that changed, 'orb' and 'akaze' match binary features and also report
+        the rotation, 'gradient' matches quantized gradient orientations (robust to the
+        room lighting), 'cascade' gives the results of 'template' but rejects most windows
+        before the full correlation. None uses the name in matcher.txt of the parameter
+        folder, or 'template'. The dual-stream modes only match with 'template'.
+        preallocate reuses one set of FrameBuffers for the whole detection session.
+        profile ('sampling' or 'cprofile') profiles every detection session, see SessionProfiler.
+        memory_cap_mb is a soft, advisory RSS limit: the buffers are always reused, the
+        queues are sized from the cap and the per-frame events stop when it is exceeded.
+        Nothing is freed beyond that, the frames and OpenCV dominate the RSS.
+        memory_report writes the RSS and the peak of each loop stage (tracemalloc) at the end.
+        headless neither draws the results nor opens a display window.
+        px_per_mm is the working resolution of the rectified ROI. The perspective warp scales
+        the front view to it directly, and the template and the px -> mm conversion follow.
+        None keeps the side lengths of the corner quad.
+        drift_interval checks every that many frames where the ArUco markers at the workspace
+        corners are. When they moved by more than drift_threshold pixels (the camera was
+        bumped), the perspective transform is corrected for the motion without stopping.
+        cpu_layout is a CpuLayout: the detection loop and OpenCV run on its detect cores,
+        the event logger on its output cores.
+        realtime runs the detection loop in a RealtimeMode: no cyclic garbage collection
+        during the loop, locked memory and a real-time priority where permitted.
+        preview_port serves the annotated frames as MJPEG on localhost instead of opening
+        a display window (see PreviewServer). They are only drawn while a client watches.
+        metrics_output exports the frame, detection and latency metrics of the session: a
+        port number serves them on http://localhost:<port>/metrics, a file path is rewritten
+        every 10 seconds (see MetricsExporter).
+        """
         self.points = []
         self.shape = []
         self.real_size = []
+        self.log_frames = log_frames
+        self.log_sample = log_sample
+        self.motion_gate = motion_gate
+        self.motion_threshold = motion_threshold
+        self.engine = engine
+        self.preallocate = preallocate
+        self.profile = profile
+        self.memory_cap_mb = memory_cap_mb
+        self.memory_report = memory_report
+        self.memory = MemoryMonitor()
+        self.headless = headless
+        self.px_per_mm = px_per_mm
+        self.drift_interval = drift_interval
+        self.drift_threshold = drift_threshold
+        self.cpu_layout = cpu_layout
+        self.realtime = realtime
+        self.preview_port = preview_port
+        self.preview = None  # PreviewServer of the running session
+        self.metrics_output = metrics_output
+        self.metrics = None  # DetectionMetrics of the running session
+        self.fiducials = None  # FiducialLocator of the drift check
+        self.fiducial_reference = None  # Marker corners the current transform was computed for
+        self.frame_count = 0
+        self.template_gray = None
+        self.matcher = None
+        self.transform = None  # Perspective transform of the ROI, computed once per session
+        self.warp_size = None  # (width, height) of the rectified ROI
+        self.working_scale = 1.0  # Rectified pixels per pixel of the full resolution front view
+        self.lores_size = None  # (width, height) of the lores stream in a dual-stream mode
+        self.coarse_scale = None  # Rectified pixels per pixel of the coarse (lores) rectified ROI
+        self.coarse_transform = None  # Perspective transform from the lores frame to the coarse ROI
+        self.coarse_size = None
+        self.coarse_template = None
+        self.sinks = []  # Callables sink(name, result) receiving every processed frame
+        # State of the running session
+        self.name = None  # Name of the parameter folder
+        self.gate = None
+        self.buffers = None
+        self.last_result = None
+        self.last_display = None
+        self.latency = LatencyTracker()
+        self.threshold = 0.9  # If the matching degree is greater than 0.9, it is considered that the target has been found.
+        self.coarse_threshold = 0.6  # Candidates of the lores pass, confirmed at full resolution
+        self.max_candidates = 8
 
     def load_points_from_file(self, file_path):
         """Load points from a file."""
         with open(file_path, 'r') as file:
             for i, line in enumerate(file, 1):
                 if i <= 4:
-                    x, y = map(int, line.strip().split(','))
+                    x, y = map(float, line.strip().split(','))  # Sub-pixel when located from the markers
                     self.points.append((x, y))
                 elif i == 5:
                     self.shape = list(map(int, line.strip().split(',')))
@@ -174,11 +471,16 @@ class DetectProcessor:
             sp[2], sp[3] = sp[3], sp[2]
         return sp
 
-    def imgcorr(self, src):
-        """
-            Perform perspective transformation on the image.
-            Used to calibrate to the front view of the ROI
-        """
+    def roi_bounding_box(self):
+        """Return the (x, y, w, h) bounding box of the ROI corners in the raw frame."""
+        xs = [p[0] for p in self.points]
+        ys = [p[1] for p in self.points]
+        x1, y1 = int(np.floor(min(xs))), int(np.floor(min(ys)))
+        x2, y2 = int(np.ceil(max(xs))), int(np.ceil(max(ys)))
+        return x1, y1, x2 - x1 + 1, y2 - y1 + 1
+
+    def warp_transform(self):
+        """Return the perspective transform of the ROI and the (width, height) of the front view."""
         sp = self.SortPoint()
         width = int(np.sqrt(((sp[0][0] - sp[1][0]) ** 2) + (sp[0][1] - sp[1][1]) ** 2))
         height = int(np.sqrt(((sp[0][0] - sp[2][0]) ** 2) + (sp[0][1] - sp[2][1]) ** 2))
@@ -188,70 +490,631 @@ class DetectProcessor:
             [0, height - 1],
             [width - 1, height - 1]], dtype="float32")
         transform = cv2.getPerspectiveTransform(np.array(sp, dtype="float32"), dstrect)
-        return cv2.warpPerspective(src, transform, (width, height))
+        if self.px_per_mm is not None:
+            # Working resolution: the scale is part of the homography, the warp stays a single pass
+            scaled_width = max(2, round(self.real_size[0] * self.px_per_mm))
+            scaled_height = max(2, round(self.real_size[1] * self.px_per_mm))
+            scale = np.diag([(scaled_width - 1) / (width - 1), (scaled_height - 1) / (height - 1), 1.0])
+            transform = scale @ transform
+            self.working_scale = (scale[0, 0] + scale[1, 1]) / 2
+            width, height = scaled_width, scaled_height
+        return transform, (width, height)
 
-    def process_image(self, path_parameters, camera):
-        """Process the image for template matching."""
-        
-        #Initial the parameters
+    def crop_offset(self, x, y):
+        """Move the ROI corners into a frame cropped at (x, y) and recompute the perspective transform."""
+        self.points = [(px - x, py - y) for px, py in self.points]
+        self.transform, self.warp_size = self.warp_transform()
+
+    def imgcorr(self, src, dst=None):
+        """
+            Perform perspective transformation on the image.
+            Used to calibrate to the front view of the ROI
+        """
+        if self.transform is None:
+            self.transform, self.warp_size = self.warp_transform()
+        return cv2.warpPerspective(src, self.transform, self.warp_size, dst=dst)
+
+    def load_matcher_from_file(self, file_path):
+        """Load the name of the matcher from a file, 'template' when there is none."""
+        if not os.path.exists(file_path):
+            return 'template'
+        with open(file_path, 'r') as file:
+            return file.readline().strip() or 'template'
+
+    def load_parameters(self, path_parameters):
+        """Load the template, the ROI corners and the real size from a parameter folder."""
         template = cv2.imread(f"{path_parameters}/template.jpg")
-        template_gray = cv2.cvtColor(template, cv2.COLOR_BGR2GRAY)
+        self.template_gray = cv2.cvtColor(template, cv2.COLOR_BGR2GRAY)
         self.points.clear()
         self.shape.clear()
-        self.real_size.clear()     
+        self.real_size.clear()
         self.load_points_from_file(f"{path_parameters}/points.txt")
         self.load_real_size_from_file(f"{path_parameters}/real_size.txt")
+        self.transform, self.warp_size = self.warp_transform()
+        if self.px_per_mm is not None:
+            self.scale_to_working_resolution()
+        engine = self.engine or self.load_matcher_from_file(f"{path_parameters}/matcher.txt")
+        self.matcher = create_matcher(engine, threshold=self.threshold)
+        self.matcher.prepare(self.template_gray, path_parameters)
+
+    def scale_to_working_resolution(self):
+        """Resize the template and the rectified shape from the saved front view to the warp size."""
+        # The template was cropped from a front view of self.shape (height, width, channels)
+        scale_x = self.warp_size[0] / self.shape[1]
+        scale_y = self.warp_size[1] / self.shape[0]
+        template_height, template_width = self.template_gray.shape
+        size = (max(3, round(template_width * scale_x)), max(3, round(template_height * scale_y)))
+        interpolation = cv2.INTER_AREA if scale_x * scale_y < 1 else cv2.INTER_LINEAR
+        self.template_gray = cv2.resize(self.template_gray, size, interpolation=interpolation)
+        self.shape = [self.warp_size[1], self.warp_size[0]] + self.shape[2:]
+
+    def to_mm(self, center_x, center_y):
+        """Convert a position of the rectified image to millimetres."""
+        scaled_center_x = round(float(center_x) / self.shape[1] * self.real_size[0], 1)
+        scaled_center_y = round(float(center_y) / self.shape[0] * self.real_size[1], 1)
+        return scaled_center_x, scaled_center_y
+
+    def detect(self, image, buffers=None):
+        """Run perspective correction and the matcher on one captured frame."""
+        start = time.perf_counter()
+        # Perform perspective correction.
+        warped_image = self.imgcorr(image, None if buffers is None else buffers.warped)
+        target_gray = cv2.cvtColor(warped_image, cv2.COLOR_BGR2GRAY, dst=None if buffers is None else buffers.gray)
+        warped = time.perf_counter()
+        detections = self.matcher.match(target_gray, buffers)
+        for detection in detections:
+            detection.center_mm = self.to_mm(*detection.center_px)
+        result = DetectionResult(detections, warped_image)
+        result.timings = {'warp': warped - start, 'match': time.perf_counter() - warped}
+        return result
+
+    def set_lores(self, lores_size, frame_size):
+        """
+        Scale the homography and the template for the coarse pass of a dual-stream mode.
+        The coarse ROI is the rectified ROI shrunk by the lores/main ratio, seen from the lores stream.
+        At a reduced working resolution it is shrunk less, never beyond the lores resolution.
+        """
+        self.lores_size = lores_size
+        scale_x = frame_size[0] / lores_size[0]
+        scale_y = frame_size[1] / lores_size[1]
+        self.coarse_scale = max(1.0, (scale_x + scale_y) / 2 * self.working_scale)
+        lores_to_frame = np.diag([scale_x, scale_y, 1.0])
+        shrink = np.diag([1 / self.coarse_scale, 1 / self.coarse_scale, 1.0])
+        self.coarse_transform = shrink @ self.transform @ lores_to_frame
+        self.coarse_size = (max(1, int(self.warp_size[0] / self.coarse_scale)),
+                            max(1, int(self.warp_size[1] / self.coarse_scale)))
+        template_height, template_width = self.template_gray.shape
+        self.coarse_template = cv2.resize(self.template_gray, (max(3, round(template_width / self.coarse_scale)),
+                                                               max(3, round(template_height / self.coarse_scale))),
+                                          interpolation=cv2.INTER_AREA)
+
+    def detect_dual(self, frame, buffers=None):
+        """
+        Coarse-to-fine detection on a DualFrame.
+
+        The lores luminance is rectified at the coarse scale and matched with the shrunk
+        template. Each candidate above coarse_threshold is then confirmed by warping only a
+        small window of the main stream around it and matching the full template there.
+        """
+        coarse = cv2.warpPerspective(frame.lores, self.coarse_transform, self.coarse_size)
+        res = cv2.matchTemplate(coarse, self.coarse_template, cv2.TM_CCOEFF_NORMED)
+        # Candidates are the strongest local maxima, the suppression would not keep the best of a cluster
+        coarse_h, coarse_w = self.coarse_template.shape
+        peaks = (res >= self.coarse_threshold) & (res >= cv2.dilate(res, np.ones((coarse_h, coarse_w), np.uint8)))
+        loc = np.flatnonzero(peaks)
+        loc = loc[np.argsort(res.flat[loc])[::-1][:self.max_candidates]]
+        ys, xs = np.unravel_index(loc, res.shape)
+
+        inverse = np.linalg.inv(self.transform)
+        frame_height, frame_width = frame.main.shape[:2]
+        h, w = self.template_gray.shape
+        margin = int(np.ceil(self.coarse_scale)) + 2  # Error of a coarse position in rectified pixels
+        boxes, scores = [], {}
+        for x1, y1 in zip(xs, ys):
+            # Window of the rectified ROI around the candidate
+            wx1 = max(0, int(x1 * self.coarse_scale) - margin)
+            wy1 = max(0, int(y1 * self.coarse_scale) - margin)
+            wx2 = min(self.warp_size[0], int(x1 * self.coarse_scale) + w + margin)
+            wy2 = min(self.warp_size[1], int(y1 * self.coarse_scale) + h + margin)
+            if wx2 - wx1 < w or wy2 - wy1 < h:
+                continue
+            # Bounding box of that window in the main stream
+            corners = np.array([[[wx1, wy1], [wx2, wy1], [wx1, wy2], [wx2, wy2]]], dtype=np.float32)
+            mapped = cv2.perspectiveTransform(corners, inverse)[0]
+            bx1 = max(0, int(np.floor(mapped[:, 0].min())) - 1)
+            by1 = max(0, int(np.floor(mapped[:, 1].min())) - 1)
+            bx2 = min(frame_width, int(np.ceil(mapped[:, 0].max())) + 2)
+            by2 = min(frame_height, int(np.ceil(mapped[:, 1].max())) + 2)
+            patch = frame.read_main(bx1, by1, bx2 - bx1, by2 - by1)
+            window_transform = (np.array([[1, 0, -wx1], [0, 1, -wy1], [0, 0, 1]], dtype=np.float64) @ self.transform
+                                @ np.array([[1, 0, bx1], [0, 1, by1], [0, 0, 1]], dtype=np.float64))
+            window = cv2.warpPerspective(patch, window_transform, (wx2 - wx1, wy2 - wy1))
+            fine = cv2.matchTemplate(cv2.cvtColor(window, cv2.COLOR_BGR2GRAY), self.template_gray,
+                                     cv2.TM_CCOEFF_NORMED)
+            _, score, _, (fx, fy) = cv2.minMaxLoc(fine)
+            if score >= self.threshold:
+                boxes.append([wx1 + fx, wy1 + fy, wx1 + fx + w, wy1 + fy + h])
+                scores[(wx1 + fx, wy1 + fy)] = score
+
+        detections = []
+        for x1, y1, x2, y2 in non_max_suppression(boxes):
+            center_x, center_y = (x1 + x2) // 2, (y1 + y2) // 2
+            detections.append(Detection((int(x1), int(y1), int(x2), int(y2)), (int(center_x), int(center_y)),
+                                        self.to_mm(center_x, center_y), float(scores[(int(x1), int(y1))])))
+        result = DetectionResult(detections, cv2.cvtColor(coarse, cv2.COLOR_GRAY2BGR))
+        result.image_scale = 1 / self.coarse_scale
+        return result
+
+    def draw_result(self, result, out=None):
+        """Draw the bounding boxes and centres of a result on a copy of its image."""
+        if out is None or out.shape != result.image.shape:
+            display_image = result.image.copy()
+        else:
+            display_image = out
+            np.copyto(display_image, result.image)
+        scale = result.image_scale
+        for detection in result.detections:
+            x1, y1, x2, y2 = [int(value * scale) for value in detection.box]
+            cv2.rectangle(display_image, (x1, y1), (x2, y2), (0, 0, 255), 2)
+            cv2.circle(display_image, (int(detection.center_px[0] * scale), int(detection.center_px[1] * scale)),
+                       5, (255, 0, 0), -1)
+        return display_image
+
+    def start_session(self, path_parameters, camera, own_frame=True):
+        """
+        Load the parameters and set up the motion gate and the buffers of a detection session.
+        own_frame is False when the frames are captured into a buffer shared with other detectors.
+        """
+        self.load_parameters(path_parameters)
+        self.name = os.path.basename(os.path.normpath(path_parameters))
+        mode_name = list(camera.modes.keys())[camera.current_mode]
+        crop = camera.modes[mode_name].get('crop')
+        if crop is not None:
+            self.crop_offset(crop[0], crop[1])
+        lores_size = camera.modes[mode_name].get('lores') if own_frame else None
+        self.lores_size = None
+        region = self.roi_bounding_box()
+        if lores_size is not None:
+            if self.matcher.name != 'template':
+                # detect_dual correlates the lores and main windows itself (TM_CCOEFF_NORMED)
+                raise ValueError(f"The dual-stream mode {mode_name} only matches with 'template', "
+                                 f"not '{self.matcher.name}'")
+            frame_width, frame_height = camera.modes[mode_name]['size']
+            self.set_lores(lores_size, (frame_width, frame_height))
+            # The motion gate watches the lores luminance: the ROI box scaled by the lores/main
+            # ratio of the streams (coarse_scale also holds the working resolution)
+            ratio_x = lores_size[0] / frame_width
+            ratio_y = lores_size[1] / frame_height
+            x, y, w, h = region
+            region = (int(x * ratio_x), int(y * ratio_y), int(np.ceil(w * ratio_x)), int(np.ceil(h * ratio_y)))
+        self.gate = MotionGate(region, self.motion_threshold, 0.5 if lores_size else 0.125) if self.motion_gate else None
+        self.memory = MemoryMonitor(self.memory_cap_mb, self.memory_report)
+        self.buffers = None
+        if self.preallocate or self.memory.cap is not None:
+            capture_into = own_frame and lores_size is None and hasattr(camera, 'capture_into')
+            frame_size = camera.modes[mode_name]['size'] if capture_into else None
+            self.buffers = FrameBuffers(frame_size, self.warp_size, self.template_gray.shape, lores_size,
+                                        self.matcher.float_target)
+        self.last_result = None
+        self.last_display = None
+        self.latency = LatencyTracker(self.memory.queue_depth(100000, LatencyTracker.SAMPLE_BYTES))
+        self.frame_count = 0
+        self.fiducial_reference = None
+        self.fiducials = FiducialLocator() if self.drift_interval else None
+
+    def capture(self, camera):
+        """Capture a frame, into the frame buffer when the session has one."""
+        if self.lores_size is not None:
+            return camera.capture_dual(None if self.buffers is None else self.buffers.lores)
+        if self.buffers is not None and self.buffers.frame is not None and hasattr(camera, 'capture_into'):
+            return camera.capture_into(self.buffers.frame)
+        return camera.capture_image()
+
+    def check_drift(self, image, logger=None):
+        """
+        Compare the corner markers with the reference markers the current transform was
+        computed for. The first check of a session takes the reference from the frame (a
+        full frame search, repeated at the next check while a marker is hidden). Later
+        checks search windows around the reference markers, and the full frame when a
+        marker is not in its window. When the markers moved by more than drift_threshold
+        pixels, their motion is composed into the perspective transform and they become
+        the reference, so the next shift is measured from the corrected ROI. A check with
+        a hidden marker changes nothing. The rectified ROI keeps its size, so the buffers
+        and the matcher stay valid. Return True when the transform was swapped.
+        """
+        if self.fiducial_reference is None:
+            self.fiducial_reference = self.fiducials.find(image)  # None while a marker is hidden
+            return False
+        markers = self.fiducials.markers_near(image, self.fiducial_reference) or self.fiducials.find(image)
+        if markers is None:
+            return False  # A marker is hidden, try again at the next check
+        homography, shift = self.fiducials.motion(self.fiducial_reference, markers)
+        if shift <= self.drift_threshold or homography is None:
+            return False
+        points = cv2.perspectiveTransform(np.array([self.points], dtype=np.float64), homography)[0]
+        self.points = [(float(x), float(y)) for x, y in points]
+        self.transform = self.transform @ np.linalg.inv(homography)
+        self.fiducial_reference = markers
+        if self.gate is not None:
+            self.gate.region = self.roi_bounding_box()
+            self.gate.reset()
+        self.last_result = None
+        if logger is not None:
+            logger.warning("roi_drift", roi=self.name, shift_px=round(shift, 2), action="homography_swapped")
+        return True
+
+    def process_frame(self, image, logger=None, frame=None):
+        """
+        Detect the target in a captured frame. Return the result and the annotated image.
+        frame is the FrameInfo of the image, used for the exposure-to-output latency. The
+        result is None, and nothing is published, when the frame was overwritten meanwhile.
+        """
+        dual = isinstance(image, DualFrame)
+        if self.fiducials is not None and not dual and self.frame_count % self.drift_interval == 0:
+            self.check_drift(image, logger)
+        self.frame_count += 1
+        # Reuse the previous result while the scene has not changed
+        if (self.gate is not None and not self.gate.changed(image.lores if dual else image)
+                and self.last_result is not None):
+            result = self.last_result.as_cached()
+            detect_seconds = None
+            if logger is not None:
+                logger.frame("cached", roi=self.name)
+        else:
+            detect_start = time.perf_counter()
+            with self.memory.stage('detect'):
+                result = self.detect_dual(image, self.buffers) if dual else self.detect(image, self.buffers)
+            detect_seconds = time.perf_counter() - detect_start
+            self.last_display = None
+        if self.draws() and self.last_display is None:
+            with self.memory.stage('display'):
+                self.last_display = self.draw_result(result, None if self.buffers is None else self.buffers.display)
+        if frame is not None and not frame.intact():
+            # A frame shared through a FrameRing was overwritten by the capture process meanwhile
+            if self.gate is not None:
+                self.gate.reset()
+            if logger is not None:
+                logger.warning("frame_overwritten", roi=self.name, frame=frame.sequence)
+            if self.metrics is not None:
+                self.metrics.dropped.inc()
+            return None, self.last_display
+        self.last_result = result
+
+        output_ns = time.monotonic_ns()
+        if frame is not None:
+            result.frame = frame
+            result.latency_ms = (output_ns - frame.exposure_ns) / 1e6
+        if logger is not None and not result.cached:
+            if not result.found:   # Boxes has nothig recorded
+                logger.frame("not_found", roi=self.name)
+            for detection in result.detections:
+                logger.frame("detected", roi=self.name, center_px=detection.center_px,
+                             center_mm=detection.center_mm, score=round(detection.score, 3),
+                             latency_ms=None if result.latency_ms is None else round(result.latency_ms, 2))
+        publish_start = time.perf_counter()
+        with self.memory.stage('publish'):
+            self.publish(result)
+        if self.metrics is not None:
+            self.metrics.record(result, detect_seconds, time.perf_counter() - publish_start)
+        if frame is not None:
+            self.latency.add(frame, output_ns, time.monotonic_ns())
+        return result, self.last_display
+
+    def publish_failed(self, frame=None):
+        """Publish "Not Found" for a frame whose detection raised, and forget the last result."""
+        result = DetectionResult([])
+        self.last_result = None
+        if self.gate is not None:
+            self.gate.reset()
+        if frame is not None:
+            result.frame = frame
+            result.latency_ms = (time.monotonic_ns() - frame.exposure_ns) / 1e6
+        self.publish(result)
+        return result
+
+    def draws(self):
+        """Whether the results are drawn: for the display window, or while a preview client watches."""
+        if self.preview is not None:
+            return self.preview.watching
+        return not self.headless
+
+    def show(self, display_image):
+        """Show an annotated frame in the preview, or else in the display window."""
+        if self.preview is not None:
+            self.preview.offer(self.name, display_image)
+        elif not self.headless:
+            cv2.namedWindow('Detected Logo' + self.__class__.__name__, cv2.WINDOW_NORMAL)
+            cv2.imshow('Detected Logo' + self.__class__.__name__, display_image)
+            cv2.waitKey(1)
+
+    def publish(self, result):
+        """Hand a result to every sink."""
+        for sink in self.sinks:
+            sink(self.name, result)
+
+    def process_image(self, path_parameters, camera):
+        """Process the image for template matching."""
         
-        with open(f'{path_parameters}/{list(camera.modes.keys())[camera.current_mode]}_times.txt', 'w') as file:
+        if self.cpu_layout is not None:
+            self.cpu_layout.enter('detect')
+        #Initial the parameters
+        self.start_session(path_parameters, camera)
+        
+        mode_name = list(camera.modes.keys())[camera.current_mode]
+        # Events are written by a background thread, to the console and as JSON lines
+        logger = EventLogger(json_path=f'{path_parameters}/{mode_name}_events.jsonl',
+                             frame_events=self.log_frames, frame_sample=self.log_sample,
+                             max_queue=self.memory.queue_depth(10000, 512))
+        logger.start()
+        if self.cpu_layout is not None:
+            self.cpu_layout.pin_thread(logger.thread, 'output')
+        logger.info("detection_started", folder=path_parameters, mode=mode_name)
+        if self.memory.cap is not None and not self.preallocate:
+            logger.warning("memory_cap", cap_mb=self.memory_cap_mb, action="reuse_buffers")
+        self.memory.start_session(logger)
+        if self.buffers is not None:
+            logger.info("buffers_allocated", megabytes=round(self.buffers.nbytes / 1e6, 1))
+        profiler = None
+        if self.profile is not None:
+            # Output files tagged with the camera mode and the parameter folder
+            profiler = SessionProfiler(self.profile, f'{path_parameters}/profile_{mode_name}_{self.name}')
+            profiler.start()
+        # The preview and metrics threads are started before the real-time mode, which
+        # they would otherwise inherit, and run on the output cores like the logger
+        if self.preview_port is not None:
+            self.preview = PreviewServer(self.preview_port)
+            self.preview.start()
+            if self.cpu_layout is not None:
+                for thread in self.preview.threads:
+                    self.cpu_layout.pin_thread(thread, 'output')
+            logger.info("preview_started", url=f"http://localhost:{self.preview.port}/")
+        exporter = None
+        loop_metrics = None
+        if self.metrics_output is not None:
+            registry = MetricsRegistry()
+            loop_metrics = LoopMetrics(registry)
+            self.metrics = DetectionMetrics(registry, self.name)
+            exporter = MetricsExporter.from_spec(registry, self.metrics_output)
+            exporter.start()
+            if self.cpu_layout is not None:
+                self.cpu_layout.pin_thread(exporter.thread, 'output')
+            logger.info("metrics_started", target=exporter.target)
+        realtime = None
+        if self.realtime:
+            realtime = RealtimeMode()
+            realtime.enter([] if self.buffers is None else self.buffers.arrays, logger)
+        with open(f'{path_parameters}/{mode_name}_times.txt', 'w') as file:
             try:
                 end = False
                 while not end:
                     # Capture an image from the camera
                     start_time = time.time()
                     
-                    image = camera.capture_image()
-                    print('Captured image to memory')
+                    with self.memory.stage('capture'):
+                        image = self.capture(camera)
+                    logger.frame("captured")
+                    self.memory.check(logger)
                     
                     end_time = time.time()
                     elapsed_time = end_time - start_time
+                    if loop_metrics is not None:
+                        loop_metrics.frame_captured(elapsed_time, getattr(camera, 'frame_info', None))
                     #print(f"Capturing photo time:{elapsed_time} seconds")
                     #file.write(f"{elapsed_time}\n")
                     try:
-                        # Perform perspective correction. 
-                        warped_image = self.imgcorr(image)
-                        target_gray = cv2.cvtColor(warped_image, cv2.COLOR_BGR2GRAY)
-                        w, h = template_gray.shape[::-1]
-                        res = cv2.matchTemplate(target_gray, template_gray, cv2.TM_CCOEFF_NORMED)
-                        threshold = 0.9 #If the matching degree is greater than 0.9, it is considered that the target has been found. 
-                        loc = np.where(res >= threshold)
-                        boxes = [[pt[0], pt[1], pt[0] + w, pt[1] + h] for pt in zip(*loc[::-1])]
-                        boxes = non_max_suppression(boxes) #Reduce the overlap
-                        if len(boxes) == 0:   # Boxes has nothig recorded
-                            print("Not Found") 
-                        display_image = warped_image.copy()
-    
-                        # Draw bounding boxes and calculate scaled positions
-                        for (x1, y1, x2, y2) in boxes:
-                            cv2.rectangle(display_image, (x1, y1), (x2, y2), (0, 0, 255), 2)
-                            center_x, center_y = (x1 + x2) // 2, (y1 + y2) // 2
-                            cv2.circle(display_image, (center_x, center_y), 5, (255, 0, 0), -1)
-                            print(f"Logo: (center_x, center_y) = ({center_x}, {center_y})")
-                            scaled_center_x = round(center_x / self.shape[1] * self.real_size[0], 1)
-                            scaled_center_y = round(center_y / self.shape[0] * self.real_size[1], 1)
-                            print(f"(center_x, center_y) = ({scaled_center_x}, {scaled_center_y})")
+                        result, display_image = self.process_frame(image, logger, getattr(camera, 'frame_info', None))
                             
                         elapsed_time2 = time.time() - end_time
                         #print(f"Processing image time:{elapsed_time2} seconds")
                         file.write(f"{elapsed_time}\t{elapsed_time2}\n")
                         # Display the processed image
-                        cv2.namedWindow('Detected Logo' + self.__class__.__name__, cv2.WINDOW_NORMAL)
-                        cv2.imshow('Detected Logo' + self.__class__.__name__, display_image)
-                        cv2.waitKey(1)
+                        if display_image is not None:
+                            self.show(display_image)
                     except Exception as e:
-                        print(f"Error during image processing: {e}")
+                        logger.error("processing_error", error=str(e))
+                    finally:
+                        if isinstance(image, DualFrame):
+                            image.release()  # Give the request buffers back to the camera
+                    if realtime is not None:
+                        realtime.checkpoint()  # The result is out, the loop waits for the next frame
     
             except KeyboardInterrupt:
-                print("Keyboard Interrupt")
+                logger.info("keyboard_interrupt")
+            finally:
+                if realtime is not None:
+                    realtime.exit(logger)
+                if self.preview is not None:
+                    self.preview.stop()
+                    self.preview = None
+                if exporter is not None:
+                    exporter.stop()
+                    self.metrics = None
+                if profiler is not None:
+                    logger.info("profile_written", files=profiler.stop())
+                self.memory.finish_session(logger, f'{path_parameters}/{mode_name}_memory.txt')
+                if self.matcher is not None and self.matcher.summary():
+                    logger.info("matcher_summary", matcher=self.matcher.name, **self.matcher.summary())
+                if len(self.latency):
+                    self.latency.write(f'{path_parameters}/{mode_name}_latency.txt')
+                    total = self.latency.summary()['total']
+                    logger.info("latency", p50_ms=round(total['p50'], 2), p99_ms=round(total['p99'], 2),
+                                p999_ms=round(total['p99.9'], 2))
+                # Flush the pending events and clean up display windows
+                logger.stop()
+                if not self.headless and self.preview_port is None:
+                    cv2.destroyAllWindows()
+
+
+class MultiDetectProcessor:
+    """
+    Detection on several parameter folders (ROIs and templates) seen by the same camera.
+
+    Every frame is captured once into a shared buffer, then each ROI is warped from it
+    and matched concurrently in a thread pool (OpenCV releases the GIL), and each
+    detector publishes its own results tagged with the name of its folder.
+    """
+    def __init__(self, workers=None, **options):
+        self.workers = workers  # Threads of the pool, default one per ROI
+        self.options = options  # Keyword arguments of every DetectProcessor
+        self.detectors = []
+        self.sinks = []  # Callables sink(name, result), shared by all detectors
+        self.frame = None  # Shared capture buffer
+        self.executor = None
+        self.memory = MemoryMonitor()
+        self.preview = None  # PreviewServer shared by all detectors
+
+    def start_session(self, folders, camera):
+        """Create and start one detector per parameter folder."""
+        self.detectors = []
+        for folder in folders:
+            detector = DetectProcessor(**self.options)
+            detector.sinks = self.sinks
+            detector.start_session(folder, camera, own_frame=False)
+            detector.memory = MemoryMonitor()  # The session is monitored as a whole, tracemalloc is process wide
+            self.detectors.append(detector)
+        self.memory = MemoryMonitor(self.options.get('memory_cap_mb'), self.options.get('memory_report', False))
+        mode_name = list(camera.modes.keys())[camera.current_mode]
+        width, height = camera.modes[mode_name]['size']
+        preallocate = self.options.get('preallocate', True) or self.memory.cap is not None
+        self.frame = np.empty((height, width, 3), dtype=np.uint8) if preallocate else None
+        self.executor = ThreadPoolExecutor(max_workers=self.workers or len(self.detectors))
+
+    def stop_session(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+
+    def capture(self, camera):
+        """Capture one frame for all ROIs."""
+        if self.frame is not None and hasattr(camera, 'capture_into'):
+            return camera.capture_into(self.frame)
+        return camera.capture_image()
+
+    def process_frame(self, image, logger=None, frame=None):
+        """
+        Process all ROIs of a frame concurrently. Return a list of (name, result, display image).
+        An ROI whose detection raises is logged and publishes "Not Found" for this frame, the
+        other ROIs keep their results.
+        """
+        futures = [self.executor.submit(detector.process_frame, image, logger, frame) for detector in self.detectors]
+        outputs = []
+        for detector, future in zip(self.detectors, futures):
+            try:
+                result, display_image = future.result()
+            except Exception as e:
+                if logger is not None:
+                    logger.error("roi_processing_error", roi=detector.name, error=repr(e))
+                result, display_image = detector.publish_failed(frame), detector.last_display
+            outputs.append((detector.name, result, display_image))
+        return outputs
+
+    def write_latency(self, file_path):
+        """Write the latency report of every ROI in one file."""
+        reports = [f"[{detector.name}]\n{detector.latency.report()}" for detector in self.detectors if len(detector.latency)]
+        if reports:
+            with open(file_path, 'w') as file:
+                file.write("\n".join(reports))
+
+    def process_image(self, folders, camera):
+        """Detection loop over several parameter folders."""
+        layout = self.options.get('cpu_layout')
+        if layout is not None:
+            layout.enter('detect')  # Before the thread pool is started
+        self.start_session(folders, camera)
+        mode_name = list(camera.modes.keys())[camera.current_mode]
+        log_folder = os.path.dirname(os.path.normpath(folders[0]))
+        logger = EventLogger(json_path=f'{log_folder}/multi_{mode_name}_events.jsonl',
+                             frame_events=self.options.get('log_frames', False),
+                             frame_sample=self.options.get('log_sample', 10),
+                             max_queue=self.memory.queue_depth(10000, 512))
+        logger.start()
+        if layout is not None:
+            layout.pin_thread(logger.thread, 'output')
+        logger.info("detection_started", folders=[detector.name for detector in self.detectors], mode=mode_name)
+        self.memory.start_session(logger)
+        profiler = None
+        if self.options.get('profile') is not None:
+            names = '+'.join(detector.name for detector in self.detectors)
+            profiler = SessionProfiler(self.options['profile'], f'{log_folder}/profile_multi_{mode_name}_{names}')
+            profiler.start()
+        # Started before the real-time mode and moved to the output cores, see DetectProcessor
+        if self.options.get('preview_port') is not None:
+            self.preview = PreviewServer(self.options['preview_port'])
+            self.preview.start()
+            if layout is not None:
+                for thread in self.preview.threads:
+                    layout.pin_thread(thread, 'output')
+            for detector in self.detectors:
+                detector.preview = self.preview
+            logger.info("preview_started", url=f"http://localhost:{self.preview.port}/")
+        exporter = None
+        loop_metrics = None
+        if self.options.get('metrics_output') is not None:
+            registry = MetricsRegistry()
+            loop_metrics = LoopMetrics(registry)
+            for detector in self.detectors:
+                detector.metrics = DetectionMetrics(registry, detector.name)
+            exporter = MetricsExporter.from_spec(registry, self.options['metrics_output'])
+            exporter.start()
+            if layout is not None:
+                layout.pin_thread(exporter.thread, 'output')
+            logger.info("metrics_started", target=exporter.target)
+        realtime = None
+        if self.options.get('realtime', False):
+            realtime = RealtimeMode()
+            arrays = [self.frame] + [array for detector in self.detectors if detector.buffers is not None
+                                     for array in detector.buffers.arrays]
+            realtime.enter(arrays, logger)
+        with open(f'{log_folder}/multi_{mode_name}_times.txt', 'w') as file:
+            try:
+                end = False
+                while not end:
+                    start_time = time.time()
+                    with self.memory.stage('capture'):
+                        image = self.capture(camera)
+                    logger.frame("captured")
+                    self.memory.check(logger)
+                    end_time = time.time()
+                    if loop_metrics is not None:
+                        loop_metrics.frame_captured(end_time - start_time, getattr(camera, 'frame_info', None))
+                    try:
+                        with self.memory.stage('process'):
+                            outputs = self.process_frame(image, logger, getattr(camera, 'frame_info', None))
+                        file.write(f"{end_time - start_time}\t{time.time() - end_time}\n")
+                        if self.preview is not None:
+                            for name, result, display_image in outputs:
+                                if display_image is not None:
+                                    self.preview.offer(name, display_image)
+                        elif not self.options.get('headless', False):
+                            for name, result, display_image in outputs:
+                                if display_image is None:
+                                    continue  # The first frame of an ROI whose detection failed
+                                cv2.namedWindow('Detected Logo ' + name, cv2.WINDOW_NORMAL)
+                                cv2.imshow('Detected Logo ' + name, display_image)
+                            cv2.waitKey(1)
+                    except Exception as e:
+                        logger.error("processing_error", error=str(e))
+                    if realtime is not None:
+                        realtime.checkpoint()
+            except KeyboardInterrupt:
+                logger.info("keyboard_interrupt")
             finally:
-                # Clean up display windows
-                cv2.destroyAllWindows()
+                if realtime is not None:
+                    realtime.exit(logger)
+                if self.preview is not None:
+                    self.preview.stop()
+                    self.preview = None
+                if exporter is not None:
+                    exporter.stop()
+                if profiler is not None:
+                    logger.info("profile_written", files=profiler.stop())
+                self.stop_session()
+                self.memory.finish_session(logger, f'{log_folder}/multi_{mode_name}_memory.txt')
+                for detector in self.detectors:
+                    if detector.matcher is not None and detector.matcher.summary():
+                        logger.info("matcher_summary", roi=detector.name, matcher=detector.matcher.name,
+                                    **detector.matcher.summary())
+                self.write_latency(f'{log_folder}/multi_{mode_name}_latency.txt')
+                logger.stop()
+                if not self.options.get('headless', False) and self.options.get('preview_port') is None:
+                    cv2.destroyAllWindows()
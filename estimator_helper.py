@@ -0,0 +1,159 @@
+# estimator_helper.py
+import threading
+import time
+import numpy as np
+
+
+class Prediction:
+    """Extrapolated position of a target at time t_ns (monotonic clock), in millimetres."""
+    def __init__(self, roi, t_ns, state, covariance, age_ms):
+        self.roi = roi
+        self.t_ns = t_ns
+        self.x, self.y, self.vx, self.vy = (float(value) for value in state)
+        self.sigma_x = float(np.sqrt(covariance[0, 0]))  # Standard deviation of the position, mm
+        self.sigma_y = float(np.sqrt(covariance[1, 1]))
+        self.age_ms = age_ms  # Time since the exposure of the last measurement
+
+
+class KalmanTrack:
+    """
+    Constant velocity Kalman filter of one target, state (x, y, vx, vy) in mm and mm/s.
+
+    The state is kept at the exposure time of the last measurement. A measurement is
+    applied at its own exposure time, so the processing latency does not lag the track,
+    and predictions extrapolate from there without changing the state.
+    """
+    H = np.array([[1.0, 0.0, 0.0, 0.0], [0.0, 1.0, 0.0, 0.0]])
+
+    def __init__(self, measurement_std=0.5, acceleration_std=200.0, initial_speed_std=200.0):
+        self.r = measurement_std ** 2
+        # Unmodelled acceleration of the target. Too large for the frame interval and the
+        # velocity overshoots on every measurement
+        self.q = acceleration_std ** 2
+        self.initial_speed_var = initial_speed_std ** 2
+        self.state = None
+        self.covariance = None
+        self.t_ns = None
+        self.measurements = 0
+
+    def transition(self, dt):
+        """State transition and process noise over dt seconds."""
+        f = np.eye(4)
+        f[0, 2] = f[1, 3] = dt
+        q = np.zeros((4, 4))
+        q[0, 0] = q[1, 1] = dt ** 4 / 4
+        q[0, 2] = q[2, 0] = q[1, 3] = q[3, 1] = dt ** 3 / 2
+        q[2, 2] = q[3, 3] = dt ** 2
+        return f, q * self.q
+
+    def predict(self, t_ns):
+        """Return the (state, covariance) extrapolated to t_ns."""
+        f, q = self.transition(max(0.0, (t_ns - self.t_ns) / 1e9))
+        return f @ self.state, f @ self.covariance @ f.T + q
+
+    def update(self, t_ns, position):
+        """Correct the track with a position measured at t_ns. Older measurements are ignored."""
+        z = np.asarray(position, dtype=np.float64)
+        if self.state is None:
+            self.state = np.array([z[0], z[1], 0.0, 0.0])
+            self.covariance = np.diag([self.r, self.r, self.initial_speed_var, self.initial_speed_var])
+            self.t_ns = t_ns
+            self.measurements = 1
+            return True
+        if t_ns < self.t_ns:
+            return False
+        state, covariance = self.predict(t_ns)
+        innovation = z - self.H @ state
+        s = self.H @ covariance @ self.H.T + np.eye(2) * self.r
+        gain = covariance @ self.H.T @ np.linalg.inv(s)
+        self.state = state + gain @ innovation
+        self.covariance = (np.eye(4) - gain @ self.H) @ covariance
+        self.t_ns = t_ns
+        self.measurements += 1
+        return True
+
+
+class PositionEstimator:
+    """
+    Predicted positions at a high rate between the camera frames.
+
+    It is a sink of the detectors: every result feeds the track of its ROI with the
+    detection closest to the prediction, timed by the exposure of its frame. Its own
+    thread wakes up rate_hz times per second, independently of the detection loop,
+    and hands a Prediction of every ROI to each output(roi, prediction).
+    """
+    def __init__(self, rate_hz=500.0, outputs=None, measurement_std=0.5, acceleration_std=200.0):
+        self.period_ns = int(1e9 / rate_hz)
+        self.outputs = outputs if outputs is not None else []
+        self.measurement_std = measurement_std
+        self.acceleration_std = acceleration_std
+        self.tracks = {}  # ROI name -> KalmanTrack
+        self.latest = {}  # ROI name -> last Prediction
+        self.lock = threading.Lock()
+        self.thread = None
+        self.running = False
+        self.ticks = 0
+        self.late_ticks = 0  # Ticks skipped because the thread fell behind
+
+    def __call__(self, roi, result):
+        if not result.detections:
+            return
+        t_ns = result.frame.exposure_ns if result.frame is not None else time.monotonic_ns()
+        with self.lock:
+            track = self.tracks.get(roi)
+            if track is None:
+                track = self.tracks[roi] = KalmanTrack(self.measurement_std, self.acceleration_std)
+            if track.state is None:
+                detection = result.detections[0]
+            else:
+                predicted = track.predict(t_ns)[0]
+                detection = min(result.detections, key=lambda d: (d.center_mm[0] - predicted[0]) ** 2
+                                                                 + (d.center_mm[1] - predicted[1]) ** 2)
+            track.update(t_ns, detection.center_mm)
+
+    def predict(self, roi, t_ns=None):
+        """Return the Prediction of a ROI at t_ns (default now), None before its first measurement."""
+        t_ns = time.monotonic_ns() if t_ns is None else t_ns
+        with self.lock:
+            track = self.tracks.get(roi)
+            if track is None or track.state is None:
+                return None
+            state, covariance = track.predict(t_ns)
+            return Prediction(roi, t_ns, state, covariance, (t_ns - track.t_ns) / 1e6)
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self._run, name='PositionEstimator', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def close(self):
+        self.stop()
+
+    def _run(self):
+        """Emit the predictions on a fixed schedule of the monotonic clock."""
+        next_tick = time.monotonic_ns()
+        while self.running:
+            now = time.monotonic_ns()
+            for roi in list(self.tracks):
+                prediction = self.predict(roi, now)
+                if prediction is None:
+                    continue
+                self.latest[roi] = prediction
+                for output in self.outputs:
+                    output(roi, prediction)
+            self.ticks += 1
+            next_tick += self.period_ns
+            delay = next_tick - time.monotonic_ns()
+            if delay > 0:
+                time.sleep(delay / 1e9)
+            else:
+                # Behind schedule: skip the missed ticks instead of emitting a burst
+                missed = -delay // self.period_ns + 1
+                self.late_ticks += missed
+                next_tick += missed * self.period_ns
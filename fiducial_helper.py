@@ -0,0 +1,137 @@
+# fiducial_helper.py
+import time
+import cv2
+import numpy as np
+
+
+class FiducialLocator:
+    """
+    ROI corners from four ArUco markers placed at the corners of the workspace.
+
+    Marker corner_ids[i] marks ROI corner i, clockwise from the top left (top left, top
+    right, bottom right, bottom left), with its own corner i: printed upright and placed
+    inside the workspace, the top left marker gives its top left corner, and so on.
+    The markers are searched in a copy shrunk to detect_width pixels, and their corners
+    are refined with sub-pixel accuracy on the full resolution image.
+    dictionary is a cv2.aruco predefined dictionary, by default DICT_4X4_50. OpenCV builds
+    before 4.7 (no ArucoDetector) use the cv2.aruco.detectMarkers function instead.
+    """
+
+    def __init__(self, dictionary=None, corner_ids=(0, 1, 2, 3), detect_width=1600):
+        if not hasattr(cv2, 'aruco'):
+            raise RuntimeError("The corner markers need OpenCV with the aruco module (opencv-contrib-python)")
+        self.corner_ids = corner_ids
+        self.detect_width = detect_width
+        self.dictionary = cv2.aruco.getPredefinedDictionary(cv2.aruco.DICT_4X4_50 if dictionary is None else dictionary)
+        if hasattr(cv2.aruco, 'ArucoDetector'):
+            self.detector = cv2.aruco.ArucoDetector(self.dictionary, cv2.aruco.DetectorParameters())
+            self.parameters = None
+        else:  # OpenCV < 4.7
+            self.detector = None
+            self.parameters = cv2.aruco.DetectorParameters_create()
+        self.criteria = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 30, 0.01)
+
+    def markers(self, gray):
+        """Return {marker id: 4x2 float32 corners} of the markers found in a gray image."""
+        scale = min(1.0, self.detect_width / float(gray.shape[1]))
+        small = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA) if scale < 1.0 else gray
+        if self.detector is not None:
+            corners, ids, _ = self.detector.detectMarkers(small)
+        else:
+            corners, ids, _ = cv2.aruco.detectMarkers(small, self.dictionary, parameters=self.parameters)
+        if ids is None:
+            return {}
+        points = np.concatenate(corners).reshape(-1, 1, 2) / scale
+        # The search window covers the error of the shrunk detection
+        window = max(5, int(round(1.5 / scale)))
+        points = cv2.cornerSubPix(gray, points.astype(np.float32), (window, window), (-1, -1), self.criteria)
+        return {int(marker_id): points[4 * i:4 * i + 4].reshape(4, 2) for i, marker_id in enumerate(ids.ravel())}
+
+    def corners_from(self, markers):
+        """The four ROI corners (top left, top right, bottom right, bottom left), None if a marker is missing."""
+        if any(marker_id not in markers for marker_id in self.corner_ids):
+            return None
+        return [tuple(float(v) for v in markers[marker_id][i]) for i, marker_id in enumerate(self.corner_ids)]
+
+    def locate(self, image):
+        """Return the ROI corners found in a frame, None when a corner marker is not visible."""
+        markers = self.find(image)
+        return None if markers is None else self.corners_from(markers)
+
+    def markers_near(self, image, reference, radius=None):
+        """
+        Find the corner markers again in windows around their positions in `reference`
+        ({marker id: corners}), much cheaper than a full frame search. The windows reach
+        `radius` pixels beyond each marker, by default its own side length. Return None
+        when one of them is not found, e.g. hidden by the print head.
+        """
+        height, width = image.shape[:2]
+        markers = {}
+        for marker_id in self.corner_ids:
+            corners = reference[marker_id]
+            side = float(np.linalg.norm(corners[0] - corners[1]))
+            reach = int(side if radius is None else radius)
+            x1, y1 = (int(value) - reach for value in corners.min(axis=0))
+            x2, y2 = (int(value) + reach + 1 for value in corners.max(axis=0))
+            x1, y1, x2, y2 = max(0, x1), max(0, y1), min(width, x2), min(height, y2)
+            if x2 <= x1 or y2 <= y1:
+                return None
+            window = image[y1:y2, x1:x2]
+            found = self.markers(cv2.cvtColor(window, cv2.COLOR_BGR2GRAY) if window.ndim == 3 else window)
+            if marker_id not in found:
+                return None
+            markers[marker_id] = found[marker_id] + np.array([x1, y1], dtype=np.float32)
+        return markers
+
+    def find(self, image):
+        """Return {marker id: corners} of the corner markers in a full frame, None if one is missing."""
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+        markers = self.markers(gray)
+        if any(marker_id not in markers for marker_id in self.corner_ids):
+            return None
+        return {marker_id: markers[marker_id] for marker_id in self.corner_ids}
+
+    def motion(self, reference, markers):
+        """Homography moving the reference marker corners onto the new ones, and the largest corner shift in pixels."""
+        source = np.concatenate([reference[marker_id] for marker_id in self.corner_ids])
+        target = np.concatenate([markers[marker_id] for marker_id in self.corner_ids])
+        homography, _ = cv2.findHomography(source, target)
+        return homography, float(np.linalg.norm(target - source, axis=1).max())
+
+
+def order_corners(corners):
+    """Top left, top right, bottom left, bottom right: the order of SortPoint and points.txt."""
+    top_left, top_right, bottom_right, bottom_left = corners
+    return [top_left, top_right, bottom_left, bottom_right]
+
+
+def front_view_shape(corners):
+    """(height, width, 3) of the front view rectified from the corners, as imgcorr computes it."""
+    top_left, top_right, bottom_left, _ = order_corners(corners)
+    width = int(np.hypot(top_left[0] - top_right[0], top_left[1] - top_right[1]))
+    height = int(np.hypot(top_left[0] - bottom_left[0], top_left[1] - bottom_left[1]))
+    return height, width, 3
+
+
+def save_points(file_path, corners):
+    """Write the corners and the front view shape in the format of points.txt, with sub-pixel corners."""
+    with open(file_path, 'w') as file:
+        for x, y in order_corners(corners):
+            file.write(f"{x:.2f},{y:.2f}\n")
+        height, width, channels = front_view_shape(corners)
+        file.write(f"{height},{width},{channels}\n")
+
+
+def calibrate_roi(image, folder, locator=None):
+    """
+    Locate the marker corners in a frame and write points.txt of a parameter folder.
+    Return the corners, or None when a marker was not found.
+    """
+    locator = locator or FiducialLocator()
+    start = time.perf_counter()
+    corners = locator.locate(image)
+    if corners is None:
+        return None
+    save_points(f"{folder}/points.txt", corners)
+    print(f"Corners located from the markers in {(time.perf_counter() - start) * 1000:.0f} ms")
+    return corners
@@ -0,0 +1,91 @@
+# latency_helper.py
+import time
+from collections import deque
+import numpy as np
+
+
+class FrameInfo:
+    """
+    Picamera2 request metadata that travels with a captured frame.
+
+    SensorTimestamp is the start of the exposure in nanoseconds of the monotonic clock,
+    the same clock as time.monotonic_ns(). The middle of the exposure is taken as the
+    moment the position was actually seen.
+    """
+    def __init__(self, sequence, sensor_timestamp, exposure_time=0, frame_duration=0, capture_ns=None):
+        self.sequence = sequence  # Frame counter of the session
+        self.sensor_timestamp = sensor_timestamp  # ns
+        self.exposure_time = exposure_time  # us
+        self.frame_duration = frame_duration  # us
+        self.capture_ns = capture_ns if capture_ns is not None else time.monotonic_ns()  # Frame available in memory
+
+    @classmethod
+    def from_metadata(cls, sequence, metadata):
+        """Build the frame info from the metadata dict of a completed request."""
+        return cls(sequence, metadata.get('SensorTimestamp', time.monotonic_ns()),
+                   metadata.get('ExposureTime', 0), metadata.get('FrameDuration', 0))
+
+    @property
+    def exposure_ns(self):
+        """Middle of the exposure, in ns of the monotonic clock."""
+        return self.sensor_timestamp + self.exposure_time * 500
+
+    def intact(self):
+        """True while the frame buffer still holds this frame. A private buffer always does."""
+        return True
+
+
+class LatencyTracker:
+    """
+    Collects the delays of every published frame and reports their percentiles.
+
+    The stages are:
+    - capture:    middle of the exposure -> frame available in memory
+    - processing: frame available -> result ready for output
+    - publish:    result ready -> all sinks called
+    - total:      middle of the exposure -> all sinks called
+    """
+    STAGES = ('capture', 'processing', 'publish', 'total')
+    PERCENTILES = (50, 90, 99, 99.9)
+    SAMPLE_BYTES = 4 * 32  # Memory of the samples of one frame (4 floats in deques)
+
+    def __init__(self, max_samples=100000):
+        # Only the latest max_samples frames are kept, a long session would grow without bound
+        self.samples = {stage: deque(maxlen=max_samples) for stage in self.STAGES}
+
+    def add(self, frame, output_ns, published_ns):
+        """Record the delays of one frame, in milliseconds."""
+        exposure_ns = frame.exposure_ns
+        self.samples['capture'].append((frame.capture_ns - exposure_ns) / 1e6)
+        self.samples['processing'].append((output_ns - frame.capture_ns) / 1e6)
+        self.samples['publish'].append((published_ns - output_ns) / 1e6)
+        self.samples['total'].append((published_ns - exposure_ns) / 1e6)
+
+    def __len__(self):
+        return len(self.samples['total'])
+
+    def summary(self):
+        """Return {stage: {'mean': ..., 'p50': ..., 'p90': ..., 'p99': ..., 'p99.9': ..., 'max': ...}} in ms."""
+        summary = {}
+        for stage, values in self.samples.items():
+            if not values:
+                continue
+            values = np.asarray(values)
+            stats = {'mean': float(values.mean())}
+            for percentile, value in zip(self.PERCENTILES, np.percentile(values, self.PERCENTILES)):
+                stats[f'p{percentile}'] = float(value)
+            stats['max'] = float(values.max())
+            summary[stage] = stats
+        return summary
+
+    def report(self):
+        """Return the summary as a text table."""
+        lines = [f"Latency over {len(self)} frames (ms)",
+                 "stage\tmean\t" + "\t".join(f"p{p}" for p in self.PERCENTILES) + "\tmax"]
+        for stage, stats in self.summary().items():
+            lines.append(f"{stage}\t" + "\t".join(f"{value:.2f}" for value in stats.values()))
+        return "\n".join(lines) + "\n"
+
+    def write(self, file_path):
+        with open(file_path, 'w') as file:
+            file.write(self.report())
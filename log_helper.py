@@ -0,0 +1,139 @@
+# log_helper.py
+import json
+import queue
+import sys
+import threading
+import time
+
+
+LEVELS = {'debug': 10, 'info': 20, 'warning': 30, 'error': 40}
+
+
+class EventLogger:
+    """
+    Structured, levelled event log handled by a background writer thread.
+
+    The detection loop only builds a small dict and puts it on a queue, so a slow
+    terminal (e.g. SSH/MobaXterm) can no longer block the capture and matching.
+    The writer thread drains the queue in batches and renders every record both as
+    a console line and, when json_path is given, as one JSON object per line.
+
+    Per-frame events are disabled by default. When enabled they are sampled: only
+    one out of every frame_sample calls of the same event is recorded.
+    """
+
+    def __init__(self, level='info', json_path=None, console=True, frame_events=False,
+                 frame_sample=10, batch_size=64, flush_interval=0.5, max_queue=10000):
+        self.level = LEVELS[level]
+        self.json_path = json_path
+        self.console = console
+        self.frame_events = frame_events
+        self.frame_sample = max(1, int(frame_sample))
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.dropped = 0  # Records discarded because the queue was full
+        self.frame_counters = {}  # Number of calls per per-frame event, used for sampling
+        self.frame_lock = threading.Lock()  # frame() is called from the threads of the Multi-ROI pool
+        self.thread = None
+        self.json_file = None
+
+    def start(self):
+        """Open the JSON output and start the writer thread."""
+        if self.thread is not None:
+            return
+        if self.json_path is not None:
+            self.json_file = open(self.json_path, 'a')
+        self.thread = threading.Thread(target=self._run, name='EventLogger', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """Flush all pending records and stop the writer thread."""
+        if self.thread is None:
+            return
+        self.queue.put(None)  # Sentinel, always accepted after the writer drained the queue
+        self.thread.join()
+        self.thread = None
+        if self.dropped:
+            sys.stdout.write(f"[WARNING] event_log_dropped count={self.dropped}\n")
+            sys.stdout.flush()
+        if self.json_file is not None:
+            self.json_file.close()
+            self.json_file = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+
+    def log(self, level, event, **fields):
+        """Queue a record without blocking. Records below the configured level are ignored."""
+        if LEVELS[level] < self.level:
+            return
+        record = {'ts': time.time(), 'level': level, 'event': event}
+        record.update(fields)
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def debug(self, event, **fields):
+        self.log('debug', event, **fields)
+
+    def info(self, event, **fields):
+        self.log('info', event, **fields)
+
+    def warning(self, event, **fields):
+        self.log('warning', event, **fields)
+
+    def error(self, event, **fields):
+        self.log('error', event, **fields)
+
+    def frame(self, event, **fields):
+        """Record a per-frame event, only when enabled and only one out of frame_sample calls."""
+        if not self.frame_events:
+            return
+        with self.frame_lock:
+            count = self.frame_counters.get(event, 0)
+            self.frame_counters[event] = count + 1
+        if count % self.frame_sample == 0:
+            self.log('info', event, **fields)
+
+    def _format_console(self, record):
+        """Render a record as a single human readable line."""
+        fields = ' '.join(f"{key}={value}" for key, value in record.items()
+                          if key not in ('ts', 'level', 'event'))
+        return f"[{record['level'].upper()}] {record['event']} {fields}".rstrip() + "\n"
+
+    def _write_batch(self, batch):
+        """Write a batch of records with a single write call per output."""
+        if self.console:
+            sys.stdout.write(''.join(self._format_console(record) for record in batch))
+            sys.stdout.flush()
+        if self.json_file is not None:
+            self.json_file.write(''.join(json.dumps(record, default=str) + "\n" for record in batch))
+            self.json_file.flush()
+
+    def _run(self):
+        """Writer thread: wait for a record, then drain up to batch_size records at once."""
+        end = False
+        while not end:
+            try:
+                record = self.queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                continue
+            batch = []
+            while record is not None:
+                batch.append(record)
+                if len(batch) >= self.batch_size:
+                    break
+                try:
+                    record = self.queue.get_nowait()
+                except queue.Empty:
+                    break
+            if record is None:
+                end = True
+            if batch:
+                self._write_batch(batch)
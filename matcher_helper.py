@@ -0,0 +1,811 @@
+# matcher_helper.py
+import hashlib
+import os
+import cv2
+import numpy as np
+
+
+def non_max_suppression(boxes, overlapThresh=0.3):
+    """
+    Implement non-max suppression to filter overlapping bounding boxes.
+    
+    This function takes a list of bounding boxes and an overlap threshold as input.
+    It returns a list of bounding boxes that are selected based on their overlap with other boxes.
+    
+    Parameters:
+    - boxes: A list of bounding boxes, where each box is represented by a list of four numbers (x1, y1, x2, y2).
+    - overlapThresh: A float representing the threshold for overlap. Boxes with overlap greater than this value are suppressed.
+    
+    Returns:
+    - A list of bounding boxes that are selected after applying non-max suppression.
+    """
+    
+    # If no target box found
+    if len(boxes) == 0:
+        return []
+    
+    # Convert the list of boxes to a numpy array for easier manipulation
+    boxes = np.array(boxes, dtype="float")
+    
+    # The boxes that are selected
+    pick = []
+    
+    # the coordinates of the boxes
+    x1, y1, x2, y2 = boxes[:, 0], boxes[:, 1], boxes[:, 2], boxes[:, 3]
+    
+    # the area of each box
+    area = (x2 - x1 + 1) * (y2 - y1 + 1)
+    idxs = np.argsort(y2)
+    
+    # While there are still indices to process
+    while len(idxs) > 0:
+        last = len(idxs) - 1
+        i = idxs[last]
+        
+        pick.append(i)
+        
+        # Calculate the coordinates of the intersection rectangle
+        xx1 = np.maximum(x1[i], x1[idxs[:last]])
+        yy1 = np.maximum(y1[i], y1[idxs[:last]])
+        xx2 = np.minimum(x2[i], x2[idxs[:last]])
+        yy2 = np.minimum(y2[i], y2[idxs[:last]])
+        
+        # Calculate the width and height of the intersection rectangle
+        w = np.maximum(0, xx2 - xx1 + 1)
+        h = np.maximum(0, yy2 - yy1 + 1)
+        
+        # Calculate the overlap between the current box and the other boxes
+        overlap = (w * h) / area[idxs[:last]]
+        
+        # Delete the indices of the boxes that have an overlap greater than the threshold
+        idxs = np.delete(idxs, np.concatenate(([last], np.where(overlap > overlapThresh)[0])))
+    
+    # Return the boxes that were picked after applying non-max suppression
+    return boxes[pick].astype("int")
+
+
+class Detection:
+    """One located target in the rectified ROI."""
+    def __init__(self, box, center_px, center_mm=None, score=None, angle=0.0):
+        self.box = box  # (x1, y1, x2, y2) in rectified pixels
+        self.center_px = center_px  # (x, y) in rectified pixels
+        self.center_mm = center_mm  # (x, y) in millimetres of the real ROI, filled in by the detector
+        self.score = score  # Matching score, None if the engine has none
+        self.angle = angle  # Rotation in degrees, 0 for the template matcher
+
+
+class DetectionResult:
+    """Outcome of processing one frame."""
+    def __init__(self, detections, image=None, cached=False):
+        self.detections = detections  # List of Detection
+        self.image = image  # Rectified BGR image the detections refer to
+        self.cached = cached  # True when the previous result was reused by the motion gate
+        self.timings = {}  # Stage name -> seconds
+        self.image_scale = 1.0  # Pixels of image per rectified pixel of the detections
+        self.frame = None  # FrameInfo of the frame the result was published for
+        self.latency_ms = None  # Middle of the exposure -> result ready for output
+
+    @property
+    def found(self):
+        return len(self.detections) > 0
+
+    def as_cached(self):
+        """Return a copy of this result marked as reused."""
+        result = DetectionResult(self.detections, self.image, cached=True)
+        result.image_scale = self.image_scale
+        return result
+
+
+class IncrementalMatcher:
+    """
+    TM_CCOEFF_NORMED response map that is only recomputed where the image changed.
+
+    The rectified ROI is divided into tiles of tile_size pixels. A tile is changed
+    when one of its pixels differs from the reference by more than change_threshold
+    gray levels. A response value at (x, y) depends on the window [x, x + w) x [y, y + h),
+    so each horizontal run of changed tiles is dilated by the template size to the left
+    and top, recomputed with cv2.matchTemplate and written into the persistent map.
+    Everything else of the map is kept from the previous frames.
+    """
+
+    def __init__(self, template_gray, tile_size=64, change_threshold=8, full_fraction=0.5):
+        self.template_gray = template_gray
+        self.tile_size = tile_size
+        self.change_threshold = change_threshold
+        self.full_fraction = full_fraction  # Above this fraction of changed tiles a full pass is cheaper
+        self.reference = None  # Pixels the current response map was computed from
+        self.response = None  # Persistent response map
+        self.stats = {'tiles_changed': 0, 'tiles_total': 0, 'recomputed_fraction': 0.0}
+
+    def reset(self):
+        """Drop the persistent state, the next frame is fully recomputed."""
+        self.reference = None
+        self.response = None
+
+    def full(self, target_gray):
+        """Recompute the whole response map."""
+        self.reference = target_gray.copy()
+        self.response = cv2.matchTemplate(target_gray, self.template_gray, cv2.TM_CCOEFF_NORMED)
+        rows = -(-target_gray.shape[0] // self.tile_size)
+        cols = -(-target_gray.shape[1] // self.tile_size)
+        self.stats = {'tiles_changed': rows * cols, 'tiles_total': rows * cols, 'recomputed_fraction': 1.0}
+        return self.response
+
+    def changed_tiles(self, target_gray):
+        """Return a uint8 grid with 1 for every tile that changed since the reference."""
+        diff = cv2.absdiff(target_gray, self.reference)
+        height, width = diff.shape
+        rows = -(-height // self.tile_size)
+        cols = -(-width // self.tile_size)
+        # Pad to a multiple of the tile size so the tiles can be reduced with a reshape
+        padded = np.zeros((rows * self.tile_size, cols * self.tile_size), dtype=np.uint8)
+        padded[:height, :width] = diff
+        tile_max = padded.reshape(rows, self.tile_size, cols, self.tile_size).max(axis=(1, 3))
+        return (tile_max > self.change_threshold).astype(np.uint8)
+
+    def match(self, target_gray):
+        """Update and return the response map for a new rectified gray image."""
+        if self.reference is None or self.reference.shape != target_gray.shape:
+            return self.full(target_gray)
+
+        grid = self.changed_tiles(target_gray)
+        tiles_changed = int(grid.sum())
+        self.stats = {'tiles_changed': tiles_changed, 'tiles_total': grid.size, 'recomputed_fraction': 0.0}
+        if tiles_changed == 0:
+            return self.response
+
+        if tiles_changed > self.full_fraction * grid.size:
+            return self.full(target_gray)
+
+        h, w = self.template_gray.shape
+        height, width = target_gray.shape
+        resp_h, resp_w = self.response.shape
+        recomputed = 0
+        for tx0, tx1, ty in self.changed_runs(grid):
+            x0 = tx0 * self.tile_size
+            y0 = ty * self.tile_size
+            x1 = min(tx1 * self.tile_size, width)
+            y1 = min((ty + 1) * self.tile_size, height)
+            # Response positions whose window overlaps the changed pixels
+            rx0, ry0 = max(x0 - w + 1, 0), max(y0 - h + 1, 0)
+            rx1, ry1 = min(x1, resp_w), min(y1, resp_h)
+            if rx0 < rx1 and ry0 < ry1:
+                sub = target_gray[ry0:ry1 + h - 1, rx0:rx1 + w - 1]
+                self.response[ry0:ry1, rx0:rx1] = cv2.matchTemplate(sub, self.template_gray, cv2.TM_CCOEFF_NORMED)
+                recomputed += (ry1 - ry0) * (rx1 - rx0)
+            self.reference[y0:y1, x0:x1] = target_gray[y0:y1, x0:x1]
+        self.stats['recomputed_fraction'] = recomputed / float(resp_h * resp_w)
+        return self.response
+
+    def changed_runs(self, grid):
+        """Yield (first column, last column + 1, row) for each horizontal run of changed tiles."""
+        for ty in np.flatnonzero(grid.any(axis=1)):
+            # Run boundaries are where the padded row switches between 0 and 1
+            edges = np.flatnonzero(np.diff(np.concatenate(([0], grid[ty], [0]))))
+            for tx0, tx1 in zip(edges[::2], edges[1::2]):
+                yield int(tx0), int(tx1), int(ty)
+
+
+class FeatureMatcher:
+    """
+    Binary feature (ORB/AKAZE) localisation of the template, robust to rotation.
+
+    Keypoints and descriptors of the template are extracted once and cached in the
+    parameter folder. For every frame features are only detected in the rectified ROI,
+    or in a window around the last hit while the target is tracked. They are matched
+    with a Hamming brute-force matcher and the pose of the template (translation,
+    rotation and scale) is estimated with RANSAC.
+
+    Features need corners and texture inside the template: both descriptors sample a
+    patch of about 31 pixels around each keypoint, so templates smaller than
+    MIN_TEMPLATE_SIZE pixels on a side are refused. Upscaling does not help, it adds no
+    corners. The shipped templates (19x18 and 8x8 blurred dots) do not qualify.
+    """
+
+    MIN_TEMPLATE_SIZE = 32
+
+    def __init__(self, template_gray, method='orb', cache_path=None, ratio=0.8, min_inliers=8,
+                 min_confidence=0.3, track_margin=3.0, max_features=10000, levels=1):
+        self.template_gray = template_gray
+        self.method = method
+        self.cache_path = cache_path
+        self.ratio = ratio  # Lowe ratio test between the best and second best match
+        self.min_inliers = min_inliers
+        self.min_confidence = min_confidence
+        self.track_margin = track_margin  # Tracking window size in multiples of the template size
+        h, w = template_gray.shape
+        if min(h, w) < self.MIN_TEMPLATE_SIZE:
+            raise ValueError(f"The {method} matcher needs a template of at least {self.MIN_TEMPLATE_SIZE}x"
+                             f"{self.MIN_TEMPLATE_SIZE} pixels, this one is {w}x{h}: use the template matcher, "
+                             f"or crop a larger template with texture")
+        # ORB needs a border of patch_size pixels around each keypoint, small templates need small patches
+        self.patch_size = max(7, min(31, (min(h, w) // 2) | 1))
+        # The camera is fixed above the workspace, so the template keeps its scale and a
+        # single pyramid level spends the whole feature budget at the right scale
+        self.levels = levels
+        self.detector = self.create_detector(max_features)
+        self.matcher = cv2.BFMatcher(cv2.NORM_HAMMING)
+        self.template_points, self.descriptors = self.template_features()
+        self.last_center = None
+
+    def create_detector(self, max_features):
+        """Create the binary feature detector."""
+        if self.method == 'orb':
+            return cv2.ORB_create(nfeatures=max_features, nlevels=self.levels, edgeThreshold=self.patch_size,
+                                  patchSize=self.patch_size, fastThreshold=10)
+        if self.method == 'akaze':
+            return cv2.AKAZE_create()
+        raise ValueError(f"Unknown feature method: {self.method}")
+
+    def cache_key(self):
+        """Identify the template pixels and the detector settings the cache was built with."""
+        digest = hashlib.sha1(self.template_gray.tobytes()).hexdigest()
+        return f"{self.method}:{self.patch_size}:{self.levels}:{self.template_gray.shape}:{digest}"
+
+    def template_features(self):
+        """Load the template keypoints from the cache, or extract and cache them."""
+        key = self.cache_key()
+        if self.cache_path is not None and os.path.exists(self.cache_path):
+            cache = np.load(self.cache_path)
+            if str(cache['key']) == key:
+                return cache['points'], cache['descriptors']
+
+        # Pad the template so that keypoints close to its border can be described
+        pad = self.patch_size
+        padded = cv2.copyMakeBorder(self.template_gray, pad, pad, pad, pad, cv2.BORDER_REPLICATE)
+        keypoints, descriptors = self.detector.detectAndCompute(padded, None)
+        if descriptors is None or len(keypoints) < self.min_inliers:
+            raise ValueError(f"Template has too few {self.method} features ({len(keypoints)}, "
+                             f"{self.min_inliers} needed) to be localised: use the template matcher")
+        points = np.array([kp.pt for kp in keypoints], dtype=np.float32) - pad
+        if self.cache_path is not None:
+            np.savez(self.cache_path, key=key, points=points, descriptors=descriptors)
+        return points, descriptors
+
+    def search_window(self, shape):
+        """Return the (x, y, w, h) area to detect features in."""
+        height, width = shape
+        if self.last_center is None:
+            return 0, 0, width, height
+        h, w = self.template_gray.shape
+        half_w, half_h = int(w * self.track_margin), int(h * self.track_margin)
+        x0, y0 = max(self.last_center[0] - half_w, 0), max(self.last_center[1] - half_h, 0)
+        x1, y1 = min(self.last_center[0] + half_w, width), min(self.last_center[1] + half_h, height)
+        return x0, y0, x1 - x0, y1 - y0
+
+    def locate(self, target_gray, window):
+        """Estimate the template pose inside one window. Return (matrix, inlier ratio) or None."""
+        x, y, w, h = window
+        keypoints, descriptors = self.detector.detectAndCompute(target_gray[y:y + h, x:x + w], None)
+        if descriptors is None or len(keypoints) < 2:
+            return None
+        good = [m[0] for m in self.matcher.knnMatch(self.descriptors, descriptors, k=2)
+                if len(m) == 2 and m[0].distance < self.ratio * m[1].distance]
+        if len(good) < self.min_inliers:
+            return None
+        src = self.template_points[[m.queryIdx for m in good]]
+        dst = np.array([keypoints[m.trainIdx].pt for m in good], dtype=np.float32) + (x, y)
+        matrix, inliers = cv2.estimateAffinePartial2D(src, dst, method=cv2.RANSAC, ransacReprojThreshold=3.0)
+        if matrix is None or int(inliers.sum()) < self.min_inliers:
+            return None
+        return matrix, float(inliers.sum()) / len(good)
+
+    def match(self, target_gray):
+        """Return a list of (box, center, confidence, angle) for the located template."""
+        window = self.search_window(target_gray.shape)
+        found = self.locate(target_gray, window)
+        if found is None and self.last_center is not None:
+            # Lost in the tracking window, search the whole ROI again
+            self.last_center = None
+            found = self.locate(target_gray, self.search_window(target_gray.shape))
+        if found is None:
+            self.last_center = None
+            return []
+        matrix, confidence = found
+        if confidence < self.min_confidence:
+            self.last_center = None
+            return []
+
+        h, w = self.template_gray.shape
+        corners = np.array([[0, 0], [w, 0], [0, h], [w, h], [w / 2.0, h / 2.0]], dtype=np.float32)
+        projected = corners @ matrix[:, :2].T + matrix[:, 2]
+        x1, y1 = np.floor(projected[:4].min(axis=0)).astype(int)
+        x2, y2 = np.ceil(projected[:4].max(axis=0)).astype(int)
+        center = (int(round(projected[4, 0])), int(round(projected[4, 1])))
+        angle = float(np.degrees(np.arctan2(matrix[1, 0], matrix[0, 0])))
+        self.last_center = center
+        return [((int(x1), int(y1), int(x2), int(y2)), center, confidence, angle)]
+
+
+class GradientMatcher:
+    """
+    LINE-MOD style matcher on quantized gradient orientations.
+
+    Gradient orientations are quantized into 8 bins over 180 degrees and stored as one
+    bit per pixel. The bits of the frame are spread (OR-ed) over a T x T neighbourhood,
+    so a small displacement still hits the right orientation. For each of the 8 template
+    orientations a lookup table turns the spread byte into a similarity of 0..4, and the
+    response maps are linearized by T so that candidate positions on a grid of step T are
+    scored with plain slice additions. The spread score is an upper bound of the exact
+    score, so the best grid hits are refined and accepted on the exact orientations.
+
+    Orientations do not depend on the brightness, and the gradient magnitude thresholds
+    are relative to the template: its features are picked among its magnitude_percentile
+    percent strongest gradients, and a frame pixel counts from frame_fraction of the
+    weakest of them on. The target still matches when the room lighting halves its
+    contrast, while the weaker texture of the grid paper is ignored.
+    """
+
+    BINS = 8
+    BIT_LUT = np.array([1 << (i % 8) for i in range(256)], dtype=np.uint8)  # Bin index -> orientation bit
+
+    def __init__(self, template_gray, threshold=0.9, spread=None, max_features=63, magnitude_percentile=25.0,
+                 frame_fraction=0.45, max_candidates=64):
+        self.template_gray = template_gray
+        self.threshold = threshold  # Normalized score in [0, 1]
+        self.max_candidates = max_candidates  # Grid hits refined at full resolution, best first
+        if spread is None:
+            # Below 4 the grid saves little over scoring every position, a wider spread
+            # lets the grid paper of the workspace match almost everywhere
+            spread = max(4, min(template_gray.shape) // 16)
+        self.spread = spread  # T, also the step of the coarse grid
+        self.luts = self.response_luts()
+        magnitude, labels = self.quantize(template_gray, 0.0)
+        inner = magnitude[1:-1, 1:-1][labels[1:-1, 1:-1] > 0]
+        if inner.size == 0:
+            raise ValueError("Template has no gradient to be matched")
+        self.feature_magnitude = float(np.percentile(inner, 100.0 - magnitude_percentile))
+        self.magnitude_threshold = frame_fraction * self.feature_magnitude  # Frame pixels weaker than this are ignored
+        self.features = self.template_features(magnitude, labels, max_features)  # Array of (x, y, orientation)
+        if len(self.features) == 0:
+            raise ValueError("Template has no gradient strong enough to be matched")
+        self.max_score = 4 * len(self.features)
+
+    def quantize(self, gray, magnitude_threshold=None):
+        """Return the gradient magnitude and the orientation bit of every pixel (0 where weak)."""
+        if magnitude_threshold is None:
+            magnitude_threshold = self.magnitude_threshold
+        dx = cv2.Sobel(gray, cv2.CV_32F, 1, 0, ksize=3)
+        dy = cv2.Sobel(gray, cv2.CV_32F, 0, 1, ksize=3)
+        magnitude = cv2.magnitude(dx, dy)
+        # Rounded to the nearest bin of 180 / 8 degrees, the mask folds 360 degrees onto 180
+        bins = np.bitwise_and(cv2.convertScaleAbs(cv2.phase(dx, dy, angleInDegrees=True), alpha=self.BINS / 180.0),
+                              self.BINS - 1)
+        labels = cv2.LUT(bins, self.BIT_LUT)
+        labels[magnitude <= magnitude_threshold] = 0
+        return magnitude, labels
+
+    def response_luts(self):
+        """For each orientation, a 256 entry table from a spread byte to the best similarity 0..4."""
+        luts = np.zeros((self.BINS, 256), dtype=np.uint8)
+        for orientation in range(self.BINS):
+            for byte in range(1, 256):
+                best = 0
+                for bit in range(self.BINS):
+                    if byte & (1 << bit):
+                        diff = abs(orientation - bit) * 180.0 / self.BINS
+                        best = max(best, int(4 * abs(np.cos(np.radians(diff))) + 1e-6))
+                luts[orientation, byte] = best
+        return luts
+
+    def template_features(self, magnitude, labels, max_features):
+        """Pick up to max_features strong and scattered gradient points of the template."""
+        # The 3x3 gradient of the border pixels depends on what surrounds the template
+        ys, xs = np.nonzero(magnitude[1:-1, 1:-1] >= self.feature_magnitude)
+        ys, xs = ys + 1, xs + 1
+        order = np.argsort(-magnitude[ys, xs])
+        min_distance = max(1.0, np.sqrt(len(order) / float(max_features)))
+        features = []
+        for index in order:
+            x, y = xs[index], ys[index]
+            if all((x - fx) ** 2 + (y - fy) ** 2 >= min_distance ** 2 for fx, fy, _ in features):
+                features.append((int(x), int(y), int(np.log2(labels[y, x]))))
+                if len(features) == max_features:
+                    break
+        return np.array(features, dtype=np.int32).reshape(-1, 3)
+
+    def spread_labels(self, gray):
+        """Return the orientation bits of the frame spread over T x T, and the exact ones."""
+        _, labels = self.quantize(gray)
+        height, width = labels.shape
+        # The T x T OR is separable: first along the rows, then along the columns
+        rows = labels.copy()
+        for dx in range(1, self.spread):
+            np.bitwise_or(rows[:, :width - dx], labels[:, dx:], out=rows[:, :width - dx])
+        spread = rows.copy()
+        for dy in range(1, self.spread):
+            np.bitwise_or(spread[:height - dy], rows[dy:], out=spread[:height - dy])
+        return spread, labels
+
+    def coarse_scores(self, spread):
+        """Sum the linearized responses of all features on the grid of step T."""
+        t = self.spread
+        height, width = spread.shape
+        h, w = self.template_gray.shape
+        rows, cols = (height - h) // t + 1, (width - w) // t + 1
+        if rows <= 0 or cols <= 0:
+            return np.zeros((0, 0), dtype=np.uint16)
+        # Linear memories: the response of orientation o at offset (r, c) of every T x T cell,
+        # only the grid positions are looked up
+        linear = {}
+        scores = np.zeros((rows, cols), dtype=np.uint16)
+        for x, y, orientation in self.features:
+            key = (orientation, y % t, x % t)
+            if key not in linear:
+                linear[key] = cv2.LUT(np.ascontiguousarray(spread[y % t::t, x % t::t]), self.luts[orientation])
+            row, col = y // t, x // t
+            np.add(scores, linear[key][row:row + rows, col:col + cols], out=scores)
+        return scores
+
+    def window_scores(self, labels, x0, y0, x1, y1):
+        """Full resolution scores of the template placed at every position of [x0, x1) x [y0, y1)."""
+        h, w = self.template_gray.shape
+        window = labels[y0:y1 + h - 1, x0:x1 + w - 1]
+        responses = {}
+        scores = np.zeros((y1 - y0, x1 - x0), dtype=np.uint16)
+        for x, y, orientation in self.features:
+            if orientation not in responses:
+                responses[orientation] = cv2.LUT(window, self.luts[orientation])
+            np.add(scores, responses[orientation][y:y + y1 - y0, x:x + x1 - x0], out=scores)
+        return scores / float(self.max_score)
+
+    def match(self, target_gray):
+        """Return a list of (box, center, score, angle) of the template positions above the threshold."""
+        spread, labels = self.spread_labels(target_gray)
+        scores = self.coarse_scores(spread)
+        t = self.spread
+        h, w = self.template_gray.shape
+        height, width = target_gray.shape
+        rows, cols = np.nonzero(scores >= self.threshold * self.max_score)
+        # Keep the best grid hit per target, greedily by score, before the per pixel refinement
+        kept = []
+        for i in np.argsort(-scores[rows, cols], kind='stable'):
+            gx, gy = int(cols[i]) * t, int(rows[i]) * t
+            if all(abs(gx - kx) >= w or abs(gy - ky) >= h for kx, ky in kept):
+                kept.append((gx, gy))
+                if len(kept) == self.max_candidates:
+                    break
+        located = []
+        for gx, gy in kept:
+            # The spread score is flat around the target and the kept cell can be a neighbour of
+            # the one holding it, the exact orientations pick and accept the position
+            x0, y0 = max(gx - t, 0), max(gy - t, 0)
+            x1, y1 = min(gx + 2 * t, width - w + 1), min(gy + 2 * t, height - h + 1)
+            window = self.window_scores(labels, x0, y0, x1, y1)
+            dy, dx = np.unravel_index(np.argmax(window), window.shape)
+            score = float(window[dy, dx])
+            if score >= self.threshold:
+                x, y = x0 + int(dx), y0 + int(dy)
+                located.append(((x, y, x + w, y + h), (x + w // 2, y + h // 2), score, 0.0))
+        return located
+
+
+class CascadeMatcher:
+    """
+    TM_CCOEFF_NORMED response map, computed only where the template can match.
+
+    Every position goes through three stages, cheapest first:
+    1. Window statistics: the mean and variance of the window at every position, from
+       box sums of the frame and of its square (computed once per frame). Windows much
+       flatter or much more contrasted than the template (max_contrast times its standard
+       deviation), or whose mean is further than max_mean_diff from it, are rejected.
+    2. Sparse test: sparse_pixels template pixels spread over a regular grid estimate the
+       correlation of the surviving windows. Below threshold - margin they are rejected.
+    3. Full correlation: the exact normalized correlation of the remaining windows only.
+    The survivors get the response of the template backend, so its threshold keeps its
+    meaning, and the rejected positions get -1. Stage 2 runs on tiles of tile_size
+    positions, a tile without candidates costs nothing after stage 1.
+    """
+
+    def __init__(self, template_gray, threshold=0.9, sparse_pixels=32, margin=0.3, max_contrast=4.0,
+                 min_std=4.0, max_mean_diff=None, tile_size=256):
+        self.template_gray = template_gray
+        self.threshold = threshold
+        self.margin = margin
+        self.max_mean_diff = max_mean_diff  # None: the mean is free, like in the normalized correlation
+        self.tile_size = tile_size
+        template = template_gray.astype(np.float32)
+        self.template_mean = float(template.mean())
+        template_std = float(template.std())
+        self.template_std = template_std
+        self.template_centred = (template - self.template_mean).ravel()
+        if template_std < 1e-6:
+            raise ValueError("Template has no contrast to be matched")
+        self.min_var = max(min_std, template_std / max_contrast) ** 2
+        self.max_var = (template_std * max_contrast) ** 2
+        # Sparse pixels, weighted so that a perfect match scores 1 like the full correlation
+        h, w = template_gray.shape
+        indices = np.unique(np.linspace(0, h * w - 1, min(sparse_pixels, h * w)).astype(int))
+        self.offsets = [(int(index // w), int(index % w)) for index in indices]
+        values = template.ravel()[indices]
+        centred = values - values.mean()
+        sample_var = float((centred ** 2).mean())
+        self.weights = centred * template_std / (len(indices) * max(sample_var, 1e-6))
+        self.stats = {}
+        self.totals = dict.fromkeys(('positions', 'stage1_rejected', 'stage2_rejected', 'accepted'), 0)
+
+    def window_stats(self, target_gray):
+        """Return the mean and the variance of the window at every response position."""
+        h, w = self.template_gray.shape
+        rows, cols = target_gray.shape[0] - h + 1, target_gray.shape[1] - w + 1
+        # Box filters anchored at the top left corner are the window sums of the integral image
+        mean = cv2.boxFilter(target_gray, cv2.CV_32F, (w, h), anchor=(0, 0), borderType=cv2.BORDER_REPLICATE)[:rows, :cols]
+        var = cv2.sqrBoxFilter(target_gray, cv2.CV_32F, (w, h), anchor=(0, 0), borderType=cv2.BORDER_REPLICATE)[:rows, :cols]
+        var -= cv2.multiply(mean, mean)
+        return mean, var
+
+    def sparse_scores(self, target, x0, y0, x1, y1):
+        """Sparse covariance of the template with the windows at [x0, x1) x [y0, y1), times its std."""
+        scores = np.zeros((y1 - y0, x1 - x0), dtype=np.float32)
+        for (dy, dx), weight in zip(self.offsets, self.weights):
+            cv2.scaleAdd(target[y0 + dy:y1 + dy, x0 + dx:x1 + dx], float(weight), scores, dst=scores)
+        return scores
+
+    def correlate(self, target, ys, xs, stds, chunk=4096):
+        """Exact normalized correlation of the windows at the positions (ys, xs)."""
+        h, w = self.template_gray.shape
+        windows = np.lib.stride_tricks.sliding_window_view(target, (h, w))
+        scores = np.empty(len(ys), dtype=np.float32)
+        for start in range(0, len(ys), chunk):
+            end = start + chunk
+            patches = windows[ys[start:end], xs[start:end]].reshape(-1, h * w)
+            # The template is centred, so the mean of the window cancels out
+            covariance = patches @ self.template_centred / (h * w)
+            scores[start:end] = covariance / np.maximum(stds[start:end] * self.template_std, 1e-6)
+        return scores
+
+    def match(self, target_gray, out=None, target_out=None):
+        """
+        Return the response map of a rectified gray image, -1 at the rejected positions.
+        target_out is a float32 array of the image's shape for its float copy.
+        """
+        mean, var = self.window_stats(target_gray)
+        rows, cols = var.shape
+        if out is None or out.shape != var.shape:
+            out = np.empty(var.shape, dtype=np.float32)
+        out.fill(-1.0)
+        candidates = cv2.inRange(var, self.min_var, self.max_var)  # 255 where the contrast is plausible
+        if self.max_mean_diff is not None:
+            candidates &= cv2.inRange(mean, self.template_mean - self.max_mean_diff,
+                                      self.template_mean + self.max_mean_diff)
+        stage1 = cv2.countNonZero(candidates)
+        target = None
+        if stage1:
+            if target_out is not None and target_out.shape == target_gray.shape:
+                target = target_out
+                np.copyto(target, target_gray)
+            else:
+                target = target_gray.astype(np.float32)
+        sparse_threshold = self.threshold - self.margin
+        found_y, found_x = [], []
+        for y0 in range(0, rows, self.tile_size):
+            y1 = min(y0 + self.tile_size, rows)
+            for x0 in range(0, cols, self.tile_size):
+                x1 = min(x0 + self.tile_size, cols)
+                keep = candidates[y0:y1, x0:x1]
+                if not cv2.countNonZero(keep):
+                    continue
+                scores = self.sparse_scores(target, x0, y0, x1, y1)
+                keep[scores < sparse_threshold * cv2.sqrt(var[y0:y1, x0:x1])] = 0
+                ys, xs = np.nonzero(keep)
+                found_y.append(ys + y0)
+                found_x.append(xs + x0)
+        ys = np.concatenate(found_y) if found_y else np.empty(0, dtype=np.intp)
+        xs = np.concatenate(found_x) if found_x else np.empty(0, dtype=np.intp)
+        stage2 = len(ys)
+        if stage2:
+            out[ys, xs] = self.correlate(target, ys, xs, np.sqrt(np.maximum(var[ys, xs], 0)))
+        positions = rows * cols
+        self.stats = {'positions': positions, 'stage1_rejected': positions - stage1,
+                      'stage2_rejected': stage1 - stage2,
+                      'accepted': int(np.count_nonzero(out >= self.threshold))}
+        for key, value in self.stats.items():
+            self.totals[key] += value
+        return out
+
+    def rejection_rates(self, stats=None):
+        """Fraction of the positions reaching each stage that it rejected (the session totals by default)."""
+        stats = self.totals if stats is None else stats
+        reached1 = stats['positions']
+        reached2 = reached1 - stats['stage1_rejected']
+        reached3 = reached2 - stats['stage2_rejected']
+        return {'stage1': stats['stage1_rejected'] / reached1 if reached1 else 0.0,
+                'stage2': stats['stage2_rejected'] / reached2 if reached2 else 0.0,
+                'stage3': (reached3 - stats['accepted']) / reached3 if reached3 else 0.0}
+
+
+MATCHERS = {}  # Name -> Matcher subclass, filled by register_matcher
+
+
+def register_matcher(cls):
+    """Class decorator adding a Matcher to the registry under its name."""
+    MATCHERS[cls.name] = cls
+    return cls
+
+
+def create_matcher(name, **options):
+    """Create the registered matcher `name` with its options."""
+    if name not in MATCHERS:
+        raise ValueError(f"Unknown matching engine: {name} (available: {', '.join(sorted(MATCHERS))})")
+    return MATCHERS[name](**options)
+
+
+class Matcher:
+    """
+    Interface of the matching backends used by DetectProcessor.
+
+    prepare() runs once per detection session with the template of the parameter folder,
+    and may cache its work in that folder. match() runs for every frame on the rectified
+    gray ROI and returns a list of Detection in rectified pixels; the detector converts
+    the centres to millimetres and records the timings.
+    """
+    name = None
+    float_target = False  # match() needs FrameBuffers.gray_float, a float32 copy of the rectified ROI
+
+    def __init__(self, threshold=0.9):
+        self.threshold = threshold
+        self.template_gray = None
+
+    def prepare(self, template_gray, folder=None):
+        self.template_gray = template_gray
+
+    def match(self, target_gray, buffers=None):
+        raise NotImplementedError
+
+    def summary(self):
+        """Statistics of the session logged when it ends, empty when the backend has none."""
+        return {}
+
+    @staticmethod
+    def from_hits(hits):
+        """Detections from (box, center, score, angle) tuples."""
+        return [Detection(box, center, None, score, angle) for box, center, score, angle in hits]
+
+
+@register_matcher
+class TemplateBackend(Matcher):
+    """The reference: TM_CCOEFF_NORMED response map, threshold and non-max suppression."""
+    name = 'template'
+
+    def response(self, target_gray, out=None):
+        """Return the response map of the rectified gray image."""
+        return cv2.matchTemplate(target_gray, self.template_gray, cv2.TM_CCOEFF_NORMED, result=out)
+
+    def locate(self, res, mask_out=None):
+        """Threshold a response map and return one Detection per target."""
+        h, w = self.template_gray.shape
+        mask = np.greater_equal(res, self.threshold, out=mask_out)
+        loc = np.nonzero(mask) if mask.any() else ((), ())  # No index arrays when nothing is found
+        boxes = [[pt[0], pt[1], pt[0] + w, pt[1] + h] for pt in zip(*loc[::-1])]
+        boxes = non_max_suppression(boxes) #Reduce the overlap
+        detections = []
+        for (x1, y1, x2, y2) in boxes:
+            center_x, center_y = (x1 + x2) // 2, (y1 + y2) // 2
+            detections.append(Detection((int(x1), int(y1), int(x2), int(y2)), (int(center_x), int(center_y)),
+                                        None, float(res[y1, x1])))
+        return detections
+
+    def match(self, target_gray, buffers=None):
+        res = self.response(target_gray, None if buffers is None else buffers.response)
+        return self.locate(res, None if buffers is None else buffers.mask)
+
+
+@register_matcher
+class IncrementalBackend(TemplateBackend):
+    """The reference, with the response map only recomputed in the tiles that changed."""
+    name = 'incremental'
+
+    def __init__(self, threshold=0.9, **options):
+        super().__init__(threshold)
+        self.options = options
+        self.engine = None
+
+    def prepare(self, template_gray, folder=None):
+        super().prepare(template_gray, folder)
+        self.engine = IncrementalMatcher(template_gray, **self.options)
+
+    def response(self, target_gray, out=None):
+        return self.engine.match(target_gray)
+
+
+@register_matcher
+class FeatureBackend(Matcher):
+    """ORB features, located with RANSAC. The template features are cached in the parameter folder."""
+    name = 'orb'
+
+    def __init__(self, threshold=0.9, **options):
+        super().__init__(threshold)
+        self.options = options
+        self.engine = None
+
+    def prepare(self, template_gray, folder=None):
+        super().prepare(template_gray, folder)
+        cache_path = None if folder is None else f"{folder}/template_features_{self.name}.npz"
+        self.engine = FeatureMatcher(template_gray, self.name, cache_path=cache_path, **self.options)
+
+    def match(self, target_gray, buffers=None):
+        return self.from_hits(self.engine.match(target_gray))
+
+
+@register_matcher
+class AkazeBackend(FeatureBackend):
+    name = 'akaze'
+
+
+@register_matcher
+class GradientBackend(Matcher):
+    """Quantized gradient orientations, robust to the lighting."""
+    name = 'gradient'
+
+    def __init__(self, threshold=0.9, **options):
+        super().__init__(threshold)
+        self.options = options
+        self.engine = None
+
+    def prepare(self, template_gray, folder=None):
+        super().prepare(template_gray, folder)
+        self.engine = GradientMatcher(template_gray, self.threshold, **self.options)
+
+    def match(self, target_gray, buffers=None):
+        return self.from_hits(self.engine.match(target_gray))
+
+
+@register_matcher
+class CascadeBackend(TemplateBackend):
+    """The reference response, only computed at the positions that pass the cheaper tests."""
+    name = 'cascade'
+    float_target = True
+
+    def __init__(self, threshold=0.9, **options):
+        super().__init__(threshold)
+        self.options = options
+        self.engine = None
+
+    def prepare(self, template_gray, folder=None):
+        super().prepare(template_gray, folder)
+        self.engine = CascadeMatcher(template_gray, self.threshold, **self.options)
+
+    def response(self, target_gray, out=None, target_out=None):
+        return self.engine.match(target_gray, out, target_out)
+
+    def match(self, target_gray, buffers=None):
+        if buffers is None:
+            return self.locate(self.response(target_gray))
+        return self.locate(self.response(target_gray, buffers.response, buffers.gray_float), buffers.mask)
+
+    def summary(self):
+        return {f"{stage}_rejected": round(rate, 4) for stage, rate in self.engine.rejection_rates().items()}
+
+
+def planted_targets(gray, template_gray, count=3):
+    """Yield (image, expected centre) with the template pasted at one of `count` places of the rectified frame."""
+    h, w = template_gray.shape
+    height, width = gray.shape
+    for i in range(count):
+        x = (i + 1) * (width - w) // (count + 1)
+        y = (i + 1) * (height - h) // (count + 1)
+        image = gray.copy()
+        image[y:y + h, x:x + w] = template_gray
+        yield image, (x + w // 2, y + h // 2)
+
+
+def check_detections(detections, shape):
+    """Return the problems of a match() output with the common result type, used by the conformance test."""
+    problems = []
+    if not isinstance(detections, list):
+        return [f"match() returned {type(detections).__name__}, not a list"]
+    for detection in detections:
+        if not isinstance(detection, Detection):
+            problems.append(f"{type(detection).__name__} is not a Detection")
+            continue
+        x1, y1, x2, y2 = detection.box
+        cx, cy = detection.center_px
+        if not (x1 <= cx <= x2 and y1 <= cy <= y2):
+            problems.append(f"centre {detection.center_px} outside its box {detection.box}")
+        if not (0 <= cx < shape[1] and 0 <= cy < shape[0]):
+            problems.append(f"centre {detection.center_px} outside the ROI")
+        if detection.score is not None and not 0.0 <= detection.score <= 1.0 + 1e-6:
+            problems.append(f"score {detection.score} outside [0, 1]")
+        if not isinstance(detection.angle, float):
+            problems.append(f"angle {detection.angle!r} is not a float")
+    return problems
@@ -0,0 +1,144 @@
+# memory_helper.py
+import contextlib
+import gc
+import os
+import resource
+import threading
+import time
+import tracemalloc
+
+
+def rss_bytes():
+    """Resident set size of the process in bytes."""
+    try:
+        with open('/proc/self/statm', 'r') as file:
+            return int(file.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024  # Peak only, in KiB on Linux
+
+
+class MemoryMonitor:
+    """
+    Memory report and memory cap of a detection session.
+
+    A background thread samples the RSS every `interval` seconds and raises over_cap
+    while it is above cap_mb. The cap is soft and advisory: going over it is logged and
+    only the event queue is shed. The RSS is dominated by the camera frames, the frame
+    sized buffers and OpenCV, which the loop needs and cannot give back, so the cap is
+    no hard limit; use a cgroup (e.g. systemd MemoryMax=) for one. With trace=True the Python/numpy allocations are also
+    traced (tracemalloc) and stage(name) records the peak growth of each stage of the
+    loop, e.g. a frame sized array allocated and freed inside the stage.
+    """
+
+    def __init__(self, cap_mb=None, trace=False, interval=0.2):
+        self.cap = None if cap_mb is None else int(cap_mb * 1e6)
+        self.trace = trace
+        self.interval = interval
+        self.over_cap = False
+        self.cap_hits = 0  # Times the RSS went above the cap
+        self.reported_hits = 0
+        self.start_rss = 0
+        self.peak_rss = 0
+        self.rss_total = 0
+        self.rss_samples = 0
+        self.stages = {}  # Stage name -> (peak growth in bytes, calls)
+        self.thread = None
+        self.running = False
+
+    def start(self):
+        self.start_rss = self.peak_rss = rss_bytes()
+        if self.trace:
+            tracemalloc.start()
+        self.running = True
+        self.thread = threading.Thread(target=self._sample, name='MemoryMonitor', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        if self.trace:
+            tracemalloc.stop()
+
+    def _sample(self):
+        while self.running:
+            rss = rss_bytes()
+            self.peak_rss = max(self.peak_rss, rss)
+            self.rss_total += rss
+            self.rss_samples += 1
+            over = self.cap is not None and rss > self.cap
+            if over and not self.over_cap:
+                self.cap_hits += 1
+            self.over_cap = over
+            time.sleep(self.interval)
+
+    @property
+    def active(self):
+        return self.thread is not None
+
+    def poll(self):
+        """Return True once each time the RSS went above the cap, for the loop to react."""
+        if self.cap_hits != self.reported_hits:
+            self.reported_hits = self.cap_hits
+            return True
+        return False
+
+    def start_session(self, logger):
+        """Start monitoring a detection session when a cap or a report is asked for."""
+        if self.cap is not None or self.trace:
+            self.start()
+            logger.info("memory_monitor", cap_mb=None if self.cap is None else self.cap / 1e6, trace=self.trace)
+
+    def check(self, logger):
+        """Once per frame: when the RSS went above the cap, log it and shed the event queue."""
+        if self.poll():
+            logger.warning("memory_cap_hit", cap_mb=self.cap / 1e6, rss_mb=round(self.peak_rss / 1e6, 1),
+                           action="frame_events_off", soft_limit=True)
+            logger.frame_events = False  # Per-frame records are the only queue that grows with the frame rate
+            gc.collect()
+
+    def finish_session(self, logger, file_path):
+        """Stop monitoring and write the report."""
+        if not self.active:
+            return
+        self.stop()
+        self.write(file_path)
+        logger.info("memory", peak_rss_mb=round(self.peak_rss / 1e6, 1), cap_hits=self.cap_hits)
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """Record the peak memory growth of the enclosed code, when tracing."""
+        if not self.trace:
+            yield
+            return
+        before = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        try:
+            yield
+        finally:
+            grown = tracemalloc.get_traced_memory()[1] - before
+            peak, calls = self.stages.get(name, (0, 0))
+            self.stages[name] = (max(peak, grown), calls + 1)
+
+    def queue_depth(self, default, item_bytes, fraction=0.05):
+        """Depth of a queue of item_bytes items that uses at most `fraction` of the cap."""
+        if self.cap is None:
+            return default
+        return max(1, min(default, int(self.cap * fraction / item_bytes)))
+
+    def report(self):
+        """Return the RSS summary and the per-stage peaks as text."""
+        lines = [f"RSS start {self.start_rss / 1e6:.1f} MB, peak {self.peak_rss / 1e6:.1f} MB"
+                 + (f", mean {self.rss_total / self.rss_samples / 1e6:.1f} MB" if self.rss_samples else "")]
+        if self.cap is not None:
+            lines.append(f"Cap {self.cap / 1e6:.0f} MB, exceeded {self.cap_hits} times")
+        if self.stages:
+            lines.append("stage\tpeak_MB\tcalls")
+            for name, (peak, calls) in self.stages.items():
+                lines.append(f"{name}\t{peak / 1e6:.2f}\t{calls}")
+        return "\n".join(lines) + "\n"
+
+    def write(self, file_path):
+        with open(file_path, 'w') as file:
+            file.write(self.report())
@@ -0,0 +1,289 @@
+# metrics_helper.py
+import os
+import threading
+import time
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)  # Seconds
+SCORE_BUCKETS = (0.5, 0.6, 0.7, 0.8, 0.85, 0.9, 0.925, 0.95, 0.975, 0.99, 1.0)
+
+
+class Counter:
+    """Value that only goes up, e.g. frames captured."""
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def samples(self, name, labels):
+        yield name, labels, self.value
+
+
+class Gauge:
+    """Value that goes up and down, e.g. the frame rate."""
+    def __init__(self):
+        self.value = 0.0
+
+    def set(self, value):
+        self.value = value
+
+    def samples(self, name, labels):
+        yield name, labels, self.value
+
+
+class Histogram:
+    """Counts of the observations per bucket (upper bounds), with their sum and count."""
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # The last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def samples(self, name, labels):
+        total = 0
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            total += count
+            yield f"{name}_bucket", labels + (('le', '+Inf' if bound == float('inf') else repr(bound)),), total
+        yield f"{name}_sum", labels, self.sum
+        yield f"{name}_count", labels, self.count
+
+
+class MetricFamily:
+    """A metric name with one series per combination of label values."""
+    def __init__(self, name, kind, help, label_names, factory):
+        self.name = name
+        self.kind = kind
+        self.help = help
+        self.label_names = tuple(label_names)
+        self.factory = factory
+        self.series = {}  # Label values -> Counter, Gauge or Histogram
+
+    def labels(self, *values):
+        """The series of these label values, created at the first call. Keep it to update it without a lookup."""
+        series = self.series.get(values)
+        if series is None:
+            series = self.series[values] = self.factory()
+        return series
+
+
+class MetricsRegistry:
+    """
+    Counters, gauges and histograms rendered in the Prometheus text exposition format.
+
+    The detection loop updates the series objects directly (an addition, or a bisect
+    for a histogram), without locks: every series is written by a single thread, and
+    a scrape reading a value while it changes only sees it one frame early or late.
+    """
+    def __init__(self):
+        self.families = {}
+
+    def _family(self, name, kind, help, label_names, factory):
+        family = self.families.get(name)
+        if family is None:
+            family = self.families[name] = MetricFamily(name, kind, help, label_names, factory)
+        elif family.kind != kind:
+            raise ValueError(f"Metric {name} is already registered as a {family.kind}")
+        return family
+
+    def counter(self, name, help, label_names=()):
+        return self._family(name, 'counter', help, label_names, Counter)
+
+    def gauge(self, name, help, label_names=()):
+        return self._family(name, 'gauge', help, label_names, Gauge)
+
+    def histogram(self, name, help, label_names=(), buckets=LATENCY_BUCKETS):
+        return self._family(name, 'histogram', help, label_names, lambda: Histogram(buckets))
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format (version 0.0.4)."""
+        lines = []
+        for family in list(self.families.values()):
+            lines.append(f"# HELP {family.name} {family.help}")
+            lines.append(f"# TYPE {family.name} {family.kind}")
+            for values, series in list(family.series.items()):
+                for name, labels, value in series.samples(family.name, tuple(zip(family.label_names, values))):
+                    label_text = ','.join(f'{key}="{escape(str(label))}"' for key, label in labels)
+                    lines.append(f"{name}{{{label_text}}} {value}" if label_text else f"{name} {value}")
+        return '\n'.join(lines) + '\n'
+
+
+def escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class LoopMetrics:
+    """
+    Metrics of a capture loop: frames captured and dropped, capture time and frame rate.
+
+    The dropped frames are the sensor frames the loop never got. They are counted from the
+    Picamera2 metadata: the gap between the SensorTimestamp of consecutive captures in
+    units of their FrameDuration, minus one. Frames without a frame duration (replayed
+    images) fall back to gaps in the frame sequence, e.g. the ring frames a detector
+    process skipped.
+    """
+    def __init__(self, registry):
+        self.captured = registry.counter('detect_frames_captured_total', "Frames captured").labels()
+        self.dropped = registry.counter('detect_frames_dropped_total',
+                                        "Sensor frames between two captures that were never processed").labels()
+        self.capture_seconds = registry.histogram('detect_capture_seconds', "Time to capture a frame").labels()
+        self.fps = registry.gauge('detect_fps', "Frames captured per second (moving average)").labels()
+        self.last_time = None
+        self.last_sequence = None
+        self.last_timestamp = None
+        self.interval = None
+
+    def frame_captured(self, seconds, frame=None):
+        """Count a captured frame that took seconds to capture. frame is its FrameInfo."""
+        self.captured.inc()
+        self.capture_seconds.observe(seconds)
+        if frame is not None:
+            if frame.frame_duration > 0 and self.last_timestamp is not None:
+                missed = round((frame.sensor_timestamp - self.last_timestamp) / (frame.frame_duration * 1000)) - 1
+                if missed > 0:
+                    self.dropped.inc(missed)
+            elif frame.frame_duration <= 0 and self.last_sequence is not None and frame.sequence > self.last_sequence + 1:
+                self.dropped.inc(frame.sequence - self.last_sequence - 1)
+            self.last_sequence = frame.sequence
+            self.last_timestamp = frame.sensor_timestamp
+        now = time.monotonic()
+        if self.last_time is not None:
+            interval = now - self.last_time
+            self.interval = interval if self.interval is None else 0.9 * self.interval + 0.1 * interval
+            self.fps.set(round(1 / self.interval, 2) if self.interval > 0 else 0.0)
+        self.last_time = now
+
+
+class DetectionMetrics:
+    """Metrics of the detections of one ROI, labelled with its name."""
+    def __init__(self, registry, roi):
+        processed = registry.counter('detect_frames_processed_total', "Frames processed, including the cached ones",
+                                     ('roi',))
+        self.processed = processed.labels(roi)
+        self.cached = registry.counter('detect_frames_cached_total', "Frames answered by the motion gate",
+                                       ('roi',)).labels(roi)
+        self.dropped = registry.counter('detect_frames_overwritten_total',
+                                        "Frames overwritten in the shared ring before their result was out",
+                                        ('roi',)).labels(roi)
+        self.detections = registry.counter('detect_detections_total', "Targets found", ('roi',)).labels(roi)
+        self.not_found = registry.counter('detect_not_found_total', "Processed frames without a target",
+                                          ('roi',)).labels(roi)
+        self.scores = registry.histogram('detect_score', "Matching scores of the detections", ('roi',),
+                                         SCORE_BUCKETS).labels(roi)
+        stages = registry.histogram('detect_stage_seconds', "Time of a stage of the detection loop",
+                                    ('roi', 'stage'))
+        self.detect_seconds = stages.labels(roi, 'detect')
+        self.publish_seconds = stages.labels(roi, 'publish')
+        self.latency = registry.histogram('detect_latency_seconds', "Middle of the exposure to result published",
+                                          ('roi',)).labels(roi)
+
+    def record(self, result, detect_seconds, publish_seconds):
+        """Count a published result. detect_seconds is None for a cached result."""
+        self.processed.inc()
+        if result.cached:
+            self.cached.inc()
+        else:
+            self.detect_seconds.observe(detect_seconds)
+            if not result.found:
+                self.not_found.inc()
+            self.detections.inc(len(result.detections))
+            for detection in result.detections:
+                if detection.score is not None:
+                    self.scores.observe(detection.score)
+        self.publish_seconds.observe(publish_seconds)
+        if result.latency_ms is not None:
+            self.latency.observe(result.latency_ms / 1000)
+
+
+class MetricsExporter:
+    """
+    Exposes a MetricsRegistry on http://localhost:<port>/metrics (a Prometheus scrape
+    target), or writes it every interval seconds to a file, replaced atomically (for the
+    node_exporter textfile collector, or to read with cat).
+    """
+    def __init__(self, registry, port=None, path=None, interval=10.0, host='127.0.0.1'):
+        self.registry = registry
+        self.port = port
+        self.path = path
+        self.interval = interval
+        self.host = host
+        self.server = None
+        self.thread = None
+        self.stopped = threading.Event()
+
+    @classmethod
+    def from_spec(cls, registry, spec):
+        """A port number serves the metrics over HTTP, anything else is the path of the file."""
+        spec = str(spec)
+        return cls(registry, port=int(spec)) if spec.isdigit() else cls(registry, path=spec)
+
+    @property
+    def target(self):
+        return f"http://localhost:{self.port}/metrics" if self.path is None else self.path
+
+    def start(self):
+        if self.thread is not None:
+            return
+        self.stopped.clear()
+        if self.path is None:
+            registry = self.registry
+
+            class Handler(MetricsHandler):
+                metrics_registry = registry
+
+            self.server = ThreadingHTTPServer((self.host, self.port), Handler)
+            self.server.daemon_threads = True
+            self.port = self.server.server_address[1]  # The bound port when 0 was asked for
+            self.thread = threading.Thread(target=self.server.serve_forever, name='MetricsHTTP', daemon=True)
+        else:
+            self.thread = threading.Thread(target=self._write_periodically, name='MetricsWriter', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """Stop serving, or write the file a last time."""
+        if self.thread is None:
+            return
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+        self.stopped.set()
+        self.thread.join()
+        self.thread = None
+
+    def write(self):
+        temporary = f"{self.path}.tmp"
+        with open(temporary, 'w') as file:
+            file.write(self.registry.render())
+        os.replace(temporary, self.path)
+
+    def _write_periodically(self):
+        while not self.stopped.wait(self.interval):
+            self.write()
+        self.write()
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    """GET /metrics of the MetricsExporter."""
+    metrics_registry = None
+
+    def log_message(self, format, *args):
+        pass  # No access log on the terminal of the detection
+
+    def do_GET(self):
+        if self.path != '/metrics':
+            self.send_error(404)
+            return
+        body = self.metrics_registry.render().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
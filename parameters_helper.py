@@ -45,7 +45,7 @@ class parameter_adjusting:
         with open(file_path, 'r') as file:
             for i, line in enumerate(file, 1):
                 if i <= 4:
-                    x, y = map(int, line.strip().split(','))
+                    x, y = map(float, line.strip().split(','))  # Sub-pixel when located from the markers
                     self.points.append((x, y)) # boundary points of the ROI in the original photo
                 elif i == 5:
                     self.shape = list(map(int, line.strip().split(','))) # shape of the calilbrated photo 
@@ -176,6 +176,23 @@ class parameter_adjusting:
             cv2.destroyAllWindows()
 
 
+    def locate_corners(self, camera):
+        """
+        Locate the corners from the ArUco markers at the workspace corners, instead of
+        selecting them by hand.
+        """
+        from fiducial_helper import calibrate_roi  # Needs the aruco module, only for this option
+        self.frame = self.capture_image(camera)
+        corners = calibrate_roi(self.frame, self.parameters_folder)
+        if corners is None:
+            print("The four corner markers were not all found, check that they are visible.")
+            return
+        self.load_points_from_file(f'{self.parameters_folder}/points.txt')
+        dst = self.imgcorr()
+        cv2.imwrite(f'{self.parameters_folder}/output.jpg', dst)
+        for i, point in enumerate(self.points):
+            print(f"Point {i+1}: ({point[0]:.2f}, {point[1]:.2f})")
+
     def capture_template(self, camera):
         """
         Capture an image and allow the user to select a template region.
@@ -220,7 +237,8 @@ class parameter_adjusting:
         try:
             while not end:
                 # Ask user for the instruction
-                mode = input("(1) Adjust real size (2) Adjust corners (3) Capture the template (0) Exit): ")
+                mode = input("(1) Adjust real size (2) Adjust corners (3) Capture the template "
+                             "(4) Locate the corners from the markers (0) Exit): ")
                 if mode == '0':
                     end = True
                 elif mode == '1':
@@ -234,6 +252,9 @@ class parameter_adjusting:
                 elif mode == '3':
                     # To get the target logo the sysytem is going to locate 
                     self.capture_template(camera)
+                elif mode == '4':
+                    # The ArUco markers at the workspace corners give the boundary without clicking
+                    self.locate_corners(camera)
                 else:
                     print("Invalid input. Please enter 1 to adjust corners, 2 to adjust real size, or 0 to exit.")
         except KeyboardInterrupt:
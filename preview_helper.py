@@ -0,0 +1,166 @@
+# preview_helper.py
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import cv2
+
+
+BOUNDARY = b'frame'
+
+
+class PreviewServer:
+    """
+    Live preview of the annotated frames as MJPEG over HTTP, instead of cv2.imshow over X11.
+
+    The server listens on localhost only; from another machine use an SSH tunnel, e.g.
+    ssh -L 8080:localhost:8080 pi@<address>, then open http://localhost:8080 in a browser.
+    Every ROI is a stream at /stream/<name>.mjpg, the page at / shows all of them.
+
+    The detection loop calls offer() for every annotated frame. While no client is
+    connected it returns at once (and the detector does not even draw, see watching).
+    Otherwise at most max_fps frames per second and stream are copied, and a background
+    thread scales them down to width pixels and encodes them as JPEG.
+    """
+    def __init__(self, port=8080, host='127.0.0.1', max_fps=5.0, width=640, quality=70):
+        self.port = port
+        self.host = host
+        self.interval = 1.0 / max_fps
+        self.width = width
+        self.quality = quality
+        self.clients = 0  # Open stream connections
+        self.pending = {}  # Name -> frame waiting for the encoder
+        self.jpegs = {}  # Name -> (version, JPEG bytes) of the newest encoded frame
+        self.last_offer = {}  # Name -> time of the last frame taken
+        self.condition = threading.Condition()
+        self.running = False
+        self.server = None
+        self.threads = []
+
+    @property
+    def watching(self):
+        """True while at least one client is connected to a stream."""
+        return self.clients > 0
+
+    def start(self):
+        """Bind the port and start the HTTP and encoder threads."""
+        if self.server is not None:
+            return
+        preview = self
+
+        class Handler(PreviewHandler):
+            server_preview = preview
+
+        self.server = ThreadingHTTPServer((self.host, self.port), Handler)
+        self.server.daemon_threads = True
+        self.port = self.server.server_address[1]  # The bound port when 0 was asked for
+        self.running = True
+        self.threads = [threading.Thread(target=self.server.serve_forever, name='PreviewHTTP', daemon=True),
+                        threading.Thread(target=self._encode, name='PreviewEncoder', daemon=True)]
+        for thread in self.threads:
+            thread.start()
+
+    def stop(self):
+        """Close the connections and stop the threads."""
+        if self.server is None:
+            return
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+        self.server.shutdown()
+        self.server.server_close()
+        for thread in self.threads:
+            thread.join()
+        self.server = None
+        self.threads = []
+
+    def offer(self, name, image):
+        """Take a copy of an annotated frame when a client watches and the frame rate cap allows it."""
+        if not self.clients:
+            return False
+        now = time.monotonic()
+        if now - self.last_offer.get(name, 0.0) < self.interval:
+            return False
+        self.last_offer[name] = now
+        with self.condition:
+            self.pending[name] = image.copy()  # The display buffer is overwritten by the next frame
+            self.condition.notify_all()
+        return True
+
+    def _encode(self):
+        """Scale down and encode the pending frames."""
+        while True:
+            with self.condition:
+                while self.running and not self.pending:
+                    self.condition.wait()
+                if not self.running:
+                    return
+                pending, self.pending = self.pending, {}
+            for name, image in pending.items():
+                height, width = image.shape[:2]
+                if width > self.width:
+                    image = cv2.resize(image, (self.width, round(height * self.width / width)),
+                                       interpolation=cv2.INTER_AREA)
+                ok, jpeg = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, self.quality])
+                if not ok:
+                    continue
+                with self.condition:
+                    version = self.jpegs.get(name, (0, None))[0] + 1
+                    self.jpegs[name] = (version, jpeg.tobytes())
+                    self.condition.notify_all()
+
+    def next_jpeg(self, name, version, timeout=1.0):
+        """Wait for a frame of the stream newer than version. Return (version, bytes), or None when stopped."""
+        with self.condition:
+            while self.running and self.jpegs.get(name, (0, None))[0] <= version:
+                self.condition.wait(timeout)
+            return self.jpegs[name] if self.running else None
+
+    def page(self):
+        """HTML page showing every stream."""
+        names = sorted(set(self.jpegs) | set(self.last_offer)) or ['detection']
+        images = ''.join(f'<h3>{name}</h3><img src="/stream/{name}.mjpg">' for name in names)
+        return f'<html><head><title>Detection preview</title></head><body>{images}</body></html>'.encode()
+
+
+class PreviewHandler(BaseHTTPRequestHandler):
+    """Requests of the PreviewServer: the page at / and one MJPEG stream per ROI."""
+    server_preview = None
+
+    def log_message(self, format, *args):
+        pass  # No access log on the terminal of the detection
+
+    def do_GET(self):
+        preview = self.server_preview
+        if self.path in ('/', '/index.html'):
+            body = preview.page()
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/html')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+        if not (self.path.startswith('/stream/') and self.path.endswith('.mjpg')):
+            self.send_error(404)
+            return
+        name = self.path[len('/stream/'):-len('.mjpg')]
+        self.send_response(200)
+        self.send_header('Content-Type', f'multipart/x-mixed-replace; boundary={BOUNDARY.decode()}')
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+        with preview.condition:
+            preview.clients += 1
+        try:
+            version = 0
+            while True:
+                frame = preview.next_jpeg(name, version)
+                if frame is None:
+                    return
+                version, jpeg = frame
+                self.wfile.write(b'--' + BOUNDARY + b'\r\nContent-Type: image/jpeg\r\n'
+                                 + f'Content-Length: {len(jpeg)}\r\n\r\n'.encode() + jpeg + b'\r\n')
+                self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # The client closed the page
+        finally:
+            with preview.condition:
+                preview.clients -= 1
@@ -0,0 +1,118 @@
+# profile_helper.py
+import cProfile
+import os
+import pstats
+import sys
+import threading
+import time
+
+
+PROFILERS = ('sampling', 'cprofile')
+
+
+class SessionProfiler:
+    """
+    Profiles a detection session and writes its results when the session ends.
+
+    Both kinds sample the stacks of the threads every `interval` seconds and write them
+    as collapsed stacks (`thread;outer;...;inner count` per line, the input of
+    flamegraph.pl or speedscope) to <prefix>.collapsed.
+    - 'sampling' adds <prefix>_functions.tsv: samples per function, self and total,
+      sorted by self time. The overhead is a few percent.
+    - 'cprofile' also runs the deterministic cProfile on the detection thread and
+      writes <prefix>.pstats (sortable with `python -m pstats`). Every Python call is
+      timed, so the session runs noticeably slower.
+    """
+
+    def __init__(self, kind, prefix, interval=0.005, ignore=('EventLogger',)):
+        if kind not in PROFILERS:
+            raise ValueError(f"Unknown profiler: {kind}")
+        self.kind = kind
+        self.prefix = prefix  # Path and name of the output files, without extension
+        self.interval = interval
+        self.ignore = ignore  # Names of service threads that mostly wait, left out of the samples
+        self.stacks = {}  # Collapsed stack -> number of samples
+        self.samples = 0
+        self.profile = None
+        self.thread = None
+        self.running = False
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self._sample, name='SessionProfiler', daemon=True)
+        self.thread.start()
+        if self.kind == 'cprofile':
+            self.profile = cProfile.Profile()
+            self.profile.enable()
+
+    def stop(self):
+        """Stop profiling and write the output files. Return their paths."""
+        if self.profile is not None:
+            self.profile.disable()
+        self.running = False
+        self.thread.join()
+        paths = [self.write_collapsed(f"{self.prefix}.collapsed")]
+        if self.profile is not None:
+            self.profile.dump_stats(f"{self.prefix}.pstats")
+            paths.append(f"{self.prefix}.pstats")
+        else:
+            paths.append(self.write_functions(f"{self.prefix}_functions.tsv"))
+        return paths
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+
+    @staticmethod
+    def frame_name(frame):
+        code = frame.f_code
+        return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+    def _sample(self):
+        """Sampler thread: record the stack of every other thread."""
+        own = threading.get_ident()
+        names = {}
+        while self.running:
+            for thread in threading.enumerate():
+                names[thread.ident] = thread.name
+            for ident, frame in sys._current_frames().items():
+                if ident == own or names.get(ident) in self.ignore:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(self.frame_name(frame))
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                key = ';'.join(reversed(stack))
+                self.stacks[key] = self.stacks.get(key, 0) + 1
+            self.samples += 1
+            time.sleep(self.interval)
+
+    def write_collapsed(self, file_path):
+        with open(file_path, 'w') as file:
+            for stack, count in sorted(self.stacks.items()):
+                file.write(f"{stack} {count}\n")
+        return file_path
+
+    def write_functions(self, file_path):
+        """Samples per function: self (innermost frame) and total (anywhere on the stack)."""
+        own, total = {}, {}
+        for stack, count in self.stacks.items():
+            frames = stack.split(';')
+            own[frames[-1]] = own.get(frames[-1], 0) + count
+            for name in set(frames):
+                total[name] = total.get(name, 0) + count
+        with open(file_path, 'w') as file:
+            file.write(f"# {self.samples} samples every {self.interval * 1000:.1f} ms\n")
+            file.write("self\ttotal\tself_ms\tfunction\n")
+            for name in sorted(total, key=lambda key: (-own.get(key, 0), -total[key])):
+                file.write(f"{own.get(name, 0)}\t{total[name]}\t{own.get(name, 0) * self.interval * 1000:.0f}\t{name}\n")
+        return file_path
+
+
+def print_stats(file_path, sort='cumulative', limit=25):
+    """Print the top entries of a .pstats file."""
+    pstats.Stats(file_path).sort_stats(sort).print_stats(limit)
@@ -0,0 +1,100 @@
+# realtime_helper.py
+import ctypes
+import ctypes.util
+import gc
+import os
+import time
+
+
+MCL_CURRENT = 1  # mlockall flag from <sys/mman.h>
+
+
+class RealtimeMode:
+    """
+    Lower tail latency of a detection loop, at the cost of the other programs on the Pi.
+
+    While the loop runs:
+    - the cyclic garbage collector is off and the objects created by the setup are
+      frozen out of its reach. The young generation is collected every gc_interval
+      frames at checkpoint(), which the loop calls while it waits for the next frame.
+    - the preallocated buffers are written once, so their pages are mapped before
+      the first frame, and the memory of the process is locked (mlockall).
+    - the loop thread runs with the SCHED_FIFO real-time priority, or failing that a
+      lower nice value.
+    Without the privileges for a feature (root, CAP_SYS_NICE, CAP_IPC_LOCK or the
+    rtprio/memlock limits) it is skipped with a realtime_fallback warning.
+    """
+    def __init__(self, priority=50, nice=-10, gc_interval=100, lock_memory=True):
+        self.priority = priority
+        self.nice = nice
+        self.gc_interval = gc_interval
+        self.lock_memory = lock_memory
+        self.enabled = []  # Features in effect
+        self.frames = 0
+        self.collections = 0
+        self.max_collect_ms = 0.0
+        self.saved_policy = None
+        self.saved_nice = None
+
+    def enter(self, arrays, logger):
+        """Switch the calling thread to real-time mode. arrays are the buffers to pre-touch."""
+        for array in arrays:
+            if array is not None:
+                array.fill(0)
+        self.enabled = ['prefault']
+        gc.collect()
+        gc.freeze()
+        gc.disable()
+        self.enabled.append('gc_frozen')
+        if self.lock_memory:
+            libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+            if libc.mlockall(MCL_CURRENT) == 0:
+                self.enabled.append('mlockall')
+            else:
+                logger.warning("realtime_fallback", feature="mlockall", error=os.strerror(ctypes.get_errno()))
+        self.raise_priority(logger)
+        self.frames = 0
+        logger.info("realtime_mode", enabled=self.enabled)
+
+    def raise_priority(self, logger):
+        """SCHED_FIFO if permitted, else a lower nice value, else normal scheduling."""
+        try:
+            self.saved_policy = os.sched_getscheduler(0)
+            os.sched_setscheduler(0, os.SCHED_FIFO, os.sched_param(self.priority))
+            self.enabled.append(f'sched_fifo:{self.priority}')
+            return
+        except (PermissionError, AttributeError, OSError) as e:
+            self.saved_policy = None
+            logger.warning("realtime_fallback", feature="sched_fifo", error=str(e))
+        try:
+            self.saved_nice = os.getpriority(os.PRIO_PROCESS, 0)
+            os.setpriority(os.PRIO_PROCESS, 0, self.nice)
+            self.enabled.append(f'nice:{self.nice}')
+        except (PermissionError, AttributeError, OSError) as e:
+            self.saved_nice = None
+            logger.warning("realtime_fallback", feature="nice", error=str(e))
+
+    def checkpoint(self):
+        """Once per frame, after the result was published: collect the young objects every gc_interval frames."""
+        self.frames += 1
+        if self.frames % self.gc_interval == 0:
+            start = time.perf_counter()
+            gc.collect(0)
+            self.collections += 1
+            self.max_collect_ms = max(self.max_collect_ms, (time.perf_counter() - start) * 1000)
+
+    def exit(self, logger):
+        """Restore the normal mode, in reverse order."""
+        if self.saved_policy is not None:
+            os.sched_setscheduler(0, self.saved_policy, os.sched_param(0))
+            self.saved_policy = None
+        if self.saved_nice is not None:
+            os.setpriority(os.PRIO_PROCESS, 0, self.saved_nice)
+            self.saved_nice = None
+        if 'mlockall' in self.enabled:
+            ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True).munlockall()
+        gc.enable()
+        gc.unfreeze()
+        gc.collect()
+        logger.info("realtime_mode_ended", collections=self.collections, max_collect_ms=round(self.max_collect_ms, 2))
+        self.enabled = []
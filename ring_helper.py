@@ -0,0 +1,222 @@
+# ring_helper.py
+import signal
+import time
+from multiprocessing import shared_memory
+import numpy as np
+from latency_helper import FrameInfo
+from detect_helper import DetectProcessor
+from sink_helper import create_sink
+
+
+SLOT_FIELDS = [('seq', np.int64), ('number', np.int64), ('sensor_timestamp', np.int64),
+               ('exposure_time', np.int64), ('frame_duration', np.int64), ('capture_ns', np.int64)]
+
+
+class RingFrameInfo(FrameInfo):
+    """FrameInfo of a frame read from a FrameRing, which can tell whether its slot was reused since."""
+    def __init__(self, ring, slot, seq, number, sensor_timestamp, exposure_time, frame_duration, capture_ns):
+        super().__init__(number, sensor_timestamp, exposure_time, frame_duration, capture_ns)
+        self.ring = ring
+        self.slot = slot
+        self.seq = seq
+
+    def intact(self):
+        return self.ring.intact(self.slot, self.seq)
+
+
+class FrameRing:
+    """
+    Ring of preallocated frame slots in shared memory, written by one capture process
+    and read by any number of detector processes without locks or copies.
+
+    Each slot has a sequence counter used as a seqlock: the writer makes it odd before
+    filling the slot and even again once the frame and its metadata are complete, then
+    publishes the frame number as `latest`. A reader takes the newest slot as a NumPy
+    view straight on the shared memory and remembers the even counter. After processing,
+    intact() compares it again: a different value means the writer lapped the ring and
+    reused the slot meanwhile, so the result may mix two frames and is dropped. With
+    `slots` slots a reader has slots - 1 frame intervals to finish before that happens.
+    """
+
+    HEADER_BYTES = 64  # int64: slots, height, width, channels, latest frame number
+    ALIGN = 64
+
+    def __init__(self, shm, owner):
+        self.shm = shm
+        self.owner = owner  # The creator unlinks the shared memory
+        header = np.ndarray((8,), dtype=np.int64, buffer=shm.buf)
+        self.header = header
+        slots, height, width, channels = (int(value) for value in header[:4])
+        self.shape = (height, width, channels) if channels > 1 else (height, width)
+        self.slot_count = slots
+        table_offset = self.HEADER_BYTES
+        self.table = np.ndarray((slots,), dtype=SLOT_FIELDS, buffer=shm.buf, offset=table_offset)
+        data_offset = self.align(table_offset + self.table.nbytes)
+        self.frames = np.ndarray((slots,) + self.shape, dtype=np.uint8, buffer=shm.buf, offset=data_offset)
+        self.written = 0  # Frames published by this writer
+
+    @classmethod
+    def align(cls, offset):
+        return -(-offset // cls.ALIGN) * cls.ALIGN
+
+    @classmethod
+    def size(cls, shape, slots):
+        table = slots * np.dtype(SLOT_FIELDS).itemsize
+        return cls.align(cls.HEADER_BYTES + table) + slots * int(np.prod(shape))
+
+    @classmethod
+    def create(cls, name, shape, slots=4):
+        """Allocate the ring for frames of `shape` (height, width[, channels]) of uint8."""
+        shm = shared_memory.SharedMemory(name=name, create=True, size=cls.size(shape, slots))
+        header = np.ndarray((8,), dtype=np.int64, buffer=shm.buf)
+        header[:] = 0
+        header[:4] = (slots, shape[0], shape[1], shape[2] if len(shape) > 2 else 1)
+        header[4] = -1  # No frame yet
+        ring = cls(shm, owner=True)
+        ring.table[:] = 0
+        ring.table['number'] = -1
+        return ring
+
+    @classmethod
+    def attach(cls, name):
+        """Open a ring created by another process."""
+        # The detector processes are started by multiprocessing from the creator and share its
+        # resource tracker, so attaching does not get the segment unlinked when they exit
+        return cls(shared_memory.SharedMemory(name=name), owner=False)
+
+    @property
+    def latest(self):
+        """Number of the newest complete frame, -1 before the first one."""
+        return int(self.header[4])
+
+    def publish(self, camera):
+        """Capture the next frame of a camera straight into the next slot and publish it."""
+        number = self.written
+        slot = number % self.slot_count
+        entry = self.table[slot:slot + 1]
+        entry['seq'] += 1  # Odd: being written
+        camera.capture_into(self.frames[slot])
+        info = camera.frame_info
+        entry['number'] = number
+        if info is not None:
+            entry['sensor_timestamp'] = info.sensor_timestamp
+            entry['exposure_time'] = info.exposure_time
+            entry['frame_duration'] = info.frame_duration
+            entry['capture_ns'] = info.capture_ns
+        entry['seq'] += 1  # Even: complete
+        self.header[4] = number
+        self.written += 1
+        return number
+
+    def read(self, number):
+        """Return (view, RingFrameInfo) of a frame, or None if its slot no longer holds it."""
+        slot = number % self.slot_count
+        seq = int(self.table['seq'][slot])
+        if seq % 2:
+            return None
+        entry = self.table[slot].copy()
+        if int(self.table['seq'][slot]) != seq or entry['number'] != number:
+            return None
+        info = RingFrameInfo(self, slot, seq, number, int(entry['sensor_timestamp']), int(entry['exposure_time']),
+                             int(entry['frame_duration']), int(entry['capture_ns']))
+        return self.frames[slot], info
+
+    def wait(self, after, timeout=1.0, poll=0.0005):
+        """Return (view, info) of the newest frame with a number above `after`, None on timeout."""
+        deadline = time.monotonic() + timeout
+        while True:
+            number = self.latest
+            if number > after:
+                frame = self.read(number)
+                if frame is not None:
+                    return frame
+            elif time.monotonic() > deadline:
+                return None
+            time.sleep(poll)
+
+    def intact(self, slot, seq):
+        """True while a slot still holds the frame read with counter `seq`."""
+        return int(self.table['seq'][slot]) == seq
+
+    def close(self):
+        # The views must go before the mapping can be closed
+        self.header = self.table = self.frames = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+class RingCamera:
+    """
+    Camera of a detector process: the frames come from a FrameRing filled by the capture
+    process. capture_image returns the newest frame as a view on the shared memory, so
+    the detector works on the slot without copying it.
+    mode_name and mode are the camera mode of the capture process, e.g. with the 'crop'
+    offset of a crop mode, so the detector shifts its ROI corners and tags its outputs
+    with the camera mode name.
+    """
+    def __init__(self, name, mode_name='ring', mode=None, timeout=5.0):
+        self.ring = FrameRing.attach(name)
+        height, width = self.ring.shape[:2]
+        self.modes = {mode_name: dict(mode or {'framerate': 0}, size=(width, height))}
+        self.current_mode = 0
+        self.timeout = timeout
+        self.last_number = -1
+        self.frame_info = None
+        self.skipped = 0  # Frames published while this detector was busy
+
+    def capture_image(self):
+        """Wait for a frame newer than the last one read and return its view."""
+        frame = None
+        while frame is None:
+            frame = self.ring.wait(self.last_number, self.timeout)
+        image, self.frame_info = frame
+        if self.last_number >= 0:
+            self.skipped += self.frame_info.sequence - self.last_number - 1
+        self.last_number = self.frame_info.sequence
+        return image
+
+    def stop(self):
+        self.ring.close()
+
+
+def capture_to_ring(camera, ring, running=None):
+    """Capture loop of the capture process: publish frames until Ctrl+C or until running is cleared."""
+    try:
+        while running is None or running.is_set():
+            ring.publish(camera)
+    except KeyboardInterrupt:
+        pass
+    return ring.written
+
+
+def stop_detector(signum, frame):
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)  # Once, the reports are written in a finally block
+    raise KeyboardInterrupt
+
+
+def detect_from_ring(name, folder, options, sink_specs=(), mode_name='ring', mode=None):
+    """
+    Target of a detector process: run the detection of one parameter folder on the
+    frames of the ring `name`, captured in the camera mode mode_name (its config dict).
+    The sinks are created here, their files and threads cannot be handed over from the
+    capture process.
+    """
+    # Ctrl+C reaches the whole process group: the capture process alone handles it and
+    # stops the detectors with SIGTERM, which ends their session like a KeyboardInterrupt
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, stop_detector)
+    camera = RingCamera(name, mode_name, mode)
+    layout = options.get('cpu_layout')
+    if layout is not None:
+        layout.enter('output')  # The sink threads start on the output cores
+    sinks = [create_sink(spec) for spec in sink_specs]
+    detecter = DetectProcessor(**options)
+    detecter.sinks = sinks
+    try:
+        detecter.process_image(folder, camera)
+    finally:
+        print(f"{folder}: {camera.skipped} frames skipped while busy")
+        for sink in sinks:
+            sink.close()
+        camera.stop()
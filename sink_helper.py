@@ -0,0 +1,142 @@
+# sink_helper.py
+import time
+from log_helper import EventLogger
+from estimator_helper import PositionEstimator
+from trajectory_helper import TrajectoryWriter, MODE_DETECTED, MODE_CACHED, MODE_NOT_FOUND
+
+
+SINKS = {}  # Name -> sink class, filled by register_sink
+
+
+def register_sink(cls):
+    """Class decorator adding a sink to the registry under its name."""
+    SINKS[cls.name] = cls
+    return cls
+
+
+def create_sink(spec):
+    """Create a sink from 'name' or 'name:argument', e.g. 'console' or 'csv:positions.csv'."""
+    name, _, argument = spec.partition(':')
+    if name not in SINKS:
+        raise ValueError(f"Unknown sink: {name} (available: {', '.join(sorted(SINKS))})")
+    return SINKS[name](argument) if argument else SINKS[name]()
+
+
+class Sink:
+    """
+    Receives every processed frame: sink(roi, result) with the name of the parameter
+    folder and its DetectionResult. Called from the detection loop, so it must not block.
+    """
+    name = None
+
+    def __call__(self, roi, result):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+@register_sink
+class ConsoleSink(Sink):
+    """Positions printed by a background thread, one line per detection. Reused results have cached=True."""
+    name = 'console'
+
+    def __init__(self, json_path=None, console=True):
+        self.logger = EventLogger(json_path=json_path, console=console)
+        self.logger.start()
+
+    def __call__(self, roi, result):
+        for detection in result.detections:
+            self.logger.info("position", roi=roi, center_mm=detection.center_mm,
+                             score=None if detection.score is None else round(detection.score, 3),
+                             angle=round(detection.angle, 1), cached=result.cached,
+                             latency_ms=None if result.latency_ms is None else round(result.latency_ms, 2))
+
+    def close(self):
+        self.logger.stop()
+
+
+@register_sink
+class JsonLinesSink(ConsoleSink):
+    """Positions appended to a JSON lines file by a background thread."""
+    name = 'jsonl'
+
+    def __init__(self, path='positions.jsonl'):
+        super().__init__(json_path=path, console=False)
+
+
+@register_sink
+class CsvSink(Sink):
+    """Positions appended to a CSV file, one row per detection, including the cached frames."""
+    name = 'csv'
+
+    def __init__(self, path='positions.csv'):
+        self.file = open(path, 'a', buffering=1 << 16)
+        if self.file.tell() == 0:
+            self.file.write("time,roi,frame,x_mm,y_mm,score,angle,cached,latency_ms\n")
+
+    def __call__(self, roi, result):
+        sequence = '' if result.frame is None else result.frame.sequence
+        latency = '' if result.latency_ms is None else f"{result.latency_ms:.2f}"
+        for detection in result.detections:
+            x_mm, y_mm = detection.center_mm
+            score = '' if detection.score is None else f"{detection.score:.3f}"
+            self.file.write(f"{time.time():.3f},{roi},{sequence},{x_mm},{y_mm},{score},{detection.angle:.1f},"
+                            f"{int(result.cached)},{latency}\n")
+
+    def close(self):
+        self.file.close()
+
+
+@register_sink
+class PredictionSink(PositionEstimator, Sink):
+    """
+    Positions predicted rate_hz times per second between the frames (e.g. predict:500),
+    appended to a CSV file with their uncertainty by the estimator thread.
+    """
+    name = 'predict'
+
+    def __init__(self, rate_hz=500.0, path='predictions.csv'):
+        self.file = open(path, 'a', buffering=1 << 16)
+        if self.file.tell() == 0:
+            self.file.write("t_ns,roi,x_mm,y_mm,vx_mm_s,vy_mm_s,sigma_x_mm,sigma_y_mm,age_ms\n")
+        super().__init__(float(rate_hz), outputs=[self.write])
+        self.start()
+
+    def write(self, roi, prediction):
+        self.file.write(f"{prediction.t_ns},{roi},{prediction.x:.3f},{prediction.y:.3f},{prediction.vx:.1f},"
+                        f"{prediction.vy:.1f},{prediction.sigma_x:.3f},{prediction.sigma_y:.3f},"
+                        f"{prediction.age_ms:.1f}\n")
+
+    def close(self):
+        self.stop()
+        self.file.close()
+
+
+@register_sink
+class TrajectorySink(TrajectoryWriter, Sink):
+    """
+    Every frame of every ROI in the binary trajectory log (e.g. trajectory:job.traj), one
+    record per detection and one with NaN centres per frame without a target. Read it
+    back with read_trajectory or read_trajectories of trajectory_helper.py.
+    """
+    name = 'trajectory'
+
+    def __init__(self, path='trajectory.traj'):
+        super().__init__(path)
+        self.start()
+
+    def __call__(self, roi, result):
+        frame = result.frame
+        t_ns = time.monotonic_ns() if frame is None else frame.exposure_ns
+        sequence = -1 if frame is None else frame.sequence
+        if not result.detections:
+            nan = (float('nan'), float('nan'))
+            self.add(t_ns, sequence, nan, nan, float('nan'), MODE_NOT_FOUND, roi)
+        mode = MODE_CACHED if result.cached else MODE_DETECTED
+        for detection in result.detections:
+            self.add(t_ns, sequence, detection.center_px, detection.center_mm,
+                     float('nan') if detection.score is None else detection.score, mode, roi)
+
+    def close(self):
+        self.stop()
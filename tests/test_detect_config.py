@@ -0,0 +1,64 @@
+# tests/test_detect_config.py
+import json
+import pytest
+
+pytest.importorskip("cv2")
+pytest.importorskip("picamera2")
+import detect  # noqa: E402
+
+
+CONFIG = {
+    "mode": "medium_res",
+    "folder": ["printer_a", "printer_b"],
+    "matcher": "cascade",
+    "sink": ["csv:positions.csv", "console"],
+    "headless": True,
+    "profile": "sampling",
+    "memory-cap": 300.0,
+    "px-per-mm": 1.0,
+    "drift-check": 150,
+    "processes": True,
+    "cpu-layout": ["capture=0", "detect=1-3", "output=0", "threads=3"],
+    "realtime": True,
+    "preview": 8080,
+    "metrics": "9100",
+}
+DESTINATIONS = {"memory-cap": "memory_cap_mb", "px-per-mm": "px_per_mm", "drift-check": "drift_interval",
+                "cpu-layout": "cpu_layout"}
+
+
+def write_config(tmp_path, config):
+    path = tmp_path / "detect.json"
+    path.write_text(json.dumps(config))
+    return str(path)
+
+
+def test_every_config_option_round_trips(tmp_path):
+    args = detect.parse_args(["--config", write_config(tmp_path, CONFIG)])
+    for key, value in CONFIG.items():
+        assert getattr(args, DESTINATIONS.get(key, key)) == value, key
+
+
+def test_underscore_keys_are_accepted(tmp_path):
+    args = detect.parse_args(["--config", write_config(tmp_path, {"mode": "low_res", "folder": "a",
+                                                                  "memory_cap": 120, "drift_check": 30})])
+    assert args.memory_cap_mb == 120
+    assert args.drift_interval == 30
+    assert args.folder == ["a"]
+
+
+def test_command_line_overrides_the_config(tmp_path):
+    args = detect.parse_args(["--config", write_config(tmp_path, CONFIG), "--mode", "low_res", "--memory-cap", "50"])
+    assert args.mode == "low_res"
+    assert args.memory_cap_mb == 50
+
+
+def test_command_line_sinks_replace_the_config_sinks(tmp_path):
+    path = write_config(tmp_path, CONFIG)
+    assert detect.parse_args(["--config", path, "--sink", "jsonl:out.jsonl"]).sink == ["jsonl:out.jsonl"]
+    assert detect.parse_args(["--config", path]).sink == CONFIG["sink"]
+
+
+def test_unknown_config_key_is_an_error(tmp_path):
+    with pytest.raises(SystemExit):
+        detect.parse_args(["--config", write_config(tmp_path, dict(CONFIG, memory_kap=300))])
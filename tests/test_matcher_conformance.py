@@ -0,0 +1,57 @@
+# tests/test_matcher_conformance.py
+"""
+Every registered matcher on the stored rectified frames of the parameter folders, and on
+the same frames with the template planted at known places. A backend conforms when its
+results have the common type and it finds each planted target within TOLERANCE pixels,
+like the template reference.
+"""
+import os
+import pytest
+
+cv2 = pytest.importorskip("cv2")
+from matcher_helper import MATCHERS, create_matcher, planted_targets, check_detections  # noqa: E402
+
+
+FOLDERS = ["parameters_support/high_res_para", "parameters_support/medium_res"]
+THRESHOLD = 0.9  # DetectProcessor.threshold
+TOLERANCE = 3  # Allowed centre error in rectified pixels
+# Known limitations, (matcher, folder name) -> (exception raised, reason). Anything else
+# raised by prepare() or match() fails the test.
+SMALL_TEMPLATE = "feature matchers refuse templates smaller than FeatureMatcher.MIN_TEMPLATE_SIZE"
+EXPECTED_FAILURES = {
+    ('orb', 'high_res_para'): (ValueError, SMALL_TEMPLATE),
+    ('orb', 'medium_res'): (ValueError, SMALL_TEMPLATE),
+    ('akaze', 'high_res_para'): (ValueError, SMALL_TEMPLATE),
+    ('akaze', 'medium_res'): (ValueError, SMALL_TEMPLATE),
+}
+
+
+def cases():
+    for folder in FOLDERS:
+        for name in sorted(MATCHERS):
+            expected = EXPECTED_FAILURES.get((name, os.path.basename(folder)))
+            marks = [pytest.mark.xfail(raises=expected[0], reason=expected[1], strict=True)] if expected else []
+            yield pytest.param(name, folder, marks=marks, id=f"{name}-{os.path.basename(folder)}")
+
+
+def load_folder(folder):
+    """The rectified frame (output.jpg) and the template of a parameter folder, in gray."""
+    gray = cv2.imread(f"{folder}/output.jpg", cv2.IMREAD_GRAYSCALE)
+    template_gray = cv2.imread(f"{folder}/template.jpg", cv2.IMREAD_GRAYSCALE)
+    return gray, template_gray
+
+
+@pytest.mark.parametrize("name, folder", list(cases()))
+def test_matcher_conforms(name, folder, tmp_path):
+    gray, template_gray = load_folder(folder)
+    matcher = create_matcher(name, threshold=THRESHOLD)
+    matcher.prepare(template_gray, str(tmp_path))  # Caches go to a temporary folder
+    problems = check_detections(matcher.match(gray), gray.shape)
+    missed = []
+    for image, (x, y) in planted_targets(gray, template_gray):
+        found = matcher.match(image)
+        problems += check_detections(found, gray.shape)
+        if not any(abs(d.center_px[0] - x) <= TOLERANCE and abs(d.center_px[1] - y) <= TOLERANCE for d in found):
+            missed.append((x, y))
+    assert not problems, problems
+    assert not missed, f"planted targets missed at {missed}"
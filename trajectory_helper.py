@@ -0,0 +1,152 @@
+# trajectory_helper.py
+import glob
+import os
+import queue
+import threading
+import time
+import numpy as np
+
+
+MAGIC = b'TRAJLOG1'
+HEADER_BYTES = 64
+# Fixed-size record, 64 bytes. t_ns is the middle of the exposure (monotonic clock),
+# NaN centres and score mark a frame without a target.
+RECORD_DTYPE = np.dtype([('t_ns', '<i8'), ('sequence', '<i8'), ('x_px', '<f4'), ('y_px', '<f4'),
+                         ('x_mm', '<f4'), ('y_mm', '<f4'), ('score', '<f4'), ('mode', 'u1'), ('roi', 'S27')])
+HEADER_DTYPE = np.dtype([('magic', 'S8'), ('record_bytes', '<u4'), ('reserved', '<u4'),
+                         ('wall_offset_ns', '<i8'), ('padding', 'V40')])
+MODE_DETECTED = 0
+MODE_CACHED = 1  # Result reused by the motion gate
+MODE_NOT_FOUND = 2
+MODES = {MODE_DETECTED: 'detected', MODE_CACHED: 'cached', MODE_NOT_FOUND: 'not_found'}
+
+
+class TrajectoryWriter:
+    """
+    Append-only binary log of the positions, one RECORD_DTYPE record per detection.
+
+    add() only puts a tuple on a queue. A background thread converts the pending
+    records to one structured array per batch and appends it to a buffered file.
+    When a file would grow beyond max_bytes, it is closed and the log continues in
+    the next segment: <root>.0001<ext>, <root>.0002<ext>, ... next to path.
+    Every segment starts with a 64 byte header holding the record size and the
+    offset of the wall clock to the monotonic clock of the timestamps.
+    """
+    def __init__(self, path='trajectory.traj', max_bytes=256 * 1024 * 1024, flush_interval=0.5, max_queue=100000):
+        self.path = path
+        self.max_records = max(1, (max_bytes - HEADER_BYTES) // RECORD_DTYPE.itemsize)
+        self.flush_interval = flush_interval
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.dropped = 0  # Records discarded because the queue was full
+        self.written = 0
+        self.segment = 0
+        self.segment_records = 0
+        self.file = None
+        self.thread = None
+
+    def start(self):
+        if self.thread is not None:
+            return
+        self.thread = threading.Thread(target=self._run, name='TrajectoryWriter', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """Write the pending records and close the segment."""
+        if self.thread is None:
+            return
+        self.queue.put(None)
+        self.thread.join()
+        self.thread = None
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def add(self, t_ns, sequence, center_px, center_mm, score, mode, roi):
+        """Queue one record. Called from the detection loop."""
+        try:
+            self.queue.put_nowait((t_ns, sequence, center_px[0], center_px[1], center_mm[0], center_mm[1],
+                                   score, mode, roi.encode()[:RECORD_DTYPE['roi'].itemsize]))
+        except queue.Full:
+            self.dropped += 1
+
+    def segment_path(self, number):
+        root, extension = os.path.splitext(self.path)
+        return f"{root}.{number:04d}{extension}"
+
+    def _open_segment(self):
+        """Open the first segment number that does not exist yet and write its header."""
+        self.segment += 1
+        while os.path.exists(self.segment_path(self.segment)):
+            self.segment += 1
+        self.file = open(self.segment_path(self.segment), 'wb', buffering=1 << 20)
+        header = np.zeros(1, dtype=HEADER_DTYPE)
+        header['magic'] = MAGIC
+        header['record_bytes'] = RECORD_DTYPE.itemsize
+        header['wall_offset_ns'] = time.time_ns() - time.monotonic_ns()
+        self.file.write(header.tobytes())
+        self.segment_records = 0
+
+    def _write(self, rows):
+        records = np.array(rows, dtype=RECORD_DTYPE)
+        while len(records):
+            if self.file is None or self.segment_records >= self.max_records:
+                if self.file is not None:
+                    self.file.close()
+                self._open_segment()
+            count = min(len(records), self.max_records - self.segment_records)
+            self.file.write(records[:count].tobytes())
+            self.segment_records += count
+            self.written += count
+            records = records[count:]
+        self.file.flush()  # Readers see every batch
+
+    def _run(self):
+        while True:
+            try:
+                rows = [self.queue.get(timeout=self.flush_interval)]
+            except queue.Empty:
+                continue
+            while True:
+                try:
+                    rows.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            end = rows[-1] is None
+            rows = [row for row in rows if row is not None]
+            if rows:
+                self._write(rows)
+            if end:
+                return
+
+
+def read_trajectory(path):
+    """
+    Memory-map one segment. Return (records, wall_offset_ns): a read-only structured
+    array of RECORD_DTYPE backed by the file, nothing is read until it is accessed.
+    A record cut off by a crash at the end of the file is ignored.
+    """
+    header = np.fromfile(path, dtype=HEADER_DTYPE, count=1)
+    if len(header) == 0 or header['magic'][0] != MAGIC:
+        raise ValueError(f"{path} is not a trajectory log")
+    if header['record_bytes'][0] != RECORD_DTYPE.itemsize:
+        raise ValueError(f"{path} has {header['record_bytes'][0]} byte records, expected {RECORD_DTYPE.itemsize}")
+    count = (os.path.getsize(path) - HEADER_BYTES) // RECORD_DTYPE.itemsize
+    if count == 0:
+        return np.zeros(0, dtype=RECORD_DTYPE), int(header['wall_offset_ns'][0])
+    records = np.memmap(path, dtype=RECORD_DTYPE, mode='r', offset=HEADER_BYTES, shape=(count,))
+    return records, int(header['wall_offset_ns'][0])
+
+
+def trajectory_segments(path):
+    """The segment files of the log written to path, in order."""
+    root, extension = os.path.splitext(path)
+    return sorted(glob.glob(f"{glob.escape(root)}.[0-9][0-9][0-9][0-9]{extension}"))
+
+
+def read_trajectories(path, roi=None):
+    """All segments of a log as one array (copied), optionally only the records of one ROI."""
+    arrays = [read_trajectory(segment)[0] for segment in trajectory_segments(path)]
+    records = np.concatenate(arrays) if arrays else np.zeros(0, dtype=RECORD_DTYPE)
+    if roi is not None:
+        records = records[records['roi'] == roi.encode()]
+    return records